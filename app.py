@@ -1,10 +1,15 @@
-from flask import Flask, send_from_directory
+from flask import Flask
 import os
 from flask_swagger_ui import get_swaggerui_blueprint
 
 # Импортируем db из models
 from models.models import db
 from flask_migrate import Migrate
+from utils.like_buffer import like_write_behind
+from utils.sqlite_profile import configure_sqlite
+from utils.db_pool import configure_pool
+from utils.db_replicas import configure_replicas
+from utils.sharding import configure_shards
 
 migrate = Migrate()
 
@@ -19,20 +24,116 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = 'uploads'
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # Хранилище медиафайлов: local (папка UPLOAD_FOLDER) или s3 (нужен boto3).
+    # При s3 папка UPLOAD_FOLDER используется только для временных файлов
+    app.config['MEDIA_STORAGE'] = os.environ.get('MEDIA_STORAGE', 'local')
+    app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+    app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+    app.config['S3_REGION'] = os.environ.get('S3_REGION')
+    app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+    app.config['S3_PUBLIC_URL'] = os.environ.get('S3_PUBLIC_URL')
+    app.config['S3_URL_EXPIRES'] = int(os.environ.get('S3_URL_EXPIRES', '3600'))
+    app.config['S3_MULTIPART_THRESHOLD'] = int(os.environ.get('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+    app.config['DIRECT_UPLOAD_MAX_SIZE'] = int(os.environ.get('DIRECT_UPLOAD_MAX_SIZE', str(100 * 1024 * 1024)))
+    # Отдача медиафайлов через nginx: Flask выбирает файл и отвечает X-Accel-Redirect
+    app.config['UPLOADS_ACCEL_REDIRECT'] = os.environ.get('UPLOADS_ACCEL_REDIRECT', '0') == '1'
+    app.config['UPLOADS_ACCEL_PREFIX'] = os.environ.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+    # Докачиваемые загрузки: предельный размер файла и части, время жизни сессии
+    app.config['RESUMABLE_UPLOAD_MAX_SIZE'] = int(os.environ.get('RESUMABLE_UPLOAD_MAX_SIZE', str(100 * 1024 * 1024)))
+    app.config['RESUMABLE_CHUNK_MAX_SIZE'] = int(os.environ.get('RESUMABLE_CHUNK_MAX_SIZE', str(8 * 1024 * 1024)))
+    app.config['RESUMABLE_UPLOAD_TTL_SECONDS'] = int(os.environ.get('RESUMABLE_UPLOAD_TTL_SECONDS', str(24 * 60 * 60)))
+    # Бюджет пикселей (ширина * высота * кадры) для защиты от декомпрессионных бомб
+    app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', '50000000'))
+    # Максимальное количество вложений в одном твите
+    app.config['MAX_TWEET_MEDIA'] = int(os.environ.get('MAX_TWEET_MEDIA', '10'))
+    # Уменьшенные копии изображений: размеры по длинной стороне и число процессов пула
+    app.config['MEDIA_VARIANT_SIZES'] = tuple(
+        int(size) for size in os.environ.get('MEDIA_VARIANT_SIZES', '150,600,1200').split(','))
+    app.config['MEDIA_VARIANT_WORKERS'] = int(os.environ.get('MEDIA_VARIANT_WORKERS', '2'))
+    # Версии в современных форматах, выбираются по заголовку Accept
+    app.config['MEDIA_MODERN_FORMATS'] = tuple(
+        fmt for fmt in os.environ.get('MEDIA_MODERN_FORMATS', 'avif,webp').split(',') if fmt)
+    # Id твитов: serial - выдает база, snowflake - приложение (время + узел + слот процесса + счетчик).
+    # SNOWFLAKE_NODE_ID (0-31) должен отличаться у всех узлов; слоты процессов узла занимаются через flock
+    app.config['TWEET_ID_STRATEGY'] = os.environ.get('TWEET_ID_STRATEGY', 'serial')
+    app.config['SNOWFLAKE_NODE_ID'] = int(os.environ.get('SNOWFLAKE_NODE_ID', '0'))
+    app.config['SNOWFLAKE_LOCK_DIR'] = os.environ.get('SNOWFLAKE_LOCK_DIR')
+    # Пул соединений воркера. Под gunicorn всего соединений до (DB_POOL_SIZE + DB_MAX_OVERFLOW) * воркеров.
+    # DB_POOL_MODE=pgbouncer - безопасный режим для PgBouncer в transaction pooling
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', '5'))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    app.config['DB_POOL_MODE'] = os.environ.get('DB_POOL_MODE', 'direct')
+    # Драйвер psycopg 3 (DATABASE_URL=postgresql+psycopg://...): запрос готовится на сервере после
+    # DB_PREPARE_THRESHOLD выполнений (0 - сразу), независимые чтения уходят одним pipeline (DB_PIPELINE)
+    app.config['DB_PREPARE_THRESHOLD'] = int(os.environ.get('DB_PREPARE_THRESHOLD', '5'))
+    app.config['DB_PIPELINE'] = os.environ.get('DB_PIPELINE', '1') == '1'
+    # Реплики для чтения (через запятую): эндпоинты только для чтения ходят на них по кругу.
+    # Реплика с отставанием больше REPLICA_MAX_LAG_SECONDS или недоступная пропускается;
+    # проверка раз в REPLICA_CHECK_INTERVAL секунд. После записи клиент READ_YOUR_WRITES_SECONDS
+    # секунд читает из основной базы
+    app.config['DATABASE_REPLICA_URLS'] = tuple(
+        url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url)
+    app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+    app.config['REPLICA_CHECK_INTERVAL'] = float(os.environ.get('REPLICA_CHECK_INTERVAL', '5'))
+    app.config['READ_YOUR_WRITES_SECONDS'] = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+    # Шарды (через запятую) для твитов, лайков и подписок; пользователи и медиа остаются в основной базе.
+    # Требует TWEET_ID_STRATEGY=snowflake. Карта корзин кэшируется в процессе на SHARD_MAP_TTL секунд
+    app.config['DATABASE_SHARD_URLS'] = tuple(
+        url for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url)
+    app.config['SHARD_MAP_TTL'] = float(os.environ.get('SHARD_MAP_TTL', '5'))
+    # Таблица tweets секционирована по месяцам (flask partitions init): лента читает твиты
+    # не старше TIMELINE_MAX_AGE_DAYS дней, то есть только последние секции.
+    # Выгруженные в TWEETS_ARCHIVE_DIR секции отдаются по id через GET /api/tweets/<id>
+    app.config['TWEETS_PARTITIONED'] = os.environ.get('TWEETS_PARTITIONED', '0') == '1'
+    app.config['TIMELINE_MAX_AGE_DAYS'] = int(os.environ.get('TIMELINE_MAX_AGE_DAYS', '62'))
+    app.config['TWEETS_ARCHIVE_DIR'] = os.environ.get('TWEETS_ARCHIVE_DIR')
+    # Мягкое удаление: DELETE /api/tweets/<id> только помечает твит, строки удаляет flask tweets reap
+    app.config['TWEETS_SOFT_DELETE'] = os.environ.get('TWEETS_SOFT_DELETE', '0') == '1'
+    # Производственный профиль SQLite (production): WAL, PRAGMA, одно соединение записи и пул чтения
+    app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'default')
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', str(64 * 1024)))
+    app.config['SQLITE_READ_POOL_SIZE'] = int(os.environ.get('SQLITE_READ_POOL_SIZE', '8'))
+    app.config['SQLITE_WRITE_TIMEOUT'] = int(os.environ.get('SQLITE_WRITE_TIMEOUT', '30'))
+    # Фоновая обработка загрузок: режим по умолчанию (иначе ?async=1) и потоки обработки в процессе;
+    # при 0 медиа обрабатывает отдельный воркер flask media process
+    app.config['MEDIA_ASYNC_UPLOADS'] = os.environ.get('MEDIA_ASYNC_UPLOADS', '0') == '1'
+    app.config['MEDIA_PROCESSING_WORKERS'] = int(os.environ.get('MEDIA_PROCESSING_WORKERS', '2'))
+    # Пакетные операции: максимум элементов в запросе и размер многострочной вставки
+    app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', '10000'))
+    app.config['BATCH_CHUNK_SIZE'] = int(os.environ.get('BATCH_CHUNK_SIZE', '500'))
+    # Отложенная пакетная запись лайков (write-behind)
+    app.config['LIKES_WRITE_BEHIND'] = os.environ.get('LIKES_WRITE_BEHIND', '0') == '1'
+    app.config['LIKES_FLUSH_INTERVAL_MS'] = int(os.environ.get('LIKES_FLUSH_INTERVAL_MS', '5'))
 
     # Инициализация расширений
+    configure_pool(app)
+    configure_sqlite(app)
     db.init_app(app)
+    configure_replicas(app)
+    configure_shards(app)
     migrate.init_app(app, db)
+    like_write_behind.init_app(app)
+
+    # Команды командной строки (flask media ...)
+    from commands import media_cli, partitions_cli, shards_cli, tweets_cli, users_cli
+    app.cli.add_command(media_cli)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(tweets_cli)
 
     # Создание папки для загрузки файлов
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
 
-    # ✅ ПЕРЕМЕСТИТЕ ЭТОТ МАРШРУТ СЮДА - ПЕРЕД статическими маршрутами
-    @app.route('/uploads/<filename>')
-    def serve_uploaded_file(filename):
-        print(f"📁 Serving uploaded file: {filename}")
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # ✅ Маршрут загруженных файлов регистрируем ПЕРЕД статическими маршрутами
+    from routes.uploads import uploads_bp
+    app.register_blueprint(uploads_bp)
 
     # Регистрация статических маршрутов
     from routes.static import register_static_routes
@@ -41,6 +142,12 @@ def create_app():
     # Регистрация blueprint'ов
     from routes.api import api_bp
     app.register_blueprint(api_bp)
+    from routes.batch import batch_bp
+    app.register_blueprint(batch_bp)
+    from routes.resumable import resumable_bp
+    app.register_blueprint(resumable_bp)
+    from routes.metrics import metrics_bp
+    app.register_blueprint(metrics_bp)
 
     # Настройка Swagger UI
     SWAGGER_URL = '/api/docs'
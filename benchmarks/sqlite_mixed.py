@@ -0,0 +1,131 @@
+"""
+Смешанная нагрузка чтение/запись на файле SQLite: профиль по умолчанию против production.
+
+    python benchmarks/sqlite_mixed.py --processes 4 --threads 4 --seconds 5 --write-ratio 0.2
+
+Каждый поток каждого процесса (как воркеры gunicorn) в цикле создает твит (POST /api/tweets)
+или читает ленту (GET /api/tweets).
+Выводит число операций в секунду и ошибок (в том числе "database is locked") для каждого профиля.
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from models.models import db, User, Follow  # noqa: E402
+from models.session import READ_ENGINE  # noqa: E402
+
+USERS = 20
+
+
+def _make_app(profile, path, seed=False):
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['SQLITE_PROFILE'] = profile
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = create_app()
+    if not seed:
+        return app
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(User(name=f'User {n}', api_key=f'key_{n}') for n in range(USERS))
+        db.session.flush()
+        db.session.add_all(Follow(follower_id=n + 1, following_id=(n + step) % USERS + 1)
+                           for n in range(USERS) for step in range(1, 4))
+        db.session.commit()
+    return app
+
+
+def _dispose(app):
+    with app.app_context():
+        db.engine.dispose()
+        if READ_ENGINE in app.extensions:
+            app.extensions[READ_ENGINE].dispose()
+
+
+def _run(app, threads, seconds, write_ratio, seed=0):
+    stats = {'reads': 0, 'writes': 0, 'errors': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def _worker(number):
+        client = app.test_client()
+        rng = random.Random(seed * 1000 + number)
+        local = dict.fromkeys(stats, 0)
+        while time.monotonic() < deadline:
+            headers = {'api-key': f'key_{rng.randrange(USERS)}'}
+            if rng.random() < write_ratio:
+                response = client.post('/api/tweets', headers=headers, json={'tweet_data': 'benchmark'})
+                kind = 'writes'
+            else:
+                response = client.get('/api/tweets', headers=headers)
+                kind = 'reads'
+            if response.status_code >= 400:
+                local['errors'] += 1
+                if b'locked' in response.data:
+                    local['locked'] += 1
+            else:
+                local[kind] += 1
+        with lock:
+            for key, value in local.items():
+                stats[key] += value
+
+    workers = [threading.Thread(target=_worker, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return stats
+
+
+def _process(profile, path, threads, seconds, write_ratio, seed, results):
+    app = _make_app(profile, path)
+    results.put(_run(app, threads, seconds, write_ratio, seed))
+    _dispose(app)
+
+
+def benchmark(profile, path, processes, threads, seconds, write_ratio):
+    _dispose(_make_app(profile, path, seed=True))
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_process,
+                                       args=(profile, path, threads, seconds, write_ratio, seed, results))
+               for seed in range(processes)]
+    for worker in workers:
+        worker.start()
+    totals = dict.fromkeys(('reads', 'writes', 'errors', 'locked'), 0)
+    for _ in workers:
+        for key, value in results.get().items():
+            totals[key] += value
+    for worker in workers:
+        worker.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f'{"profile":<12}{"ops/s":>10}{"reads/s":>10}{"writes/s":>10}{"errors":>8}{"locked":>8}')
+    for profile in ('default', 'production'):
+        with tempfile.TemporaryDirectory() as folder:
+            stats = benchmark(profile, os.path.join(folder, 'bench.db'), args.processes,
+                              args.threads, args.seconds, args.write_ratio)
+        ops = (stats['reads'] + stats['writes']) / args.seconds
+        print(f'{profile:<12}{ops:>10.0f}{stats["reads"] / args.seconds:>10.0f}'
+              f'{stats["writes"] / args.seconds:>10.0f}{stats["errors"]:>8}{stats["locked"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
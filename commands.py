@@ -0,0 +1,245 @@
+import time
+from collections import Counter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from models.models import db
+from utils.deletion import purge_deleted_users, reap_deleted_tweets
+from utils.media_gc import collect_orphaned_media
+from utils.media_layout import migrate_batch
+from utils.media_processing import process_pending_media
+from utils.partitions import archive_partitions, archive_supported, create_future_partitions, partition_tweets
+from utils.sharding import SHARD_BUCKETS, get_shards, init_shards, rebalance, repair_follows
+from utils.storage import get_storage
+
+
+# Команды обслуживания медиафайлов: flask media <команда>
+media_cli = AppGroup('media', help='Обслуживание загруженных медиафайлов')
+
+
+@media_cli.command('migrate-layout')
+@click.option('--batch-size', default=500, show_default=True, help='Файлов за одну транзакцию')
+@click.option('--pause', default=0.0, show_default=True, help='Пауза между порциями, секунды')
+def migrate_layout(batch_size, pause):
+    """
+    Переносит файлы из плоской папки загрузок в раскладку ab/cd/ без остановки сервиса
+    """
+    if not get_storage().local:
+        raise click.ClickException('Layout migration works only with MEDIA_STORAGE=local')
+    folder = current_app.config['UPLOAD_FOLDER']
+    total = 0
+    while True:
+        moved = migrate_batch(folder, batch_size)
+        if not moved:
+            break
+        total += moved
+        click.echo(f'Moved {total} records')
+        if pause:
+            time.sleep(pause)
+    click.echo(f'Layout migration finished: {total} records moved')
+
+
+@media_cli.command('gc')
+@click.option('--grace-hours', default=24.0, show_default=True,
+              help='Не трогать медиа моложе этого возраста, часы')
+@click.option('--batch-size', default=500, show_default=True, help='Медиа за одну транзакцию')
+@click.option('--workers', default=8, show_default=True, help='Потоков для удаления файлов')
+def collect_garbage(grace_hours, batch_size, workers):
+    """
+    Удаляет медиа, не прикрепленные ни к одному твиту, и их файлы
+    """
+    result = collect_orphaned_media(int(grace_hours * 3600), batch_size, workers)
+    click.echo(f'Deleted {result.media} media and {result.files} files, reclaimed {result.bytes} bytes')
+
+
+@media_cli.command('process')
+@click.option('--batch-size', default=100, show_default=True, help='Медиа за один проход')
+@click.option('--interval', default=0.0, show_default=True,
+              help='Повторять проходы с этой паузой, секунды (0 - один проход)')
+def process_media(batch_size, interval):
+    """
+    Обрабатывает фоновые загрузки, оставшиеся в состоянии processing
+    """
+    while True:
+        total = 0
+        while True:
+            processed = process_pending_media(batch_size)
+            total += processed
+            if processed < batch_size:
+                break
+        if total or not interval:
+            click.echo(f'Processed {total} media')
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+# Шарды данных пользователей: flask shards <команда>
+shards_cli = AppGroup('shards', help='Шарды твитов, лайков и подписок')
+
+
+def _require_shards():
+    shards = get_shards()
+    if shards is None:
+        raise click.ClickException('Sharding is not configured (DATABASE_SHARD_URLS)')
+    return shards
+
+
+@shards_cli.command('init')
+def init_shards_command():
+    """
+    Создает таблицы на шардах и сохраняет карту корзин
+    """
+    shards = _require_shards()
+    init_shards(shards)
+    click.echo(f'Initialized {len(shards.engines)} shards')
+
+
+@shards_cli.command('status')
+def shards_status():
+    """
+    Сколько корзин на каждом шарде и какие переезжают
+    """
+    shards = _require_shards()
+    shards.invalidate()
+    mapping, moving = shards.bucket_map()
+    for shard in range(len(shards.engines)):
+        click.echo(f'Shard {shard}: {mapping.count(shard)} of {SHARD_BUCKETS} buckets')
+    if moving:
+        click.echo(f'Moving: {len(moving)} buckets')
+
+
+@shards_cli.command('rebalance')
+@click.option('--shards', 'shard_count', type=int, default=None,
+              help='Сколько первых шардов использовать (по умолчанию все; меньше - вывод шардов)')
+@click.option('--chunk-size', default=1000, show_default=True, help='Строк за одну вставку')
+@click.option('--dry-run', is_flag=True, help='Только показать план')
+def rebalance_shards(shard_count, chunk_size, dry_run):
+    """
+    Выравнивает корзины по шардам, перенося данные без остановки чтения
+    """
+    shards = _require_shards()
+    try:
+        moves = rebalance(shards, shard_count, chunk_size, dry_run, log=click.echo)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    if dry_run:
+        for (source, target), count in sorted(Counter((source, target) for _, source, target in moves).items()):
+            click.echo(f'Shard {source} -> shard {target}: {count} buckets')
+    click.echo(f"{'Planned' if dry_run else 'Moved'} {len(moves)} buckets")
+
+
+@shards_cli.command('repair-follows')
+@click.option('--chunk-size', default=1000, show_default=True, help='Строк за один запрос')
+def repair_follows_command(chunk_size):
+    """
+    Восстанавливает копии подписок на шардах после сбоя между фиксациями; запускать по расписанию
+    """
+    shards = _require_shards()
+    try:
+        added, removed = repair_follows(shards, chunk_size, log=click.echo)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Repaired follows: {added} added, {removed} removed')
+
+
+# Помесячные секции таблицы tweets: flask partitions <команда>
+partitions_cli = AppGroup('partitions', help='Помесячные секции и архив твитов (PostgreSQL)')
+
+
+def _tweet_databases():
+    """
+    Базы с таблицей tweets: шарды, если они настроены, иначе основная
+    """
+    shards = get_shards()
+    if shards is None:
+        return [('primary', db.engine)]
+    return [(f'shard-{index}', engine) for index, engine in enumerate(shards.engines)]
+
+
+@partitions_cli.command('init')
+@click.option('--months-ahead', default=3, show_default=True, help='На сколько месяцев вперед создать секции')
+def init_partitions(months_ahead):
+    """
+    Переводит tweets в секционированную по месяцам таблицу (копирует данные - окно обслуживания)
+    """
+    for database, engine in _tweet_databases():
+        try:
+            with engine.begin() as connection:
+                created = partition_tweets(connection, months_ahead)
+        except RuntimeError as e:
+            raise click.ClickException(f'{database}: {e}')
+        click.echo(f'{database}: partitioned tweets into {len(created)} monthly partitions')
+
+
+@partitions_cli.command('create-ahead')
+@click.option('--months', default=3, show_default=True, help='На сколько месяцев вперед должны быть секции')
+def create_partitions_ahead(months):
+    """
+    Создает секции будущих месяцев; запускать по расписанию, например раз в день
+    """
+    for database, engine in _tweet_databases():
+        try:
+            with engine.begin() as connection:
+                created = create_future_partitions(connection, months)
+        except RuntimeError as e:
+            raise click.ClickException(f'{database}: {e}')
+        click.echo(f"{database}: created {len(created)} partitions{': ' + ', '.join(created) if created else ''}")
+
+
+@partitions_cli.command('archive')
+@click.option('--older-than-months', default=12, show_default=True,
+              help='Выгрузить секции месяцев старше этого числа месяцев')
+@click.option('--keep-tables', is_flag=True, help='Только отсоединить секции, не удаляя таблицы')
+def archive_old_partitions(older_than_months, keep_tables):
+    """
+    Выгружает старые секции в Parquet (TWEETS_ARCHIVE_DIR) и отсоединяет их от tweets
+    """
+    archive_dir = current_app.config.get('TWEETS_ARCHIVE_DIR')
+    if not archive_dir:
+        raise click.ClickException('Archive directory is not configured (TWEETS_ARCHIVE_DIR)')
+    if not archive_supported():
+        raise click.ClickException('Tweet archive requires pyarrow: pip install pyarrow')
+    total = 0
+    for database, engine in _tweet_databases():
+        try:
+            with engine.connect() as connection:
+                total += len(archive_partitions(connection, archive_dir, older_than_months, database,
+                                                drop=not keep_tables, log=click.echo))
+        except RuntimeError as e:
+            raise click.ClickException(f'{database}: {e}')
+    click.echo(f'Archived {total} partitions')
+
+
+# Удаление аккаунтов: flask users <команда>
+users_cli = AppGroup('users', help='Обслуживание аккаунтов пользователей')
+
+
+@users_cli.command('purge')
+@click.option('--batch-size', default=1000, show_default=True, help='Строк за одну транзакцию')
+@click.option('--pause', default=0.0, show_default=True, help='Пауза между порциями, секунды')
+@click.option('--workers', default=8, show_default=True, help='Потоков для удаления файлов')
+def purge_users(batch_size, pause, workers):
+    """
+    Удаляет данные аккаунтов, помеченных удаленными; запускать по расписанию
+    """
+    result = purge_deleted_users(batch_size, pause, workers, log=click.echo)
+    click.echo(f'Purged {result.users} users: {result.tweets} tweets, {result.likes} likes, '
+               f'{result.follows} follows, {result.media} media')
+
+
+# Удаленные твиты: flask tweets <команда>
+tweets_cli = AppGroup('tweets', help='Обслуживание твитов')
+
+
+@tweets_cli.command('reap')
+@click.option('--batch-size', default=1000, show_default=True, help='Строк за одну транзакцию')
+@click.option('--pause', default=0.0, show_default=True, help='Пауза между порциями, секунды')
+def reap_tweets(batch_size, pause):
+    """
+    Удаляет строки мягко удаленных твитов (TWEETS_SOFT_DELETE); запускать в часы низкой нагрузки
+    """
+    result = reap_deleted_tweets(batch_size, pause)
+    click.echo(f'Reaped {result.tweets} tweets and {result.likes} likes')
@@ -3,14 +3,29 @@ CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     name VARCHAR(80) NOT NULL,
     api_key VARCHAR(100) UNIQUE NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    deleted_at TIMESTAMP
 );
 
 -- Создание таблицы tweets
 CREATE TABLE IF NOT EXISTS tweets (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL PRIMARY KEY,
     content TEXT NOT NULL,
-    author_id INTEGER REFERENCES users(id),
+    author_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(16) NOT NULL DEFAULT 'published',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_tweets_author_id_created_at ON tweets (author_id, created_at DESC, id);
+CREATE INDEX IF NOT EXISTS ix_tweets_author_id_id ON tweets (author_id, id DESC);
+CREATE INDEX IF NOT EXISTS ix_tweets_deleted ON tweets (id) WHERE status = 'deleted';
+
+-- Создание таблицы файлов медиа, адресуемых по sha256 содержимого
+CREATE TABLE IF NOT EXISTS media_blobs (
+    hash VARCHAR(64) PRIMARY KEY,
+    filename VARCHAR(120) NOT NULL,
+    size BIGINT NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    variants VARCHAR(255),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -19,33 +34,82 @@ CREATE TABLE IF NOT EXISTS media (
     id SERIAL PRIMARY KEY,
     filename VARCHAR(120) NOT NULL,
     owner_id INTEGER REFERENCES users(id),
+    blob_hash VARCHAR(64) REFERENCES media_blobs(hash),
+    width INTEGER,
+    height INTEGER,
+    frame_count INTEGER DEFAULT 1,
+    status VARCHAR(16) NOT NULL DEFAULT 'ready',
+    error VARCHAR(255),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS ix_media_blob_hash ON media (blob_hash);
+
+-- Создание таблицы сессий докачиваемых загрузок
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id VARCHAR(32) PRIMARY KEY,
+    owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    extension VARCHAR(10) NOT NULL,
+    total_size BIGINT NOT NULL,
+    upload_offset BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_upload_sessions_owner_id ON upload_sessions (owner_id);
+CREATE INDEX IF NOT EXISTS ix_upload_sessions_expires_at ON upload_sessions (expires_at);
 
 -- Создание таблицы likes
 CREATE TABLE IF NOT EXISTS likes (
     id SERIAL PRIMARY KEY,
-    user_id INTEGER REFERENCES users(id),
-    tweet_id INTEGER REFERENCES tweets(id),
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    tweet_id BIGINT REFERENCES tweets(id) ON DELETE CASCADE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(user_id, tweet_id)
 );
+CREATE INDEX IF NOT EXISTS ix_likes_tweet_id ON likes (tweet_id);
 
 -- Создание таблицы follows
 CREATE TABLE IF NOT EXISTS follows (
     id SERIAL PRIMARY KEY,
-    follower_id INTEGER REFERENCES users(id),
-    following_id INTEGER REFERENCES users(id),
+    follower_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    following_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(follower_id, following_id)
 );
+CREATE INDEX IF NOT EXISTS ix_follows_following_id_follower_id ON follows (following_id, follower_id);
 
 -- Создание промежуточной таблицы для связи многие-ко-многим между твитами и медиа
+-- При шардировании (DATABASE_SHARD_URLS) flask shards init снимает ссылку на tweets: твиты лежат на шардах
 CREATE TABLE IF NOT EXISTS tweet_media (
-    tweet_id INTEGER REFERENCES tweets(id),
+    tweet_id BIGINT REFERENCES tweets(id) ON DELETE CASCADE,
     media_id INTEGER REFERENCES media(id),
     PRIMARY KEY (tweet_id, media_id)
 );
+CREATE INDEX IF NOT EXISTS ix_tweet_media_media_id ON tweet_media (media_id);
+
+-- Создание таблицы ключей идемпотентности для повторяемых POST запросов
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id SERIAL PRIMARY KEY,
+    scope VARCHAR(64) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'processing',
+    response_status INTEGER,
+    response_body TEXT,
+    response_mimetype VARCHAR(100),
+    response_headers TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    UNIQUE(scope, key)
+);
+ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS response_headers TEXT;
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at);
+
+-- Карта корзин пользователей по шардам (используется при DATABASE_SHARD_URLS)
+CREATE TABLE IF NOT EXISTS shard_buckets (
+    bucket INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    moving BOOLEAN NOT NULL DEFAULT FALSE
+);
 
 -- Создание тестовых пользователей для демонстрации
 INSERT INTO users (name, api_key) VALUES 
@@ -1,3 +1,3 @@
-from .models import db, User, Tweet, Media, Like, Follow
+from .models import db, User, Tweet, Media, MediaBlob, UploadSession, Like, Follow, ShardBucket, IdempotencyKey
 
-__all__ = ['db', 'User', 'Tweet', 'Media', 'Like', 'Follow']
\ No newline at end of file
+__all__ = ['db', 'User', 'Tweet', 'Media', 'MediaBlob', 'UploadSession', 'Like', 'Follow', 'ShardBucket', 'IdempotencyKey']
\ No newline at end of file
@@ -1,9 +1,29 @@
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import os
 
+from .session import RoutingSession
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+# 64-битный id твита (k-сортируемый, см. utils/snowflake.py). В SQLite автоинкремент
+# работает только у INTEGER PRIMARY KEY, который и так 64-битный
+BigId = db.BigInteger().with_variant(db.Integer(), 'sqlite')
+
+# Состояния обработки медиа: загрузка подтверждается сразу, проверка и сохранение идут в фоне
+MEDIA_PROCESSING = 'processing'
+MEDIA_READY = 'ready'
+MEDIA_FAILED = 'failed'
+
+# Состояния твита: твит с необработанными вложениями ждет их и публикуется автоматически
+TWEET_PENDING = 'pending'
+TWEET_PUBLISHED = 'published'
+TWEET_FAILED = 'failed'
+# Удаленный твит (TWEETS_SOFT_DELETE): скрыт из чтений, строки удаляет flask tweets reap
+TWEET_DELETED = 'deleted'
 
 
 class User(db.Model):
@@ -13,11 +33,16 @@ class User(db.Model):
     name = db.Column(db.String(80), nullable=False)
     api_key = db.Column(db.String(100), unique=True, nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Аккаунт удален: API ключ больше не действует, данные удаляет flask users purge
+    deleted_at = db.Column(db.DateTime)
     
-    # Relationships
-    tweets = db.relationship('Tweet', backref='author', lazy=True, cascade='all, delete-orphan')
+    # Relationships. Твиты, лайки и подписки удаляет база (ON DELETE CASCADE):
+    # passive_deletes не дает сессии загружать их перед удалением пользователя
+    tweets = db.relationship('Tweet', backref='author', lazy=True, cascade='all, delete-orphan',
+                             passive_deletes=True)
     media = db.relationship('Media', backref='owner', lazy=True, cascade='all, delete-orphan')
-    likes = db.relationship('Like', backref='user', lazy=True, cascade='all, delete-orphan')
+    likes = db.relationship('Like', backref='user', lazy=True, cascade='all, delete-orphan',
+                            passive_deletes=True)
     
     # Followers и Following через промежуточную таблицу Follow
     followers = db.relationship(
@@ -25,7 +50,8 @@ class User(db.Model):
         foreign_keys='Follow.following_id',
         backref='following',
         lazy='dynamic',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
     
     following = db.relationship(
@@ -33,7 +59,8 @@ class User(db.Model):
         foreign_keys='Follow.follower_id',
         backref='follower',
         lazy='dynamic',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     def __repr__(self):
@@ -43,44 +70,159 @@ class User(db.Model):
 class Tweet(db.Model):
     __tablename__ = 'tweets'
     
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(BigId, primary_key=True)
     content = db.Column(db.Text, nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=TWEET_PUBLISHED)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     media = db.relationship('Media', secondary='tweet_media', backref='tweets')
-    likes = db.relationship('Like', backref='tweet', lazy=True, cascade='all, delete-orphan')
+    likes = db.relationship('Like', backref='tweet', lazy=True, cascade='all, delete-orphan',
+                            passive_deletes=True)
+
+    # Лента: author_id IN (...) ORDER BY created_at DESC читает диапазоны индекса без полного сканирования.
+    # С id по времени (TWEET_ID_STRATEGY=snowflake) лента сортируется по id
+    __table_args__ = (
+        db.Index('ix_tweets_author_id_created_at', 'author_id', created_at.desc(), 'id'),
+        db.Index('ix_tweets_author_id_id', 'author_id', id.desc()),
+        # Частичный индекс только по удаленным твитам: чистка находит их, не просматривая таблицу
+        db.Index('ix_tweets_deleted', 'id', postgresql_where=status == TWEET_DELETED,
+                 sqlite_where=status == TWEET_DELETED),
+    )
 
     def __repr__(self):
         return f'<Tweet {self.id}>'
 
 
+class MediaBlob(db.Model):
+    __tablename__ = 'media_blobs'
+
+    # Файл хранится один раз под sha256 содержимого, Media ссылаются на него
+    hash = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(120), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # Количество Media, ссылающихся на файл; -1 - файл удаляется
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    # Готовые уменьшенные копии и версии в современных форматах через запятую,
+    # например "150,600,webp,150.webp" (см. utils/media_variants.py); NULL - еще не готовы
+    variants = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def variant_sizes(self):
+        return parse_variant_sizes(self.variants)
+
+    def __repr__(self):
+        return f'<MediaBlob {self.hash} refs={self.ref_count}>'
+
+
+def parse_variant_sizes(variants):
+    """
+    Разбирает список готовых размеров из строки "150,600,webp"
+    """
+    return [int(token) for token in variants.split(',') if token.isdigit()] if variants else []
+
+
+def parse_variant_formats(variants):
+    """
+    Готовые версии в современных форматах: {размер копии или None для оригинала: {расширение, ...}}.
+    "webp" - версия оригинала, "150.webp" - версия копии 150
+    """
+    formats = {}
+    for token in (variants or '').split(','):
+        if not token or token.isdigit():
+            continue
+        size, _, extension = token.rpartition('.')
+        formats.setdefault(int(size) if size else None, set()).add(extension)
+    return formats
+
+
+def variant_filename(filename, size):
+    """
+    Имя файла уменьшенной копии: <имя>_<размер>.<расширение>
+    """
+    stem, extension = filename.rsplit('.', 1)
+    return f'{stem}_{size}.{extension}'
+
+
 class Media(db.Model):
     __tablename__ = 'media'
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(120), nullable=False)
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    blob_hash = db.Column(db.String(64), db.ForeignKey('media_blobs.hash'), index=True)
+    # Размеры из заголовка файла: клиенты резервируют место, не скачивая изображение
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    frame_count = db.Column(db.Integer, default=1)
+    # Пока медиа обрабатывается, filename указывает на временный файл в папке загрузок
+    status = db.Column(db.String(16), nullable=False, default=MEDIA_READY)
+    error = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    blob = db.relationship('MediaBlob', lazy=True)
     
-    def get_url(self):
+    def get_url(self, size=None):
+        # Наименьшая готовая копия не меньше запрошенного размера, иначе оригинал
+        if size and self.blob is not None:
+            fitting = [variant for variant in self.blob.variant_sizes if variant >= size]
+            if fitting:
+                return f'/uploads/{variant_filename(self.filename, min(fitting))}'
         return f'/uploads/{self.filename}'
 
+    def variant_urls(self):
+        # Готовые уменьшенные копии: {"150": url, ...}; клиент выбирает размер под экран
+        if self.blob is None:
+            return {}
+        return {str(size): f'/uploads/{variant_filename(self.filename, size)}'
+                for size in sorted(self.blob.variant_sizes)}
+
+    def to_meta(self):
+        return {
+            "url": self.get_url(),
+            "width": self.width,
+            "height": self.height,
+            "frame_count": self.frame_count,
+            "variants": self.variant_urls(),
+        }
+
     def __repr__(self):
         return f'<Media {self.filename}>'
 
 
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+
+    # Случайный идентификатор: по нему клиент докачивает файл частями
+    id = db.Column(db.String(32), primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    extension = db.Column(db.String(10), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    # Сколько байт уже принято и проверено; все, что дальше в файле, отбрасывается
+    upload_offset = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.upload_offset}/{self.total_size}>'
+
+
 class Like(db.Model):
     __tablename__ = 'likes'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    tweet_id = db.Column(db.Integer, db.ForeignKey('tweets.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    tweet_id = db.Column(BigId, db.ForeignKey('tweets.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Уникальное ограничение, чтобы пользователь не мог лайкнуть один и тот же твит дважды
-    __table_args__ = (db.UniqueConstraint('user_id', 'tweet_id', name='unique_user_tweet_like'),)
+    # Уникальное ограничение, чтобы пользователь не мог лайкнуть один и тот же твит дважды.
+    # Лайки твита ищутся по tweet_id, который в уникальном индексе стоит вторым
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'tweet_id', name='unique_user_tweet_like'),
+        db.Index('ix_likes_tweet_id', 'tweet_id'),
+    )
 
     def __repr__(self):
         return f'<Like user_id={self.user_id}, tweet_id={self.tweet_id}>'
@@ -90,19 +232,69 @@ class Follow(db.Model):
     __tablename__ = 'follows'
     
     id = db.Column(db.Integer, primary_key=True)
-    follower_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    following_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    follower_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    following_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Уникальное ограничение, чтобы пользователь не мог подписаться на одного и того же пользователя дважды
-    __table_args__ = (db.UniqueConstraint('follower_id', 'following_id', name='unique_follower_following'),)
+    # Уникальное ограничение, чтобы пользователь не мог подписаться на одного и того же пользователя дважды.
+    # Подписчики пользователя ищутся по following_id: отдельный покрывающий индекс в обратном порядке
+    __table_args__ = (
+        db.UniqueConstraint('follower_id', 'following_id', name='unique_follower_following'),
+        db.Index('ix_follows_following_id_follower_id', 'following_id', 'follower_id'),
+    )
 
     def __repr__(self):
         return f'<Follow follower_id={self.follower_id}, following_id={self.following_id}>'
 
 
+def _tweets_on_primary(ddl, target, bind, **kw):
+    # При шардировании (DATABASE_SHARD_URLS) твиты лежат на шардах, а tweets основной базы пуста:
+    # ссылка на нее отклоняла бы каждую привязку медиа. Связь остается в метаданных для ORM
+    return not (has_app_context() and current_app.config.get('DATABASE_SHARD_URLS'))
+
+
 # Промежуточная таблица для связи многие-ко-многим между твитами и медиа
 tweet_media = db.Table('tweet_media',
-    db.Column('tweet_id', db.Integer, db.ForeignKey('tweets.id'), primary_key=True),
-    db.Column('media_id', db.Integer, db.ForeignKey('media.id'), primary_key=True)
-)
\ No newline at end of file
+    db.Column('tweet_id', BigId, primary_key=True),
+    db.Column('media_id', db.Integer, db.ForeignKey('media.id'), primary_key=True),
+    db.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE').ddl_if(callable_=_tweets_on_primary),
+    # Поиск по медиа (сборка мусора) не может использовать первичный ключ (tweet_id, media_id)
+    db.Index('ix_tweet_media_media_id', 'media_id')
+)
+
+
+class ShardBucket(db.Model):
+    __tablename__ = 'shard_buckets'
+
+    # Данные пользователя лежат на шарде его корзины (user_id % SHARD_BUCKETS, см. utils/sharding.py);
+    # при перешардировании переезжают корзины целиком
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.Integer, nullable=False)
+    # Корзина переезжает: запись в нее временно запрещена
+    moving = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<ShardBucket {self.bucket} -> {self.shard}>'
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Область ключа - хэш API ключа клиента, чтобы разные пользователи не пересекались
+    scope = db.Column(db.String(64), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='processing')
+    response_status = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    response_mimetype = db.Column(db.String(100))
+    # Заголовки ответа, которые повтор должен вернуть (JSON: имя -> значение)
+    response_headers = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (db.UniqueConstraint('scope', 'key', name='unique_idempotency_scope_key'),)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} {self.status}>'
@@ -0,0 +1,74 @@
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.util import find_tables
+
+
+# Движок для чтения; если его нет в app.extensions, все запросы идут в основной
+READ_ENGINE = 'db_read_engine'
+# Реплика, выбранная для текущего запроса (атрибут flask.g)
+REPLICA_ENGINE = 'db_replica_engine'
+# Шарды данных пользователей (utils/sharding.py) и таблицы, которые на них лежат
+SHARDS = 'db_shards'
+SHARDED_TABLES = frozenset(('tweets', 'likes', 'follows'))
+
+_READ_STATEMENTS = ('SELECT', 'WITH', 'EXPLAIN')
+
+
+def is_write(clause):
+    if isinstance(clause, sa.sql.dml.UpdateBase):
+        return True
+    if isinstance(clause, sa.sql.elements.TextClause):
+        return not clause.text.lstrip().upper().startswith(_READ_STATEMENTS)
+    return False
+
+
+def is_sharded(mapper, clause):
+    if mapper is not None:
+        return mapper.persist_selectable.name in SHARDED_TABLES
+    if clause is None:
+        return False
+    return any(table.name in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
+
+
+def read_engine():
+    """
+    Движок для чтений: реплика, выбранная для запроса, или пул чтения SQLite
+    """
+    if has_request_context():
+        replica = g.get(REPLICA_ENGINE)
+        if replica is not None:
+            return replica
+    return current_app.extensions.get(READ_ENGINE)
+
+
+class RoutingSession(Session):
+    """
+    Чтения уходят на движок для чтения, а запись (flush, INSERT/UPDATE/DELETE)
+    и все запросы после нее до конца транзакции - на основной движок,
+    чтобы транзакция видела свои изменения.
+    Запросы к шардированным таблицам идут на шард, выбранный в session.info['shard']
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            shards = current_app.extensions.get(SHARDS)
+            if shards is not None and is_sharded(mapper, clause):
+                shard = self.info.get('shard')
+                if shard is None:
+                    raise RuntimeError('Query touches sharded tables, but no shard is selected')
+                return shards.engines[shard]
+            if self._flushing or is_write(clause):
+                self.info['wrote'] = True
+            elif not self.info.get('wrote'):
+                reader = read_engine()
+                if reader is not None:
+                    return reader
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _forget_write(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
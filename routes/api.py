@@ -1,10 +1,27 @@
+from collections import defaultdict
+from datetime import datetime
+
+import sqlalchemy as sa
 from flask import Blueprint, request, jsonify, current_app
 import os
+import uuid
 from werkzeug.utils import secure_filename
-from models.models import db, User, Tweet, Media, Like, Follow
+from models.models import (db, User, Tweet, Media, MediaBlob, Like, Follow, tweet_media,
+                           MEDIA_PROCESSING, MEDIA_FAILED, TWEET_PENDING, TWEET_PUBLISHED, TWEET_DELETED)
 from utils.auth import get_user_by_api_key
-from utils.validators import validate_tweet_data
-import uuid
+from utils.validators import validate_tweet_data, validate_tweet_payload
+from utils.idempotency import idempotent
+from utils.db_replicas import replica_reads
+from utils.sharding import (ShardMovingError, get_shards, use_user_shard, use_tweet_shard, gather_timeline,
+                            add_follow_on_shards, remove_follow_on_shards)
+from utils.media_storage import stream_to_temp, spool_to_temp, save_media, MediaValidationError
+from utils.media_processing import enqueue_media, publish_ready_tweets
+from utils.partitions import find_archived_tweet, timeline_since
+from utils.pipeline import fetch_all, id_in
+from utils.snowflake import new_tweet_ids, snowflake_enabled
+from utils.storage import get_storage, content_type
+from utils.upserts import (add_like, remove_like, add_follow, remove_follow,
+                           NOT_FOUND, EXISTS, ABSENT)
 
 
 api_bp = Blueprint('api', __name__)
@@ -16,7 +33,102 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def async_upload_requested():
+    """
+    Фоновая обработка загрузки: ?async=1 или MEDIA_ASYNC_UPLOADS по умолчанию
+    """
+    value = request.args.get('async')
+    if value is None:
+        return current_app.config.get('MEDIA_ASYNC_UPLOADS', False)
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def media_state(media):
+    """
+    Ответ о загруженном медиа: размеры и адрес известны только после обработки
+    """
+    state = {"media_id": media.id, "status": media.status}
+    if media.status == MEDIA_PROCESSING:
+        return state
+    if media.status == MEDIA_FAILED:
+        state["error"] = media.error
+        return state
+    state.update(media.to_meta())
+    return state
+
+
+def sharded_timeline(shards, author_ids, since=None):
+    """
+    Лента со всех шардов авторов
+    """
+    tweets, likers = gather_timeline(shards, author_ids, since)
+    return render_tweets(tweets, likers)
+
+
+def render_tweets(tweets, likers=None):
+    """
+    Твиты из строк (id, content, author_id). Лайки {tweet_id: [user_id, ...]} передаются,
+    если они лежат на шардах, иначе читаются здесь. Вложения, имена и лайки загружаются
+    независимыми запросами - на psycopg 3 за один сетевой обмен с базой
+    """
+    tweet_ids = [tweet.id for tweet in tweets]
+    if not tweet_ids:
+        return []
+    users = User.__table__
+    media = Media.__table__
+    blobs = MediaBlob.__table__
+    likes = Like.__table__
+    user_ids = {tweet.author_id for tweet in tweets}
+    statements = [
+        # Готовые копии берутся из media_blobs тем же запросом
+        sa.select(tweet_media.c.tweet_id, media.c.filename, media.c.width, media.c.height, media.c.frame_count,
+                  blobs.c.variants)
+        .join(media, media.c.id == tweet_media.c.media_id)
+        .outerjoin(blobs, blobs.c.hash == media.c.blob_hash)
+        .where(id_in(tweet_media.c.tweet_id, tweet_ids))
+    ]
+    if likers is None:
+        # Имя лайкнувшего - подзапросом по первичному ключу: лайки выбираются по индексу tweet_id
+        liker_name = sa.select(users.c.name).where(users.c.id == likes.c.user_id).scalar_subquery()
+        statements.append(
+            sa.select(likes.c.tweet_id, likes.c.user_id, liker_name).where(id_in(likes.c.tweet_id, tweet_ids))
+        )
+    else:
+        user_ids |= {user_id for ids in likers.values() for user_id in ids}
+    statements.append(sa.select(users.c.id, users.c.name).where(id_in(users.c.id, user_ids)))
+
+    attached, *liked, named = fetch_all(statements)
+    names = dict(named)
+    if likers is None:
+        likers = defaultdict(list)
+        for tweet_id, user_id, name in liked[0]:
+            likers[tweet_id].append(user_id)
+            names[user_id] = name
+    attachments = defaultdict(list)
+    for tweet_id, filename, width, height, frame_count, variants in attached:
+        attachments[tweet_id].append(Media(filename=filename, width=width, height=height, frame_count=frame_count,
+                                           blob=MediaBlob(variants=variants)))
+
+    return [{
+        "id": tweet.id,
+        "content": tweet.content,
+        "attachments": [item.get_url() for item in attachments[tweet.id]],
+        "attachments_meta": [item.to_meta() for item in attachments[tweet.id]],
+        "author": {
+            "id": tweet.author_id,
+            "name": names.get(tweet.author_id)
+        },
+        "likes": [
+            {
+                "user_id": user_id,
+                "name": names.get(user_id)
+            } for user_id in likers.get(tweet.id, ())
+        ]
+    } for tweet in tweets]
+
+
 @api_bp.route('/api/tweets', methods=['POST'])
+@idempotent
 def create_tweet():
     try:
         api_key = request.headers.get('api-key')
@@ -35,42 +147,69 @@ def create_tweet():
         tweet_media_ids = data.get('tweet_media_ids', [])
 
         # ✅ ИСПРАВЛЕННАЯ ВАЛИДАЦИЯ: разрешаем либо текст, либо медиа
-        if not tweet_data and not tweet_media_ids:
+        error = validate_tweet_payload(tweet_data, tweet_media_ids, current_app.config.get('MAX_TWEET_MEDIA', 10))
+        if error:
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": error}), 400
+
+        # Все вложения проверяем одним запросом IN с фильтром по владельцу;
+        # медиа, которое не удалось обработать, прикрепить нельзя
+        media_ids = list(dict.fromkeys(tweet_media_ids))
+        owned = {}
+        if media_ids:
+            owned = dict(db.session.query(Media.id, Media.status).filter(
+                Media.id.in_(media_ids),
+                Media.owner_id == user.id,
+                Media.status != MEDIA_FAILED
+            ))
+        owned_ids = set(owned)
+        invalid_media_ids = [media_id for media_id in media_ids if media_id not in owned_ids]
+
+        if not tweet_data and not owned_ids:
             return jsonify({
                 "result": False,
                 "error_type": "ValidationError",
-                "error_message": "Either tweet text or media is required"
+                "error_message": "Either tweet text or media is required",
+                "invalid_media_ids": invalid_media_ids
             }), 400
 
-        # ✅ Проверяем длину текста если он есть
-        if tweet_data and len(tweet_data) > 280:
-            return jsonify({
-                "result": False,
-                "error_type": "ValidationError",
-                "error_message": "Tweet text too long (max 280 characters)"
-            }), 400
+        # Твит с еще обрабатываемыми вложениями публикуется, когда они будут готовы
+        status = TWEET_PENDING if MEDIA_PROCESSING in owned.values() else TWEET_PUBLISHED
 
-        # Создание твита
-        tweet = Tweet(content=tweet_data, author_id=user.id)
+        # Создание твита на шарде автора. Id по времени назначает приложение, иначе его выдает база
+        use_user_shard(user.id, write=True)
+        tweet_ids = new_tweet_ids(1, user.id)
+        tweet = Tweet(id=tweet_ids[0] if tweet_ids else None, content=tweet_data, author_id=user.id, status=status)
         db.session.add(tweet)
-        db.session.flush()  # Получаем ID твита без фиксации транзакции
+        if tweet.id is None:
+            db.session.flush()  # Получаем ID твита без фиксации транзакции
 
-        # Привязка медиафайлов к твиту
-        for media_id in tweet_media_ids:
-            media = Media.query.get(media_id)
-            if media and media.owner_id == user.id:
-                tweet.media.append(media)
+        # Привязка медиафайлов к твиту одной многострочной вставкой
+        if owned_ids:
+            db.session.execute(tweet_media.insert(), [
+                {"tweet_id": tweet.id, "media_id": media_id}
+                for media_id in media_ids if media_id in owned_ids
+            ])
 
         db.session.commit()
 
-        return jsonify({"result": True, "tweet_id": tweet.id}), 201
+        if status == TWEET_PENDING:
+            # Вложения могли стать готовыми, пока твит создавался
+            publish_ready_tweets([tweet.id])
+            db.session.refresh(tweet)
+
+        return jsonify({"result": True, "tweet_id": tweet.id, "status": tweet.status,
+                        "invalid_media_ids": invalid_media_ids}), 201
 
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         db.session.rollback()
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
 
 
 @api_bp.route('/api/medias', methods=['POST'])
+@idempotent
 def upload_media():
     try:
         api_key = request.headers.get('api-key')
@@ -91,16 +230,29 @@ def upload_media():
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             extension = filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4().hex}.{extension}"
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-            
-            file.save(filepath)
-
-            media = Media(filename=unique_filename, owner_id=user.id)
-            db.session.add(media)
-            db.session.commit()
 
-            return jsonify({"result": True, "media_id": media.id}), 201
+            if async_upload_requested():
+                # Запрос только принимает файл; проверка, хэш и копии строятся в фоне
+                temp_path = spool_to_temp(file.stream)
+                try:
+                    media = enqueue_media(temp_path, extension, user.id)
+                except Exception:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+                return jsonify({"result": True, **media_state(media)}), 202
+
+            # Файл хранится под sha256 содержимого: одинаковые загрузки делят один файл
+            upload = stream_to_temp(file.stream, extension)
+            try:
+                media = save_media(upload, extension, user.id)
+            except MediaValidationError as e:
+                return jsonify({"result": False, "error_type": "ValidationError", "error_message": str(e)}), 400
+            finally:
+                upload.discard()
+
+            return jsonify({"result": True, "media_id": media.id,
+                            "width": media.width, "height": media.height}), 201
         else:
             return jsonify({"result": False, "error_type": "ValidationError", "error_message": "File type not allowed"}), 400
 
@@ -109,6 +261,154 @@ def upload_media():
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
 
 
+@api_bp.route('/api/medias/<int:media_id>', methods=['GET'])
+def get_media(media_id):
+    try:
+        api_key = request.headers.get('api-key')
+        if not api_key:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401
+
+        user = get_user_by_api_key(api_key)
+        if not user:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
+
+        # Состояние обработки видно только владельцу
+        media = Media.query.filter_by(id=media_id, owner_id=user.id).first()
+        if not media:
+            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Media not found"}), 404
+
+        response = jsonify({"result": True, **media_state(media)})
+        if media.status == MEDIA_PROCESSING:
+            # Подсказка клиенту, когда спросить снова
+            response.headers['Retry-After'] = '1'
+        return response, 200
+
+    except Exception as e:
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@api_bp.route('/api/medias/direct', methods=['POST'])
+def create_direct_upload():
+    try:
+        api_key = request.headers.get('api-key')
+        if not api_key:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401
+
+        user = get_user_by_api_key(api_key)
+        if not user:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
+
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(str(data.get('filename') or ''))
+        size = data.get('size')
+        if not filename or not allowed_file(filename):
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "File type not allowed"}), 400
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "size must be a positive integer"}), 400
+        if size > current_app.config.get('DIRECT_UPLOAD_MAX_SIZE', 100 * 1024 * 1024):
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "File is too large"}), 413
+
+        # Клиент загружает файл прямо в хранилище по подписанной ссылке, минуя Flask
+        extension = filename.rsplit('.', 1)[1].lower()
+        key = f'incoming/{user.id}/{uuid.uuid4().hex}.{extension}'
+        mimetype = content_type(key)
+        upload_url = get_storage().presigned_upload(
+            key, mimetype, size, current_app.config.get('S3_URL_EXPIRES', 3600))
+        if upload_url is None:
+            return jsonify({"result": False, "error_type": "BadRequest",
+                            "error_message": "Direct uploads require object storage"}), 400
+
+        return jsonify({"result": True, "key": key, "upload_url": upload_url,
+                        "method": "PUT", "headers": {"Content-Type": mimetype}}), 201
+
+    except Exception as e:
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@api_bp.route('/api/medias/direct/complete', methods=['POST'])
+@idempotent
+def complete_direct_upload():
+    try:
+        api_key = request.headers.get('api-key')
+        if not api_key:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401
+
+        user = get_user_by_api_key(api_key)
+        if not user:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
+
+        data = request.get_json(silent=True) or {}
+        key = str(data.get('key') or '')
+        name = key[len(f'incoming/{user.id}/'):]
+        if not key.startswith(f'incoming/{user.id}/') or '/' in name or not allowed_file(name):
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "Invalid upload key"}), 400
+
+        storage = get_storage()
+        if not storage.exists(key):
+            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Uploaded object not found"}), 404
+
+        # Содержимое читается один раз, чтобы проверить изображение и посчитать хэш;
+        # в постоянное место объект копируется внутри хранилища
+        extension = name.rsplit('.', 1)[1].lower()
+        body = storage.open(key)
+        try:
+            upload = stream_to_temp(body, extension, source_key=key)
+        finally:
+            body.close()
+        try:
+            media = save_media(upload, extension, user.id)
+        except MediaValidationError as e:
+            storage.delete(key)
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": str(e)}), 400
+        finally:
+            upload.discard()
+        storage.delete(key)
+
+        return jsonify({"result": True, "media_id": media.id,
+                        "width": media.width, "height": media.height}), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@api_bp.route('/api/tweets/<int:tweet_id>', methods=['GET'])
+@replica_reads
+def get_tweet(tweet_id):
+    try:
+        api_key = request.headers.get('api-key')
+        if not api_key:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401
+
+        user = get_user_by_api_key(api_key)
+        if not user:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
+
+        use_tweet_shard(tweet_id)
+        tweet = Tweet.query.get(tweet_id)
+
+        archived = False
+        if tweet is None and current_app.config.get('TWEETS_ARCHIVE_DIR'):
+            # Отсоединенные секции: твит читается из архива, лайки остаются в базе
+            row = find_archived_tweet(current_app.config['TWEETS_ARCHIVE_DIR'], tweet_id)
+            if row is not None:
+                use_user_shard(row['author_id'])
+                tweet = Tweet(**row)
+                archived = True
+
+        if tweet is None or tweet.status != TWEET_PUBLISHED:
+            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Tweet not found"}), 404
+
+        likers = {tweet.id: [user_id for user_id, in db.session.query(Like.user_id).filter(
+            Like.tweet_id == tweet.id).order_by(Like.id)]}
+        tweet_data = render_tweets([tweet], likers)[0]
+        tweet_data["archived"] = archived
+        return jsonify({"result": True, "tweet": tweet_data}), 200
+
+    except Exception as e:
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
 @api_bp.route('/api/tweets/<int:tweet_id>', methods=['DELETE'])
 def delete_tweet(tweet_id):
     try:
@@ -120,18 +420,34 @@ def delete_tweet(tweet_id):
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
+        use_tweet_shard(tweet_id, write=True)
         tweet = Tweet.query.get(tweet_id)
-        if not tweet:
+        if not tweet or tweet.status == TWEET_DELETED:
             return jsonify({"result": False, "error_type": "NotFound", "error_message": "Tweet not found"}), 404
 
         if tweet.author_id != user.id:
             return jsonify({"result": False, "error_type": "Forbidden", "error_message": "You can only delete your own tweets"}), 403
 
-        db.session.delete(tweet)
+        if current_app.config.get('TWEETS_SOFT_DELETE', False):
+            # Твит только помечается и сразу пропадает из чтений (они берут опубликованные);
+            # строки, лайки и связи с медиа удаляет flask tweets reap
+            db.session.execute(sa.update(Tweet).where(Tweet.id == tweet_id).values(status=TWEET_DELETED))
+            db.session.commit()
+            return jsonify({"result": True}), 200
+
+        # Лайки и связи с медиа удаляются запросами в базе, без загрузки в сессию.
+        # ON DELETE CASCADE сделал бы это и сам, но SQLite не проверяет внешние ключи,
+        # а при шардировании связи с медиа лежат в основной базе, твит и его лайки - на шарде
+        db.session.execute(tweet_media.delete().where(tweet_media.c.tweet_id == tweet_id))
+        db.session.execute(sa.delete(Like).where(Like.tweet_id == tweet_id))
+        db.session.execute(sa.delete(Tweet).where(Tweet.id == tweet_id))
         db.session.commit()
 
         return jsonify({"result": True}), 200
 
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         db.session.rollback()
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -148,21 +464,30 @@ def like_tweet(tweet_id):
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
-        tweet = Tweet.query.get(tweet_id)
-        if not tweet:
-            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Tweet not found"}), 404
+        # Лайки лежат на шарде твита, несуществующий твит дает NOT_FOUND ниже
+        use_tweet_shard(tweet_id, write=True)
+
+        # В режиме write-behind лайк пишется в журнал и сбрасывается в базу пачкой
+        buffer = current_app.extensions.get('like_write_behind')
+        if buffer is not None:
+            status = buffer.like(user.id, tweet_id)
+        else:
+            # Один запрос INSERT ... ON CONFLICT DO NOTHING вместо проверки и вставки
+            status = add_like(user.id, tweet_id)
 
-        # Проверяем, что лайк еще не существует
-        existing_like = Like.query.filter_by(user_id=user.id, tweet_id=tweet_id).first()
-        if existing_like:
+        if status == NOT_FOUND:
+            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Tweet not found"}), 404
+        if status == EXISTS:
             return jsonify({"result": False, "error_type": "Conflict", "error_message": "Tweet already liked"}), 409
 
-        like = Like(user_id=user.id, tweet_id=tweet_id)
-        db.session.add(like)
-        db.session.commit()
+        if buffer is None:
+            db.session.commit()
 
         return jsonify({"result": True}), 200
 
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         db.session.rollback()
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -179,19 +504,28 @@ def unlike_tweet(tweet_id):
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
-        tweet = Tweet.query.get(tweet_id)
-        if not tweet:
-            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Tweet not found"}), 404
+        # Лайки лежат на шарде твита, несуществующий твит дает NOT_FOUND ниже
+        use_tweet_shard(tweet_id, write=True)
+
+        buffer = current_app.extensions.get('like_write_behind')
+        if buffer is not None:
+            status = buffer.unlike(user.id, tweet_id)
+        else:
+            status = remove_like(user.id, tweet_id)
 
-        like = Like.query.filter_by(user_id=user.id, tweet_id=tweet_id).first()
-        if not like:
+        if status == NOT_FOUND:
+            return jsonify({"result": False, "error_type": "NotFound", "error_message": "Tweet not found"}), 404
+        if status == ABSENT:
             return jsonify({"result": False, "error_type": "NotFound", "error_message": "Like not found"}), 404
 
-        db.session.delete(like)
-        db.session.commit()
+        if buffer is None:
+            db.session.commit()
 
         return jsonify({"result": True}), 200
 
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         db.session.rollback()
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -208,24 +542,27 @@ def follow_user(user_id):
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
-        target_user = User.query.get(user_id)
-        if not target_user:
-            return jsonify({"result": False, "error_type": "NotFound", "error_message": "User not found"}), 404
-
-        if user.id == target_user.id:
+        # Текущий пользователь всегда существует, поэтому проверка на себя не требует запроса
+        if user.id == user_id:
             return jsonify({"result": False, "error_type": "BadRequest", "error_message": "You cannot follow yourself"}), 400
 
-        # Проверяем, что подписка еще не существует
-        existing_follow = Follow.query.filter_by(follower_id=user.id, following_id=target_user.id).first()
-        if existing_follow:
+        shards = get_shards()
+        if shards is not None:
+            status = add_follow_on_shards(shards, user.id, user_id)
+        else:
+            status = add_follow(user.id, user_id)
+        if status == NOT_FOUND:
+            return jsonify({"result": False, "error_type": "NotFound", "error_message": "User not found"}), 404
+        if status == EXISTS:
             return jsonify({"result": False, "error_type": "Conflict", "error_message": "Already following this user"}), 409
 
-        follow = Follow(follower_id=user.id, following_id=target_user.id)
-        db.session.add(follow)
         db.session.commit()
 
         return jsonify({"result": True}), 200
 
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         db.session.rollback()
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -242,25 +579,30 @@ def unfollow_user(user_id):
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
-        target_user = User.query.get(user_id)
-        if not target_user:
+        shards = get_shards()
+        if shards is not None:
+            status = remove_follow_on_shards(shards, user.id, user_id)
+        else:
+            status = remove_follow(user.id, user_id)
+        if status == NOT_FOUND:
             return jsonify({"result": False, "error_type": "NotFound", "error_message": "User not found"}), 404
-
-        follow = Follow.query.filter_by(follower_id=user.id, following_id=target_user.id).first()
-        if not follow:
+        if status == ABSENT:
             return jsonify({"result": False, "error_type": "NotFound", "error_message": "Not following this user"}), 404
 
-        db.session.delete(follow)
         db.session.commit()
 
         return jsonify({"result": True}), 200
 
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         db.session.rollback()
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
 
 
 @api_bp.route('/api/tweets', methods=['GET'])
+@replica_reads
 def get_tweets():
     try:
         api_key = request.headers.get('api-key')
@@ -271,34 +613,41 @@ def get_tweets():
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
-        # Получаем ID пользователей, на которых подписан текущий пользователь
+        # Получаем ID пользователей, на которых подписан текущий пользователь (с его шарда)
+        use_user_shard(user.id)
         following_ids = [follow.following_id for follow in Follow.query.filter_by(follower_id=user.id).all()]
         # Добавляем собственный ID, чтобы показывать и свои твиты тоже
         following_ids.append(user.id)
 
-        # Сортировка по дате создания (новые твиты сначала)
-        tweets = db.session.query(Tweet).filter(
-            Tweet.author_id.in_(following_ids)
-        ).order_by(Tweet.created_at.desc()).all()
-
-        result_tweets = []
-        for tweet in tweets:
-            tweet_data = {
-                "id": tweet.id,
-                "content": tweet.content,
-                "attachments": [media.get_url() for media in tweet.media],
-                "author": {
-                    "id": tweet.author.id,
-                    "name": tweet.author.name
-                },
-                "likes": [
-                    {
-                        "user_id": like.user.id,
-                        "name": like.user.name
-                    } for like in tweet.likes
-                ]
-            }
-            result_tweets.append(tweet_data)
+        # В секционированной таблице лента читает только последние месяцы
+        since = timeline_since()
+
+        # Твиты авторов лежат на разных шардах: опрашиваем их параллельно и сливаем по id
+        shards = get_shards()
+        if shards is not None:
+            return jsonify({"result": True, "tweets": sharded_timeline(shards, following_ids, since)}), 200
+
+        # Сортировка по дате создания (новые твиты сначала); id по времени упорядочены так же
+        # и не совпадают у твитов одной миллисекунды
+        order = Tweet.id.desc() if snowflake_enabled() else Tweet.created_at.desc()
+        query = db.session.query(Tweet.id, Tweet.content, Tweet.author_id).filter(
+            id_in(Tweet.author_id, following_ids),
+            Tweet.status == TWEET_PUBLISHED
+        )
+        if since is not None:
+            query = query.filter(Tweet.created_at >= since)
+        result_tweets = render_tweets(query.order_by(order).all())
+
+        # Read-your-writes: накладываем еще не сброшенные лайки текущего пользователя
+        buffer = current_app.extensions.get('like_write_behind')
+        pending_likes = buffer.pending_for_user(user.id) if buffer is not None else {}
+
+        for tweet_data in result_tweets:
+            pending = pending_likes.get(tweet_data["id"])
+            if pending is not None:
+                tweet_data["likes"] = [like for like in tweet_data["likes"] if like["user_id"] != user.id]
+                if pending == 'like':
+                    tweet_data["likes"].append({"user_id": user.id, "name": user.name})
 
         return jsonify({"result": True, "tweets": result_tweets}), 200
 
@@ -307,6 +656,7 @@ def get_tweets():
 
 
 @api_bp.route('/api/users/me', methods=['GET'])
+@replica_reads
 def get_current_user():
     try:
         api_key = request.headers.get('api-key')
@@ -317,6 +667,8 @@ def get_current_user():
         if not user:
             return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
 
+        # Подписки и подписчики лежат на шарде пользователя
+        use_user_shard(user.id)
         followers = [
             {
                 "id": follower.follower.id,
@@ -344,13 +696,38 @@ def get_current_user():
         return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
 
 
+@api_bp.route('/api/users/me', methods=['DELETE'])
+def delete_current_user():
+    try:
+        api_key = request.headers.get('api-key')
+        if not api_key:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401
+
+        user = get_user_by_api_key(api_key)
+        if not user:
+            return jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401
+
+        # Аккаунт только помечается: твиты, лайки и медиа порциями удаляет flask users purge
+        user.deleted_at = datetime.utcnow()
+        db.session.commit()
+
+        return jsonify({"result": True}), 202
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
 @api_bp.route('/api/users/<int:user_id>', methods=['GET'])
+@replica_reads
 def get_user(user_id):
     try:
         user = User.query.get(user_id)
-        if not user:
+        if not user or user.deleted_at is not None:
             return jsonify({"result": False, "error_type": "NotFound", "error_message": "User not found"}), 404
 
+        # Подписки и подписчики лежат на шарде пользователя
+        use_user_shard(user.id)
         followers = [
             {
                 "id": follower.follower.id,
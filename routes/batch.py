@@ -0,0 +1,222 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import Blueprint, request, jsonify, current_app
+
+from models.models import (db, Tweet, Media, tweet_media, MEDIA_PROCESSING, MEDIA_FAILED,
+                           TWEET_PENDING, TWEET_PUBLISHED)
+from utils.auth import get_user_by_api_key
+from utils.media_processing import publish_ready_tweets
+from utils.sharding import ShardMovingError, get_shards, use_user_shard
+from utils.snowflake import new_tweet_ids
+from utils.upserts import bulk_add_likes, bulk_add_follows, CREATED, EXISTS, NOT_FOUND
+from utils.validators import is_id, validate_tweet_payload
+
+
+batch_bp = Blueprint('batch', __name__)
+
+
+def _ok(index, **extra):
+    return dict({"index": index, "result": True}, **extra)
+
+
+def _error(index, error_type, error_message):
+    return {"index": index, "result": False, "error_type": error_type, "error_message": error_message}
+
+
+def _load_batch():
+    """
+    Общая часть пакетных обработчиков: аутентификация и разбор списка операций.
+    Возвращает (user, items, None) или (None, None, ответ с ошибкой)
+    """
+    api_key = request.headers.get('api-key')
+    if not api_key:
+        return None, None, (jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401)
+
+    user = get_user_by_api_key(api_key)
+    if not user:
+        return None, None, (jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401)
+
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, None, (jsonify({"result": False, "error_type": "BadRequest", "error_message": "items must be a non-empty list"}), 400)
+
+    max_items = current_app.config.get('BATCH_MAX_ITEMS', 10000)
+    if len(items) > max_items:
+        return None, None, (jsonify({"result": False, "error_type": "ValidationError", "error_message": f"Too many items (max {max_items})"}), 400)
+
+    return user, items, None
+
+
+def _relation_batch(user, items, field, bulk_insert, messages):
+    """
+    Пакетная вставка связей (лайки, подписки) текущего пользователя.
+    messages - тексты ошибок для NOT_FOUND и EXISTS
+    """
+    results = [None] * len(items)
+    pairs = {}
+    for index, item in enumerate(items):
+        target_id = item.get(field) if isinstance(item, dict) else None
+        if not is_id(target_id):
+            results[index] = _error(index, "ValidationError", f"{field} must be an integer")
+        elif field == 'user_id' and target_id == user.id:
+            results[index] = _error(index, "BadRequest", "You cannot follow yourself")
+        elif (user.id, target_id) in pairs:
+            results[index] = _error(index, "Conflict", "Duplicate item in batch")
+        else:
+            pairs[(user.id, target_id)] = index
+
+    statuses = bulk_insert(list(pairs), chunk_size=current_app.config.get('BATCH_CHUNK_SIZE', 500))
+    for pair, index in pairs.items():
+        status = statuses[pair]
+        if status == CREATED:
+            results[index] = _ok(index)
+        elif status == NOT_FOUND:
+            results[index] = _error(index, "NotFound", messages[NOT_FOUND])
+        else:
+            results[index] = _error(index, "Conflict", messages[EXISTS])
+
+    db.session.commit()
+    return results
+
+
+@batch_bp.route('/api/batch/likes', methods=['POST'])
+def batch_likes():
+    try:
+        user, items, error = _load_batch()
+        if error:
+            return error
+
+        # Связи пачки разбросаны по шардам: многострочная вставка в одну базу невозможна
+        if get_shards() is not None:
+            return jsonify({"result": False, "error_type": "NotImplemented", "error_message": "Batch likes are not available with sharding"}), 501
+
+        results = _relation_batch(user, items, 'tweet_id', bulk_add_likes, {
+            NOT_FOUND: "Tweet not found",
+            EXISTS: "Tweet already liked",
+        })
+        return jsonify({"result": True, "results": results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@batch_bp.route('/api/batch/follows', methods=['POST'])
+def batch_follows():
+    try:
+        user, items, error = _load_batch()
+        if error:
+            return error
+
+        # Связи пачки разбросаны по шардам: многострочная вставка в одну базу невозможна
+        if get_shards() is not None:
+            return jsonify({"result": False, "error_type": "NotImplemented", "error_message": "Batch follows are not available with sharding"}), 501
+
+        results = _relation_batch(user, items, 'user_id', bulk_add_follows, {
+            NOT_FOUND: "User not found",
+            EXISTS: "Already following this user",
+        })
+        return jsonify({"result": True, "results": results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@batch_bp.route('/api/batch/tweets', methods=['POST'])
+def batch_tweets():
+    try:
+        user, items, error = _load_batch()
+        if error:
+            return error
+
+        # Все твиты пачки принадлежат одному автору и лежат на его шарде
+        use_user_shard(user.id, write=True)
+
+        max_media = current_app.config.get('MAX_TWEET_MEDIA', 10)
+        chunk_size = current_app.config.get('BATCH_CHUNK_SIZE', 500)
+        results = [None] * len(items)
+        pending_ids = []
+
+        valid = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = _error(index, "ValidationError", "Item must be an object")
+                continue
+            tweet_data = item.get('tweet_data', '')
+            media_ids = item.get('tweet_media_ids', [])
+            message = validate_tweet_payload(tweet_data, media_ids, max_media)
+            if message:
+                results[index] = _error(index, "ValidationError", message)
+                continue
+            valid.append((index, tweet_data, list(dict.fromkeys(media_ids))))
+
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+
+            # Вложения всей пачки - одним запросом IN с фильтром по владельцу
+            requested = {media_id for _, _, media_ids in chunk for media_id in media_ids}
+            owned = {}
+            if requested:
+                owned = dict(db.session.query(Media.id, Media.status).filter(
+                    Media.id.in_(requested),
+                    Media.owner_id == user.id,
+                    Media.status != MEDIA_FAILED
+                ))
+            owned_ids = set(owned)
+
+            rows = []
+            for index, tweet_data, media_ids in chunk:
+                if not tweet_data and not owned_ids.intersection(media_ids):
+                    results[index] = _error(index, "ValidationError", "Either tweet text or media is required")
+                else:
+                    rows.append((index, tweet_data, media_ids))
+            if not rows:
+                continue
+
+            now = datetime.utcnow()
+            statuses = [
+                TWEET_PENDING if any(owned.get(media_id) == MEDIA_PROCESSING for media_id in media_ids)
+                else TWEET_PUBLISHED
+                for _, _, media_ids in rows
+            ]
+            values = [{"content": tweet_data, "author_id": user.id, "status": status, "created_at": now}
+                      for (_, tweet_data, _), status in zip(rows, statuses)]
+            tweet_ids = new_tweet_ids(len(rows), user.id)
+            if tweet_ids:
+                # Id назначены заранее: обычная многострочная вставка без RETURNING
+                for row, tweet_id in zip(values, tweet_ids):
+                    row["id"] = tweet_id
+                db.session.execute(sa.insert(Tweet), values)
+            else:
+                # Многострочный INSERT ... RETURNING id с сохранением порядка строк
+                tweet_ids = db.session.scalars(
+                    sa.insert(Tweet).returning(Tweet.id, sort_by_parameter_order=True), values
+                ).all()
+
+            links = []
+            for (index, _, media_ids), tweet_id, status in zip(rows, tweet_ids, statuses):
+                links.extend({"tweet_id": tweet_id, "media_id": media_id}
+                             for media_id in media_ids if media_id in owned_ids)
+                if status == TWEET_PENDING:
+                    pending_ids.append(tweet_id)
+                results[index] = _ok(index, tweet_id=tweet_id, status=status, invalid_media_ids=[
+                    media_id for media_id in media_ids if media_id not in owned_ids
+                ])
+            if links:
+                db.session.execute(tweet_media.insert(), links)
+
+        db.session.commit()
+        if pending_ids:
+            # Вложения могли стать готовыми, пока твиты создавались
+            publish_ready_tweets(pending_ids)
+        return jsonify({"result": True, "results": results}), 200
+
+    except ShardMovingError as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "ServiceUnavailable", "error_message": str(e)}), 503, {"Retry-After": "1"}
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -0,0 +1,32 @@
+from flask import Blueprint, jsonify, current_app
+
+from models.models import db
+from models.session import READ_ENGINE
+from utils.db_pool import pool_stats
+from utils.db_replicas import REPLICAS
+
+
+# Служебные метрики процесса; снаружи закрыты в nginx
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/api/metrics/db-pool', methods=['GET'])
+def db_pool_metrics():
+    """
+    Состояние пула соединений воркера, обработавшего запрос (pid в ответе)
+    """
+    try:
+        pools = {"primary": pool_stats(db.engine)}
+        reader = current_app.extensions.get(READ_ENGINE)
+        if reader is not None:
+            pools["read"] = pool_stats(reader)
+        result = {"result": True, "pools": pools}
+        replica_set = current_app.extensions.get(REPLICAS)
+        if replica_set is not None:
+            for replica in replica_set.replicas:
+                pools[replica.name] = pool_stats(replica.engine)
+            result["replicas"] = [replica.state() for replica in replica_set.replicas]
+        return jsonify(result), 200
+
+    except Exception as e:
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -0,0 +1,183 @@
+from flask import Blueprint, request, jsonify, current_app
+from werkzeug.utils import secure_filename
+
+from models.models import db
+from routes.api import allowed_file, async_upload_requested, media_state
+from utils.auth import get_user_by_api_key
+from utils.idempotency import idempotent
+from utils.media_storage import hash_file, save_media, MediaValidationError
+from utils.media_processing import enqueue_media
+from utils.resumable_uploads import (create_session, get_session, append_chunk, discard_session,
+                                     parse_checksum, part_path, ChunkError)
+
+
+# Докачиваемые загрузки: создать сессию, отправить части PUT с позицией, завершить
+resumable_bp = Blueprint('resumable', __name__)
+
+
+def _authenticate():
+    """
+    Возвращает (user, None) или (None, ответ с ошибкой)
+    """
+    api_key = request.headers.get('api-key')
+    if not api_key:
+        return None, (jsonify({"result": False, "error_type": "Unauthorized", "error_message": "API key is required"}), 401)
+
+    user = get_user_by_api_key(api_key)
+    if not user:
+        return None, (jsonify({"result": False, "error_type": "Unauthorized", "error_message": "Invalid API key"}), 401)
+    return user, None
+
+
+def _session_not_found():
+    return jsonify({"result": False, "error_type": "NotFound", "error_message": "Upload session not found"}), 404
+
+
+def _session_state(upload_session):
+    return {
+        "result": True,
+        "upload_id": upload_session.id,
+        "offset": upload_session.upload_offset,
+        "size": upload_session.total_size,
+    }
+
+
+@resumable_bp.route('/api/medias/uploads', methods=['POST'])
+def create_upload():
+    try:
+        user, error = _authenticate()
+        if error:
+            return error
+
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(str(data.get('filename') or ''))
+        size = data.get('size')
+        if not filename or not allowed_file(filename):
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "File type not allowed"}), 400
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "size must be a positive integer"}), 400
+        if size > current_app.config.get('RESUMABLE_UPLOAD_MAX_SIZE', 100 * 1024 * 1024):
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "File is too large"}), 413
+
+        extension = filename.rsplit('.', 1)[1].lower()
+        upload_session = create_session(user.id, extension, size)
+
+        state = _session_state(upload_session)
+        state["chunk_size"] = current_app.config.get('RESUMABLE_CHUNK_MAX_SIZE', 8 * 1024 * 1024)
+        return jsonify(state), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@resumable_bp.route('/api/medias/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    try:
+        user, error = _authenticate()
+        if error:
+            return error
+
+        # После обрыва связи клиент узнает отсюда, с какой позиции продолжать
+        upload_session = get_session(upload_id, user.id)
+        if upload_session is None:
+            return _session_not_found()
+        return jsonify(_session_state(upload_session)), 200
+
+    except Exception as e:
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@resumable_bp.route('/api/medias/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        user, error = _authenticate()
+        if error:
+            return error
+
+        upload_session = get_session(upload_id, user.id)
+        if upload_session is None:
+            return _session_not_found()
+
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None or offset < 0:
+            return jsonify({"result": False, "error_type": "BadRequest", "error_message": "Upload-Offset header is required"}), 400
+        digest = parse_checksum(request.headers.get('Upload-Checksum'))
+        if digest is None:
+            return jsonify({"result": False, "error_type": "BadRequest", "error_message": "Upload-Checksum must be 'sha256 <base64>'"}), 400
+        length = request.content_length
+        if length is None:
+            return jsonify({"result": False, "error_type": "BadRequest", "error_message": "Content-Length is required"}), 411
+        if length == 0 or length > current_app.config.get('RESUMABLE_CHUNK_MAX_SIZE', 8 * 1024 * 1024):
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": "Invalid chunk size"}), 413
+
+        # Тело читаем потоком: Werkzeug не разбирает его как форму и не буферизует
+        try:
+            new_offset = append_chunk(upload_session, offset, request.stream, length, digest)
+        except ChunkError as e:
+            return jsonify({"result": False, "error_type": e.error_type, "error_message": str(e)}), e.status
+
+        return jsonify({"result": True, "upload_id": upload_id, "offset": new_offset}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@resumable_bp.route('/api/medias/uploads/<upload_id>/complete', methods=['POST'])
+@idempotent
+def complete_upload(upload_id):
+    try:
+        user, error = _authenticate()
+        if error:
+            return error
+
+        upload_session = get_session(upload_id, user.id)
+        if upload_session is None:
+            return _session_not_found()
+        if upload_session.upload_offset != upload_session.total_size:
+            return jsonify({"result": False, "error_type": "Conflict",
+                            "error_message": f"Upload is incomplete: {upload_session.upload_offset} of {upload_session.total_size} bytes"}), 409
+
+        # Сессия удаляется в той же транзакции, что создает Media
+        if async_upload_requested():
+            db.session.delete(upload_session)
+            media = enqueue_media(part_path(upload_id), upload_session.extension, user.id)
+            return jsonify({"result": True, **media_state(media)}), 202
+
+        upload = hash_file(part_path(upload_id), upload_session.extension)
+        db.session.delete(upload_session)
+        try:
+            media = save_media(upload, upload_session.extension, user.id)
+        except MediaValidationError as e:
+            # Собранный файл не станет корректным при повторе - удаляем сессию
+            db.session.commit()
+            upload.discard()
+            return jsonify({"result": False, "error_type": "ValidationError", "error_message": str(e)}), 400
+
+        return jsonify({"result": True, "media_id": media.id,
+                        "width": media.width, "height": media.height}), 201
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
+
+
+@resumable_bp.route('/api/medias/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    try:
+        user, error = _authenticate()
+        if error:
+            return error
+
+        upload_session = get_session(upload_id, user.id)
+        if upload_session is None:
+            return _session_not_found()
+
+        discard_session(upload_session)
+        db.session.commit()
+        return jsonify({"result": True}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"result": False, "error_type": "InternalServerError", "error_message": str(e)}), 500
@@ -23,6 +23,13 @@ swagger_spec = {
                         "required": True,
                         "type": "string",
                         "description": "API ключ пользователя"
+                    },
+                    {
+                        "name": "Idempotency-Key",
+                        "in": "header",
+                        "required": False,
+                        "type": "string",
+                        "description": "Ключ идемпотентности: повтор запроса с тем же ключом возвращает сохраненный ответ"
                     }
                 ],
                 "requestBody": {
@@ -62,6 +69,11 @@ swagger_spec = {
                                         },
                                         "tweet_id": {
                                             "type": "integer"
+                                        },
+                                        "status": {
+                                            "type": "string",
+                                            "enum": ["published", "pending"],
+                                            "description": "pending - твит будет опубликован, когда вложения обработаются"
                                         }
                                     }
                                 }
@@ -118,6 +130,20 @@ swagger_spec = {
                         "required": True,
                         "type": "string",
                         "description": "API ключ пользователя"
+                    },
+                    {
+                        "name": "async",
+                        "in": "query",
+                        "required": False,
+                        "type": "boolean",
+                        "description": "Обработать файл в фоне: ответ 202 со status processing сразу после приема"
+                    },
+                    {
+                        "name": "Idempotency-Key",
+                        "in": "header",
+                        "required": False,
+                        "type": "string",
+                        "description": "Ключ идемпотентности: повтор запроса с тем же ключом возвращает сохраненный ответ"
                     }
                 ],
                 "requestBody": {
@@ -149,16 +175,436 @@ swagger_spec = {
                                         },
                                         "media_id": {
                                             "type": "integer"
+                                        },
+                                        "width": {
+                                            "type": "integer"
+                                        },
+                                        "height": {
+                                            "type": "integer"
                                         }
                                     }
                                 }
                             }
                         }
+                    },
+                    "202": {
+                        "description": "Файл принят и обрабатывается в фоне; состояние - GET /api/medias/{media_id}",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "$ref": "#/components/schemas/MediaState"
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        "/api/medias/{media_id}": {
+            "get": {
+                "summary": "Состояние загруженного медиа",
+                "description": "Возвращает состояние обработки медиа владельцу; пока status = processing, ответ содержит Retry-After",
+                "parameters": [
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    },
+                    {
+                        "name": "media_id",
+                        "in": "path",
+                        "required": True,
+                        "type": "integer",
+                        "description": "ID медиа"
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Состояние медиа",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "$ref": "#/components/schemas/MediaState"
+                                }
+                            }
+                        }
+                    },
+                    "404": {
+                        "description": "Медиа не найдено"
+                    }
+                }
+            }
+        },
+        "/api/medias/uploads": {
+            "post": {
+                "summary": "Создать сессию докачиваемой загрузки",
+                "description": "Создает сессию, в которую файл отправляется частями",
+                "parameters": [
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "filename": {
+                                        "type": "string"
+                                    },
+                                    "size": {
+                                        "type": "integer"
+                                    }
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "201": {
+                        "description": "Сессия создана",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "$ref": "#/components/schemas/UploadSession"
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        "/api/medias/uploads/{upload_id}": {
+            "get": {
+                "summary": "Состояние загрузки",
+                "description": "Возвращает позицию, с которой нужно продолжить загрузку",
+                "parameters": [
+                    {
+                        "name": "upload_id",
+                        "in": "path",
+                        "required": True,
+                        "type": "string",
+                        "description": "ID сессии загрузки"
+                    },
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Состояние сессии",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "$ref": "#/components/schemas/UploadSession"
+                                }
+                            }
+                        }
+                    }
+                }
+            },
+            "put": {
+                "summary": "Загрузить часть файла",
+                "description": "Дописывает часть файла с позиции Upload-Offset после проверки контрольной суммы",
+                "parameters": [
+                    {
+                        "name": "upload_id",
+                        "in": "path",
+                        "required": True,
+                        "type": "string",
+                        "description": "ID сессии загрузки"
+                    },
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    },
+                    {
+                        "name": "Upload-Offset",
+                        "in": "header",
+                        "required": True,
+                        "type": "integer",
+                        "description": "Позиция части в файле, должна совпадать с текущей позицией сессии"
+                    },
+                    {
+                        "name": "Upload-Checksum",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "Контрольная сумма части: sha256 <base64>"
+                    }
+                ],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/offset+octet-stream": {
+                            "schema": {
+                                "type": "string",
+                                "format": "binary"
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "200": {
+                        "description": "Часть принята",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "$ref": "#/components/schemas/UploadSession"
+                                }
+                            }
+                        }
+                    }
+                }
+            },
+            "delete": {
+                "summary": "Отменить загрузку",
+                "description": "Удаляет сессию и принятые части файла",
+                "parameters": [
+                    {
+                        "name": "upload_id",
+                        "in": "path",
+                        "required": True,
+                        "type": "string",
+                        "description": "ID сессии загрузки"
+                    },
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Загрузка отменена"
+                    }
+                }
+            }
+        },
+        "/api/medias/uploads/{upload_id}/complete": {
+            "post": {
+                "summary": "Завершить загрузку",
+                "description": "Проверяет собранный файл и создает медиафайл",
+                "parameters": [
+                    {
+                        "name": "upload_id",
+                        "in": "path",
+                        "required": True,
+                        "type": "string",
+                        "description": "ID сессии загрузки"
+                    },
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    },
+                    {
+                        "name": "Idempotency-Key",
+                        "in": "header",
+                        "required": False,
+                        "type": "string",
+                        "description": "Ключ идемпотентности: повтор запроса с тем же ключом возвращает сохраненный ответ"
+                    }
+                ],
+                "responses": {
+                    "201": {
+                        "description": "Файл успешно загружен",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "result": {
+                                            "type": "boolean"
+                                        },
+                                        "media_id": {
+                                            "type": "integer"
+                                        },
+                                        "width": {
+                                            "type": "integer"
+                                        },
+                                        "height": {
+                                            "type": "integer"
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        "/api/medias/direct": {
+            "post": {
+                "summary": "Получить ссылку для прямой загрузки",
+                "description": "Возвращает подписанную ссылку для загрузки файла напрямую в объектное хранилище (MEDIA_STORAGE=s3)",
+                "parameters": [
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "filename": {
+                                        "type": "string"
+                                    },
+                                    "size": {
+                                        "type": "integer"
+                                    }
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "201": {
+                        "description": "Ссылка создана",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "result": {
+                                            "type": "boolean"
+                                        },
+                                        "key": {
+                                            "type": "string"
+                                        },
+                                        "upload_url": {
+                                            "type": "string"
+                                        },
+                                        "method": {
+                                            "type": "string"
+                                        },
+                                        "headers": {
+                                            "type": "object"
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        "/api/medias/direct/complete": {
+            "post": {
+                "summary": "Завершить прямую загрузку",
+                "description": "Проверяет загруженный в хранилище файл и создает медиафайл",
+                "parameters": [
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "key": {
+                                        "type": "string"
+                                    }
+                                }
+                            }
+                        }
+                    }
+                },
+                "responses": {
+                    "201": {
+                        "description": "Файл успешно загружен"
                     }
                 }
             }
         },
         "/api/tweets/{id}": {
+            "get": {
+                "summary": "Получить твит",
+                "description": "Получает опубликованный твит по id; твиты из выгруженных секций читаются из архива",
+                "parameters": [
+                    {
+                        "name": "id",
+                        "in": "path",
+                        "required": True,
+                        "type": "integer",
+                        "description": "ID твита"
+                    },
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Твит",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "result": {
+                                            "type": "boolean"
+                                        },
+                                        "tweet": {
+                                            "allOf": [
+                                                {"$ref": "#/components/schemas/Tweet"},
+                                                {
+                                                    "type": "object",
+                                                    "properties": {
+                                                        "archived": {
+                                                            "type": "boolean",
+                                                            "description": "Твит прочитан из архива старых секций"
+                                                        }
+                                                    }
+                                                }
+                                            ]
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    },
+                    "404": {
+                        "description": "Твит не найден"
+                    }
+                }
+            },
             "delete": {
                 "summary": "Удалить твит",
                 "description": "Удаляет твит, если он принадлежит пользователю",
@@ -382,6 +828,36 @@ swagger_spec = {
                         }
                     }
                 }
+            },
+            "delete": {
+                "summary": "Удалить аккаунт",
+                "description": "Помечает аккаунт удаленным: API ключ перестает действовать, данные удаляются в фоне",
+                "parameters": [
+                    {
+                        "name": "api-key",
+                        "in": "header",
+                        "required": True,
+                        "type": "string",
+                        "description": "API ключ пользователя"
+                    }
+                ],
+                "responses": {
+                    "202": {
+                        "description": "Аккаунт помечен удаленным",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "result": {
+                                            "type": "boolean"
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
             }
         },
         "/api/users/{id}": {
@@ -418,10 +894,174 @@ swagger_spec = {
                     }
                 }
             }
+        },
+        "/api/metrics/db-pool": {
+            "get": {
+                "summary": "Метрики пула соединений",
+                "description": "Состояние пулов соединений воркера, обработавшего запрос, и проверок реплик; значение null - пул без счетчиков (база в памяти)",
+                "responses": {
+                    "200": {
+                        "description": "Состояние пулов: primary, read в производственном профиле SQLite и replica-N при настроенных репликах",
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "result": {
+                                            "type": "boolean",
+                                            "example": True
+                                        },
+                                        "pools": {
+                                            "type": "object",
+                                            "additionalProperties": {
+                                                "type": "object",
+                                                "properties": {
+                                                    "pid": {
+                                                        "type": "integer"
+                                                    },
+                                                    "size": {
+                                                        "type": "integer"
+                                                    },
+                                                    "in_use": {
+                                                        "type": "integer"
+                                                    },
+                                                    "idle": {
+                                                        "type": "integer"
+                                                    },
+                                                    "overflow": {
+                                                        "type": "integer"
+                                                    },
+                                                    "max_overflow": {
+                                                        "type": "integer"
+                                                    },
+                                                    "checkouts": {
+                                                        "type": "integer"
+                                                    },
+                                                    "timeouts": {
+                                                        "type": "integer"
+                                                    },
+                                                    "connects": {
+                                                        "type": "integer"
+                                                    },
+                                                    "wait_ms_avg": {
+                                                        "type": "number"
+                                                    },
+                                                    "wait_ms_max": {
+                                                        "type": "number"
+                                                    },
+                                                    "wait_histogram": {
+                                                        "type": "object",
+                                                        "additionalProperties": {
+                                                            "type": "integer"
+                                                        }
+                                                    }
+                                                }
+                                            }
+                                        },
+                                        "replicas": {
+                                            "type": "array",
+                                            "items": {
+                                                "type": "object",
+                                                "properties": {
+                                                    "name": {
+                                                        "type": "string"
+                                                    },
+                                                    "healthy": {
+                                                        "type": "boolean"
+                                                    },
+                                                    "lag_seconds": {
+                                                        "type": "number"
+                                                    },
+                                                    "error": {
+                                                        "type": "string"
+                                                    }
+                                                }
+                                            }
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
         }
     },
     "components": {
         "schemas": {
+            "MediaState": {
+                "type": "object",
+                "properties": {
+                    "result": {
+                        "type": "boolean"
+                    },
+                    "media_id": {
+                        "type": "integer"
+                    },
+                    "status": {
+                        "type": "string",
+                        "enum": ["processing", "ready", "failed"]
+                    },
+                    "url": {
+                        "type": "string",
+                        "description": "Только для status = ready"
+                    },
+                    "width": {
+                        "type": "integer"
+                    },
+                    "height": {
+                        "type": "integer"
+                    },
+                    "frame_count": {
+                        "type": "integer"
+                    },
+                    "error": {
+                        "type": "string",
+                        "description": "Причина ошибки для status = failed"
+                    }
+                }
+            },
+            "UploadSession": {
+                "type": "object",
+                "properties": {
+                    "result": {
+                        "type": "boolean"
+                    },
+                    "upload_id": {
+                        "type": "string"
+                    },
+                    "offset": {
+                        "type": "integer"
+                    },
+                    "size": {
+                        "type": "integer"
+                    }
+                }
+            },
+            "MediaMeta": {
+                "type": "object",
+                "properties": {
+                    "url": {
+                        "type": "string"
+                    },
+                    "width": {
+                        "type": "integer"
+                    },
+                    "height": {
+                        "type": "integer"
+                    },
+                    "frame_count": {
+                        "type": "integer"
+                    },
+                    "variants": {
+                        "type": "object",
+                        "description": "Готовые уменьшенные копии: размер по большей стороне -> URL",
+                        "additionalProperties": {
+                            "type": "string"
+                        }
+                    }
+                }
+            },
             "Tweet": {
                 "type": "object",
                 "properties": {
@@ -437,6 +1077,12 @@ swagger_spec = {
                             "type": "string"
                         }
                     },
+                    "attachments_meta": {
+                        "type": "array",
+                        "items": {
+                            "$ref": "#/components/schemas/MediaMeta"
+                        }
+                    },
                     "author": {
                         "$ref": "#/components/schemas/UserShort"
                     },
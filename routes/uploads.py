@@ -0,0 +1,83 @@
+import os
+
+from flask import Blueprint, abort, current_app, redirect, request, send_from_directory
+from werkzeug.security import safe_join
+
+from utils.media_layout import alternate_filename
+from utils.media_variants import negotiate_representation
+from utils.storage import LocalStorage, get_storage, content_type
+
+
+# Создаем blueprint для загруженных медиафайлов
+uploads_bp = Blueprint('uploads', __name__)
+
+# Имена файлов не меняются: новое содержимое получает новое имя (хэш)
+CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _upload_folder():
+    # Относительный путь считаем от корня приложения, как и send_from_directory
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+
+
+def _locate(folder, filename):
+    """
+    Во время миграции файл может лежать как в плоской папке, так и в ab/cd/
+    """
+    path = safe_join(folder, filename)
+    if path is None:
+        abort(404)
+    if not os.path.exists(path):
+        alternate = alternate_filename(filename)
+        # Для имен вида x/y/.. другой раскладкой получается '..', его safe_join отвергает
+        alternate_path = safe_join(folder, alternate)
+        if alternate_path is not None and os.path.exists(alternate_path):
+            return alternate
+    return filename
+
+
+def _accel_redirect(folder, representation):
+    """
+    Flask только выбирает файл, а отдает его nginx из internal location
+    """
+    path = safe_join(folder, representation)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = current_app.response_class(mimetype=content_type(representation))
+    prefix = current_app.config.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/')
+    response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + representation
+    return response
+
+
+@uploads_bp.route('/uploads/<path:filename>')
+def serve_uploaded_file(filename):
+    current_app.logger.debug('Serving uploaded file: %s', filename)
+    storage = get_storage()
+    if not storage.local:
+        # Файл отдает само хранилище (публичный адрес или подписанная ссылка)
+        representation = negotiate_representation(storage, filename, request.accept_mimetypes)
+        response = redirect(storage.url(representation))
+        response.vary.add('Accept')
+        return response
+
+    folder = _upload_folder()
+    filename = _locate(folder, filename)
+
+    # Отдаем самую легкую версию (AVIF, WebP или оригинал), которую понимает клиент
+    representation = negotiate_representation(LocalStorage(folder), filename, request.accept_mimetypes)
+    if current_app.config.get('UPLOADS_ACCEL_REDIRECT', False):
+        response = _accel_redirect(folder, representation)
+    else:
+        # Имя файла содержит хэш содержимого, поэтому подходит как строгий ETag.
+        # Range и условные запросы обрабатывает send_from_directory
+        response = send_from_directory(
+            folder, representation,
+            mimetype=content_type(representation),
+            etag=os.path.basename(representation),
+            max_age=CACHE_MAX_AGE,
+        )
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
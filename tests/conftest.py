@@ -20,6 +20,8 @@ def app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = 'uploads'
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['MEDIA_VARIANT_WORKERS'] = 0  # Уменьшенные копии создаются синхронно
+    app.config['MEDIA_PROCESSING_WORKERS'] = 0  # Фоновые загрузки обрабатывает тест (flask media process)
     
     # Инициализация расширений
     db.init_app(app)
@@ -31,8 +33,24 @@ def app():
         os.makedirs(app.config['UPLOAD_FOLDER'])
     
     # Регистрация blueprint'ов
+    from routes.uploads import uploads_bp
+    app.register_blueprint(uploads_bp)
+
     from routes.api import api_bp
     app.register_blueprint(api_bp)
+    from routes.batch import batch_bp
+    app.register_blueprint(batch_bp)
+    from routes.resumable import resumable_bp
+    app.register_blueprint(resumable_bp)
+    from routes.metrics import metrics_bp
+    app.register_blueprint(metrics_bp)
+    
+    from commands import media_cli, partitions_cli, shards_cli, tweets_cli, users_cli
+    app.cli.add_command(media_cli)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(tweets_cli)
     
     # Регистрация статических маршрутов
     from routes.static import register_static_routes
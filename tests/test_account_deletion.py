@@ -0,0 +1,84 @@
+import pytest
+import json
+from sqlalchemy import event
+from models.models import User, Tweet, Like, Follow, Media, UploadSession, tweet_media, db
+from datetime import datetime, timedelta
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def accounts(app):
+    """Удаляемый пользователь 1 с твитами, лайками, подписками и медиа; пользователь 2 остается"""
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(name='Leaving', api_key='leaving_key'), User(name='Staying', api_key='staying_key')])
+        db.session.flush()
+        media = Media(filename='leaving.png', owner_id=1)
+        tweets = [Tweet(content=f'Tweet {n}', author_id=1) for n in range(5)]
+        tweets[0].media.append(media)
+        other = Tweet(content='Other', author_id=2)
+        db.session.add_all(tweets + [other])
+        db.session.flush()
+        db.session.add_all([Like(user_id=2, tweet_id=tweet.id) for tweet in tweets])
+        db.session.add_all([
+            Like(user_id=1, tweet_id=other.id),
+            Follow(follower_id=1, following_id=2),
+            Follow(follower_id=2, following_id=1),
+            UploadSession(id='session', owner_id=1, extension='png', total_size=10,
+                          expires_at=datetime.utcnow() + timedelta(hours=1)),
+        ])
+        db.session.commit()
+        yield
+
+
+def test_delete_account_marks_user(client, accounts):
+    """Тестирование пометки аккаунта: ключ перестает действовать, профиль не виден"""
+    response = client.delete('/api/users/me', headers={'api-key': 'leaving_key'})
+    assert response.status_code == 202
+    assert json.loads(response.data)['result'] is True
+
+    assert client.get('/api/users/me', headers={'api-key': 'leaving_key'}).status_code == 401
+    assert client.get('/api/users/1').status_code == 404
+    # Данные удаляются фоновой командой, а не в запросе
+    assert Tweet.query.filter_by(author_id=1).count() == 5
+
+
+def test_purge_removes_account_in_chunks(app, client, runner, accounts, upload_folder):
+    """Тестирование порционного удаления данных аккаунта командой flask users purge"""
+    client.delete('/api/users/me', headers={'api-key': 'leaving_key'})
+
+    result = runner.invoke(args=['users', 'purge', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Purged 1 users: 5 tweets, 6 likes, 2 follows, 1 media' in result.output
+
+    assert db.session.get(User, 1) is None
+    assert Tweet.query.filter_by(author_id=1).count() == 0
+    assert Like.query.count() == 0 and Follow.query.count() == 0
+    assert Media.query.count() == 0 and UploadSession.query.count() == 0
+    assert db.session.execute(tweet_media.select()).all() == []
+    # Данные другого пользователя не тронуты
+    assert [tweet.content for tweet in Tweet.query.all()] == ['Other']
+
+    result = runner.invoke(args=['users', 'purge'])
+    assert 'Purged 0 users' in result.output
+
+
+def test_delete_tweet_removes_likes_without_loading(app, client, accounts):
+    """Тестирование удаления твита: лайки удаляются запросом в базе, без загрузки в сессию"""
+    statements = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    response = client.delete('/api/tweets/1', headers={'api-key': 'leaving_key'})
+    event.remove(db.engine, 'before_cursor_execute', _record)
+    assert response.status_code == 200
+    assert Like.query.filter_by(tweet_id=1).count() == 0
+    assert not any(statement.startswith('SELECT') and 'FROM likes' in statement for statement in statements)
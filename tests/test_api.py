@@ -1,5 +1,6 @@
 import pytest
 import json
+from PIL import Image
 from models.models import User, Tweet, Media, Like, Follow, db
 
 
@@ -76,7 +77,7 @@ def test_upload_media(app, client):
         
         # Создание временного файла для теста
         with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            temp_file.write(b'test image content')
+            Image.new('RGB', (40, 30), 'red').save(temp_file, format='JPEG')
             temp_file_path = temp_file.name
         
         try:
@@ -719,4 +720,60 @@ def test_exception_handling_in_get_user(app, client):
         response = client.get(f'/api/users/{user.id}')
         assert response.status_code == 200
         data = json.loads(response.data)
-        assert data['result'] is True
\ No newline at end of file
+        assert data['result'] is True
+
+def test_tweet_media_invalid_ids_reported(app, client):
+    """Тестирование отчета о невалидных вложениях"""
+    with app.app_context():
+        # Создание пользователей
+        user = User(name='Test User', api_key='test_api_key')
+        other = User(name='Other User', api_key='other_api_key')
+        db.session.add_all([user, other])
+        db.session.commit()
+
+        own_media = Media(filename='own.jpg', owner=user)
+        foreign_media = Media(filename='foreign.jpg', owner=other)
+        db.session.add_all([own_media, foreign_media])
+        db.session.commit()
+
+        # Чужое и несуществующее медиа не привязываются, но попадают в ответ
+        response = client.post(
+            '/api/tweets',
+            headers={'api-key': 'test_api_key'},
+            json={
+                'tweet_data': 'Tweet with mixed media',
+                'tweet_media_ids': [own_media.id, foreign_media.id, 99999, own_media.id]
+            }
+        )
+
+        assert response.status_code == 201
+        data = json.loads(response.data)
+        assert data['invalid_media_ids'] == [foreign_media.id, 99999]
+
+        tweet = Tweet.query.get(data['tweet_id'])
+        assert [media.id for media in tweet.media] == [own_media.id]
+
+
+def test_tweet_media_limit(app, client):
+    """Тестирование ограничения количества вложений"""
+    with app.app_context():
+        user = User(name='Test User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        app.config['MAX_TWEET_MEDIA'] = 2
+        response = client.post(
+            '/api/tweets',
+            headers={'api-key': 'test_api_key'},
+            json={'tweet_data': 'Too many', 'tweet_media_ids': [1, 2, 3]}
+        )
+        assert response.status_code == 400
+
+        # Твит без текста, у которого нет ни одного валидного вложения
+        response = client.post(
+            '/api/tweets',
+            headers={'api-key': 'test_api_key'},
+            json={'tweet_media_ids': [99999]}
+        )
+        assert response.status_code == 400
+        assert json.loads(response.data)['invalid_media_ids'] == [99999]
@@ -1,5 +1,6 @@
 import pytest
 import json
+from PIL import Image
 from models.models import User, Tweet, Media, Like, Follow, db
 from unittest.mock import patch
 
@@ -39,7 +40,7 @@ def test_upload_media_exception(app, client):
         
         # Создание временного файла для теста
         with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            temp_file.write(b'test image content')
+            Image.new('RGB', (40, 30), 'red').save(temp_file, format='JPEG')
             temp_file_path = temp_file.name
         
         try:
@@ -0,0 +1,118 @@
+import json
+from models.models import User, Tweet, Media, Like, Follow, db
+
+
+def test_batch_follows(app, client):
+    """Тестирование пакетной подписки"""
+    with app.app_context():
+        users = [User(name=f'User {i}', api_key=f'user{i}_api_key') for i in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add(Follow(follower=users[0], following=users[3]))
+        db.session.commit()
+
+        response = client.post(
+            '/api/batch/follows',
+            headers={'api-key': 'user0_api_key'},
+            json={'items': [
+                {'user_id': users[1].id},
+                {'user_id': users[2].id},
+                {'user_id': users[3].id},   # уже подписан
+                {'user_id': users[0].id},   # на себя
+                {'user_id': 99999},         # не существует
+                {'user_id': users[1].id},   # дубликат в пачке
+                {'user_id': 'abc'},
+            ]}
+        )
+
+        assert response.status_code == 200
+        results = json.loads(response.data)['results']
+        assert [item['result'] for item in results] == [True, True, False, False, False, False, False]
+        assert [item.get('error_type') for item in results[2:]] == [
+            'Conflict', 'BadRequest', 'NotFound', 'Conflict', 'ValidationError'
+        ]
+        assert Follow.query.filter_by(follower_id=users[0].id).count() == 3
+
+
+def test_batch_likes(app, client):
+    """Тестирование пакетных лайков"""
+    with app.app_context():
+        user = User(name='User', api_key='user_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        tweets = [Tweet(content=f'Tweet {i}', author=user) for i in range(3)]
+        db.session.add_all(tweets)
+        db.session.commit()
+        db.session.add(Like(user=user, tweet=tweets[0]))
+        db.session.commit()
+
+        response = client.post(
+            '/api/batch/likes',
+            headers={'api-key': 'user_api_key'},
+            json={'items': [{'tweet_id': tweet.id} for tweet in tweets] + [{'tweet_id': 99999}]}
+        )
+
+        results = json.loads(response.data)['results']
+        assert [item['result'] for item in results] == [False, True, True, False]
+        assert results[0]['error_type'] == 'Conflict'
+        assert results[3]['error_type'] == 'NotFound'
+        assert Like.query.count() == 3
+
+
+def test_batch_tweets(app, client):
+    """Тестирование пакетного создания твитов"""
+    with app.app_context():
+        user = User(name='User', api_key='user_api_key')
+        db.session.add(user)
+        db.session.commit()
+        media = Media(filename='image.jpg', owner=user)
+        db.session.add(media)
+        db.session.commit()
+
+        response = client.post(
+            '/api/batch/tweets',
+            headers={'api-key': 'user_api_key'},
+            json={'items': [
+                {'tweet_data': 'First'},
+                {'tweet_data': 'A' * 281},
+                {'tweet_media_ids': [media.id, 99999]},
+                {'tweet_media_ids': [99999]},
+                {'tweet_data': 42},
+                {'tweet_data': ['text']},
+                {'tweet_data': None, 'tweet_media_ids': [media.id]},
+            ]}
+        )
+
+        assert response.status_code == 200
+        results = json.loads(response.data)['results']
+        assert [item['result'] for item in results] == [True, False, True, False, False, False, False]
+        assert results[2]['invalid_media_ids'] == [99999]
+        assert results[1]['error_message'] == 'Tweet text too long (max 280 characters)'
+        assert {item['error_message'] for item in results[4:]} == {'tweet_data must be a string'}
+
+        tweet = Tweet.query.get(results[2]['tweet_id'])
+        assert [m.id for m in tweet.media] == [media.id]
+        assert Tweet.query.get(results[0]['tweet_id']).content == 'First'
+        assert Tweet.query.count() == 2
+
+
+def test_batch_validation(app, client):
+    """Тестирование ошибок запроса к пакетным операциям"""
+    with app.app_context():
+        user = User(name='User', api_key='user_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        assert client.post('/api/batch/likes', json={'items': []}).status_code == 401
+
+        response = client.post('/api/batch/likes', headers={'api-key': 'user_api_key'}, json={'items': []})
+        assert response.status_code == 400
+
+        app.config['BATCH_MAX_ITEMS'] = 2
+        response = client.post(
+            '/api/batch/follows',
+            headers={'api-key': 'user_api_key'},
+            json={'items': [{'user_id': 1}] * 3}
+        )
+        assert response.status_code == 400
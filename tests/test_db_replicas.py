@@ -0,0 +1,117 @@
+import pytest
+import json
+import sqlalchemy as sa
+from app import create_app
+from models.models import db, User
+from utils import db_replicas
+from utils.db_replicas import REPLICAS, STICKY_COOKIE
+
+HEADERS = {'api-key': 'test_api_key'}
+
+
+def _seed(engine, name):
+    """Одинаковый пользователь с разным именем: по имени видно, какая база ответила"""
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(sa.insert(User), {"id": 1, "name": name, "api_key": 'test_api_key'})
+
+
+@pytest.fixture
+def replica_app(tmp_path, monkeypatch):
+    """Основная база и две реплики - отдельные файлы SQLite"""
+    replicas = []
+    for index in range(2):
+        path = tmp_path / f'replica-{index}.db'
+        engine = sa.create_engine(f'sqlite:///{path}')
+        _seed(engine, f'Replica {index}')
+        engine.dispose()
+        replicas.append(f'sqlite:///{path}')
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path}/primary.db')
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', ','.join(replicas))
+    monkeypatch.setenv('REPLICA_CHECK_INTERVAL', '0')
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        _seed(db.engine, 'Primary')
+        yield app
+        db.session.remove()
+        for replica in app.extensions[REPLICAS].replicas:
+            replica.engine.dispose()
+        db.engine.dispose()
+
+
+def _reader(client, url='/api/users/me'):
+    response = client.get(url, headers=HEADERS)
+    assert response.status_code == 200
+    return json.loads(response.data)['user']['name']
+
+
+def test_reads_round_robin(replica_app):
+    """Тестирование чтения с реплик по кругу"""
+    client = replica_app.test_client()
+    assert [_reader(client) for _ in range(4)] == ['Replica 0', 'Replica 1', 'Replica 0', 'Replica 1']
+    assert _reader(client, '/api/users/1') == 'Replica 0'
+
+
+def test_writes_go_to_primary(replica_app):
+    """Тестирование записи и эндпоинтов, не помеченных для реплик"""
+    client = replica_app.test_client()
+    response = client.post('/api/tweets', headers=HEADERS, json={'tweet_data': 'Hello'})
+    assert response.status_code == 201
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT content FROM tweets').scalars().all() == ['Hello']
+
+
+def test_read_your_writes(replica_app):
+    """Тестирование окна чтения из основной базы после записи"""
+    client = replica_app.test_client()
+    response = client.post('/api/tweets', headers=HEADERS, json={'tweet_data': 'Hello'})
+    assert STICKY_COOKIE in response.headers['Set-Cookie']
+
+    # Тот же процесс узнает автора записи по api-key, даже без куки
+    assert _reader(replica_app.test_client()) == 'Primary'
+    # Другой воркер ничего не знает о записи, но клиент приносит куку
+    replica_app.extensions[REPLICAS]._sticky.clear()
+    assert _reader(client) == 'Primary'
+    tweets = json.loads(client.get('/api/tweets', headers=HEADERS).data)['tweets']
+    assert [tweet['content'] for tweet in tweets] == ['Hello']
+
+    # Окно закрылось
+    client.delete_cookie(STICKY_COOKIE)
+    assert _reader(client) == 'Replica 0'
+
+
+def test_failed_request_is_not_sticky(replica_app):
+    """Тестирование: неуспешная запись не переключает чтения на основную базу"""
+    client = replica_app.test_client()
+    assert client.delete('/api/tweets/999', headers=HEADERS).status_code == 404
+    assert _reader(client) == 'Replica 0'
+
+
+def test_unreachable_replica_skipped(replica_app):
+    """Тестирование пропуска недоступной реплики"""
+    replica_set = replica_app.extensions[REPLICAS]
+    replica_set.replicas[0].engine = sa.create_engine('sqlite:////nonexistent/dir/replica.db')
+    client = replica_app.test_client()
+    assert [_reader(client) for _ in range(3)] == ['Replica 1'] * 3
+
+    data = json.loads(client.get('/api/metrics/db-pool').data)
+    assert [replica['healthy'] for replica in data['replicas']] == [False, True]
+
+
+def test_lagging_replicas_fall_back_to_primary(replica_app, monkeypatch):
+    """Тестирование чтения из основной базы, когда все реплики отстают"""
+    monkeypatch.setattr(db_replicas, 'measure_lag', lambda connection: 60.0)
+    client = replica_app.test_client()
+    assert _reader(client) == 'Primary'
+    assert [replica.error for replica in replica_app.extensions[REPLICAS].replicas] == ['Replication lag 60.0s'] * 2
+
+    monkeypatch.setattr(db_replicas, 'measure_lag', lambda connection: 0.5)
+    assert _reader(client) == 'Replica 1'
+
+
+def test_no_replicas_configured(client):
+    """Тестирование без реплик: все чтения из основной базы"""
+    assert REPLICAS not in client.application.extensions
+    data = json.loads(client.get('/api/metrics/db-pool').data)
+    assert 'replicas' not in data
@@ -0,0 +1,137 @@
+import json
+from flask import jsonify
+from datetime import datetime, timedelta
+from models.models import User, Tweet, IdempotencyKey, db
+from utils.idempotency import _scope, _claim, _delete_stale, idempotent
+
+
+def test_create_tweet_replayed(app, client):
+    """Тестирование повтора запроса с тем же Idempotency-Key"""
+    with app.app_context():
+        user = User(name='Test User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'api-key': 'test_api_key', 'Idempotency-Key': 'retry-1'}
+        first = client.post('/api/tweets', headers=headers, json={'tweet_data': 'Only once'})
+        second = client.post('/api/tweets', headers=headers, json={'tweet_data': 'Only once'})
+
+        assert first.status_code == 201
+        assert second.status_code == 201
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert json.loads(second.data) == json.loads(first.data)
+        assert Tweet.query.count() == 1
+
+        # Другой ключ создает новый твит
+        headers['Idempotency-Key'] = 'retry-2'
+        client.post('/api/tweets', headers=headers, json={'tweet_data': 'Only once'})
+        assert Tweet.query.count() == 2
+
+
+def test_key_reused_with_different_body(app, client):
+    """Тестирование повторного использования ключа с другим телом запроса"""
+    with app.app_context():
+        user = User(name='Test User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'api-key': 'test_api_key', 'Idempotency-Key': 'same-key'}
+        client.post('/api/tweets', headers=headers, json={'tweet_data': 'First'})
+        response = client.post('/api/tweets', headers=headers, json={'tweet_data': 'Second'})
+
+        assert response.status_code == 422
+        assert Tweet.query.count() == 1
+
+
+def test_key_in_progress(app, client):
+    """Тестирование дубликата, пока первый запрос еще выполняется"""
+    with app.app_context():
+        user = User(name='Test User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        app.config['IDEMPOTENCY_WAIT_SECONDS'] = 0.1
+        app.config['IDEMPOTENCY_POLL_INTERVAL'] = 0.01
+
+        # Первый запрос "завис" - обработчик повторно не выполняется
+        headers = {'api-key': 'test_api_key', 'Idempotency-Key': 'slow-key'}
+        client.post('/api/tweets', headers=headers, json={'tweet_data': 'Slow'})
+        record = IdempotencyKey.query.filter_by(scope=_scope('test_api_key'), key='slow-key').first()
+        record.status = 'processing'
+        db.session.commit()
+
+        response = client.post('/api/tweets', headers=headers, json={'tweet_data': 'Slow'})
+        assert response.status_code == 409
+        assert Tweet.query.count() == 1
+
+
+def test_expired_key_executes_again(app, client):
+    """Тестирование истечения срока хранения ответа"""
+    with app.app_context():
+        user = User(name='Test User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        headers = {'api-key': 'test_api_key', 'Idempotency-Key': 'old-key'}
+        client.post('/api/tweets', headers=headers, json={'tweet_data': 'Old'})
+
+        record = IdempotencyKey.query.filter_by(key='old-key').first()
+        record.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        response = client.post('/api/tweets', headers=headers, json={'tweet_data': 'Old'})
+        assert response.status_code == 201
+        assert 'Idempotent-Replayed' not in response.headers
+        assert Tweet.query.count() == 2
+
+
+def test_replay_keeps_headers(app, client):
+    """Тестирование повтора: заголовки Location и ETag возвращаются вместе с телом"""
+    calls = []
+
+    @idempotent
+    def create_item():
+        calls.append(1)
+        return jsonify({"result": True}), 201, {'Location': '/items/1', 'ETag': '"v1"', 'X-Debug': 'first'}
+
+    app.add_url_rule('/items', view_func=create_item, methods=['POST'])
+    with app.app_context():
+        db.session.add(User(name='Test User', api_key='test_api_key'))
+        db.session.commit()
+    headers = {'api-key': 'test_api_key', 'Idempotency-Key': 'item-1'}
+    first = client.post('/items', headers=headers, json={})
+    second = client.post('/items', headers=headers, json={})
+
+    assert calls == [1]
+    assert second.status_code == 201
+    assert second.headers['Location'] == first.headers['Location'] == '/items/1'
+    assert second.headers['ETag'] == '"v1"'
+    assert 'X-Debug' not in second.headers
+
+
+def test_unknown_api_key_not_stored(app, client):
+    """Тестирование запроса с неизвестным API ключом: ключ идемпотентности не занимается"""
+    with app.app_context():
+        headers = {'api-key': 'unknown_key', 'Idempotency-Key': 'bad-auth'}
+        assert client.post('/api/tweets', headers=headers, json={'tweet_data': 'Nope'}).status_code == 401
+        assert IdempotencyKey.query.count() == 0
+
+
+
+def test_stale_key_reclaimed_once(app, client):
+    """Тестирование двух запросов, увидевших один просроченный ключ: второй не удаляет занятый первым"""
+    with app.app_context():
+        scope = _scope('test_api_key')
+        expired = datetime.utcnow() - timedelta(seconds=1)
+        db.session.add(IdempotencyKey(scope=scope, key='stale', request_hash='h', status='completed',
+                                      response_status=201, response_body='{}', expires_at=expired))
+        db.session.commit()
+        stale = IdempotencyKey.__table__.select().where(IdempotencyKey.key == 'stale')
+        seen = db.session.execute(stale).first()
+
+        # Первый запрос удалил просроченную запись и занял ключ, второй удаляет то, что прочитал раньше
+        assert _claim(scope, 'stale', 'h') is None
+        _delete_stale(seen)
+
+        record = IdempotencyKey.query.filter_by(scope=scope, key='stale').one()
+        assert record.status == 'processing'
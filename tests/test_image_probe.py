@@ -0,0 +1,97 @@
+import pytest
+import io
+import json
+from PIL import Image
+from models.models import User, Media, db
+from utils.image_probe import probe_image, ImageProbeError
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    return tmp_path
+
+
+def _image(format, width, height, frames=1):
+    buffer = io.BytesIO()
+    images = [Image.new('RGB', (width, height), color) for color in ('red', 'green', 'blue')[:frames]]
+    if frames > 1:
+        images[0].save(buffer, format=format, save_all=True, append_images=images[1:])
+    else:
+        images[0].save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def _upload(client, content, name):
+    return client.post(
+        '/api/medias',
+        headers={'api-key': 'test_api_key'},
+        data={'file': (io.BytesIO(content), name)},
+        content_type='multipart/form-data'
+    )
+
+
+@pytest.mark.parametrize('format, frames', [('PNG', 1), ('PNG', 3), ('JPEG', 1), ('GIF', 1), ('GIF', 3)])
+def test_probe_reads_headers(tmp_path, format, frames):
+    """Тестирование чтения размеров и числа кадров из заголовков"""
+    path = tmp_path / 'image'
+    path.write_bytes(_image(format, 320, 240, frames))
+
+    info = probe_image(str(path))
+    assert info.format == format
+    assert (info.width, info.height, info.frame_count) == (320, 240, frames)
+    assert info.pixels == 320 * 240 * frames
+
+
+@pytest.mark.parametrize('content', [b'', b'not an image', b'\x89PNG\r\n\x1a\n\x00', b'\xff\xd8\xff\xe0\x00'])
+def test_probe_rejects_garbage(tmp_path, content):
+    """Тестирование отказа для не изображений и обрезанных файлов"""
+    path = tmp_path / 'image'
+    path.write_bytes(content)
+
+    with pytest.raises(ImageProbeError):
+        probe_image(str(path))
+
+
+def test_upload_stores_dimensions(app, client, upload_folder):
+    """Тестирование сохранения размеров и выдачи их в ленте"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        response = _upload(client, _image('GIF', 64, 48, frames=2), 'anim.gif')
+        assert response.status_code == 201
+        data = json.loads(response.data)
+        assert (data['width'], data['height']) == (64, 48)
+
+        media = Media.query.get(data['media_id'])
+        assert (media.width, media.height, media.frame_count) == (64, 48, 2)
+
+        client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                    json={'tweet_data': 'Animated', 'tweet_media_ids': [media.id]})
+        tweets = json.loads(client.get('/api/tweets', headers={'api-key': 'test_api_key'}).data)['tweets']
+        assert tweets[0]['attachments_meta'] == [
+            {'url': media.get_url(), 'width': 64, 'height': 48, 'frame_count': 2, 'variants': {}}
+        ]
+
+
+def test_upload_rejects_invalid_images(app, client, upload_folder):
+    """Тестирование отказа для мусора, чужого расширения и декомпрессионной бомбы"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        assert _upload(client, b'not an image', 'fake.jpg').status_code == 400
+        assert _upload(client, _image('PNG', 10, 10), 'photo.jpg').status_code == 400
+
+        app.config['MAX_IMAGE_PIXELS'] = 100 * 100
+        response = _upload(client, _image('PNG', 200, 100), 'huge.png')
+        assert response.status_code == 400
+        assert json.loads(response.data)['error_message'] == 'Image dimensions are too large'
+
+        # Отклоненные файлы не остаются ни в базе, ни на диске
+        assert Media.query.count() == 0
+        assert list(upload_folder.iterdir()) == []
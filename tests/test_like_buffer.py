@@ -0,0 +1,164 @@
+import pytest
+import json
+import os
+import threading
+from sqlalchemy import event
+from models.models import User, Tweet, Like, db
+from utils.like_buffer import LikeWriteBehind
+
+
+@pytest.fixture
+def write_behind(app, tmp_path):
+    """Включает write-behind для лайков без фонового потока"""
+    app.config['LIKES_WRITE_BEHIND'] = True
+    app.config['LIKES_WRITE_BEHIND_DIR'] = str(tmp_path)
+    app.config['LIKES_FLUSH_INTERVAL_MS'] = 0
+    buffer = LikeWriteBehind(app)
+    yield buffer
+    app.extensions.pop('like_write_behind', None)
+
+
+def _create_users_and_tweet():
+    user1 = User(name='User 1', api_key='user1_api_key')
+    user2 = User(name='User 2', api_key='user2_api_key')
+    db.session.add_all([user1, user2])
+    db.session.commit()
+
+    tweet = Tweet(content='Viral tweet', author=user1)
+    db.session.add(tweet)
+    db.session.commit()
+    return user1, user2, tweet
+
+
+def test_like_is_buffered_and_flushed(app, client, write_behind):
+    """Тестирование отложенной записи лайка"""
+    with app.app_context():
+        user1, user2, tweet = _create_users_and_tweet()
+
+        response = client.post(f'/api/tweets/{tweet.id}/likes', headers={'api-key': 'user2_api_key'})
+        assert response.status_code == 200
+
+        # Лайк записан в журнал, но еще не в базе
+        assert Like.query.filter_by(user_id=user2.id, tweet_id=tweet.id).first() is None
+        assert os.path.getsize(write_behind._log_path) > 0
+
+        # Повторный лайк видит несброшенную запись
+        response = client.post(f'/api/tweets/{tweet.id}/likes', headers={'api-key': 'user2_api_key'})
+        assert response.status_code == 409
+
+        assert write_behind.flush() == 1
+        assert Like.query.filter_by(user_id=user2.id, tweet_id=tweet.id).first() is not None
+
+
+def test_read_your_writes_overlay(app, client, write_behind):
+    """Тестирование того, что автор лайка сразу видит его в ленте"""
+    with app.app_context():
+        user1, user2, tweet = _create_users_and_tweet()
+
+        client.post(f'/api/users/{user1.id}/follow', headers={'api-key': 'user2_api_key'})
+        client.post(f'/api/tweets/{tweet.id}/likes', headers={'api-key': 'user2_api_key'})
+
+        response = client.get('/api/tweets', headers={'api-key': 'user2_api_key'})
+        data = json.loads(response.data)
+        assert data['tweets'][0]['likes'] == [{'user_id': user2.id, 'name': 'User 2'}]
+
+        write_behind.flush()
+
+        # Анлайк до сброса скрывает уже записанный лайк
+        response = client.delete(f'/api/tweets/{tweet.id}/likes', headers={'api-key': 'user2_api_key'})
+        assert response.status_code == 200
+        response = client.get('/api/tweets', headers={'api-key': 'user2_api_key'})
+        data = json.loads(response.data)
+        assert data['tweets'][0]['likes'] == []
+
+        write_behind.flush()
+        assert Like.query.filter_by(user_id=user2.id, tweet_id=tweet.id).first() is None
+
+
+def test_orphaned_log_is_replayed(app, client, write_behind, tmp_path):
+    """Тестирование восстановления журнала упавшего процесса"""
+    with app.app_context():
+        user1, user2, tweet = _create_users_and_tweet()
+
+        orphan = tmp_path / 'likes-1-0.log'
+        orphan.write_text(
+            json.dumps({'op': 'like', 'user_id': user2.id, 'tweet_id': tweet.id, 'ts': 0}) + '\n'
+            + '{"op": "like", "user_'  # недописанная строка
+        )
+
+        write_behind.flush()
+
+        assert Like.query.filter_by(user_id=user2.id, tweet_id=tweet.id).first() is not None
+        assert not orphan.exists()
+
+
+def test_concurrent_double_like(app, write_behind):
+    """Тестирование одновременного двойного лайка: оба прочитали состояние, записывает только один"""
+    with app.app_context():
+        user1, user2, tweet = _create_users_and_tweet()
+        user_id, tweet_id = user2.id, tweet.id
+        barrier = threading.Barrier(2, timeout=5)
+
+        @event.listens_for(db.engine, 'after_cursor_execute')
+        def _wait_for_other(connection, cursor, statement, parameters, context, executemany):
+            if 'LEFT OUTER JOIN likes' in statement:
+                barrier.wait()
+
+        results = []
+
+        def _like():
+            with app.app_context():
+                results.append(write_behind.like(user_id, tweet_id))
+
+        threads = [threading.Thread(target=_like) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        event.remove(db.engine, 'after_cursor_execute', _wait_for_other)
+
+        assert sorted(results) == ['created', 'exists']
+        with open(write_behind._log_path, encoding='utf-8') as log:
+            assert len(log.readlines()) == 1
+
+
+def test_started_per_process(app, write_behind, monkeypatch):
+    """Тестирование запуска после fork: новый процесс открывает свой журнал и не наследует чужие записи"""
+    with app.app_context():
+        user1, user2, tweet = _create_users_and_tweet()
+        write_behind.like(user2.id, tweet.id)
+        parent_log = write_behind._log_path
+
+        monkeypatch.setattr('utils.like_buffer.os.getpid', lambda: 99999)
+        assert write_behind.pending_for_user(user2.id) == {}
+        assert write_behind._log_path != parent_log and write_behind._log_path.endswith('likes-99999.log')
+
+
+
+def test_recovery_skips_journal_being_flushed(app, write_behind, monkeypatch):
+    """Тестирование восстановления в другом процессе, пока владелец пишет снимок в базу"""
+    with app.app_context():
+        user1, user2, tweet = _create_users_and_tweet()
+        real_pid = os.getpid()
+        pid = [real_pid]
+        monkeypatch.setattr('utils.like_buffer.os.getpid', lambda: pid[0])
+        write_behind.like(user2.id, tweet.id)
+
+        # Соседний воркер с той же папкой журналов
+        other = LikeWriteBehind(app)
+        replayed = []
+        monkeypatch.setattr(other, '_apply', replayed.append)
+        apply = write_behind._apply
+
+        def _apply_with_recovery(operations):
+            pid[0] = 99999
+            other.flush()
+            pid[0] = real_pid
+            apply(operations)
+
+        monkeypatch.setattr(write_behind, '_apply', _apply_with_recovery)
+        assert write_behind.flush() == 1
+
+        assert replayed == []
+        assert not os.path.exists(write_behind._log_path + '.flushing')
+        assert Like.query.filter_by(user_id=user2.id, tweet_id=tweet.id).first() is not None
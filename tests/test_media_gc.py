@@ -0,0 +1,93 @@
+import pytest
+import io
+import json
+from datetime import datetime, timedelta
+from PIL import Image
+from models.models import User, Tweet, Media, MediaBlob, db
+from utils.media_gc import collect_orphaned_media
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    return tmp_path
+
+
+def _upload(client, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, format='PNG')
+    response = client.post(
+        '/api/medias',
+        headers={'api-key': 'test_api_key'},
+        data={'file': (io.BytesIO(buffer.getvalue()), 'photo.png')},
+        content_type='multipart/form-data'
+    )
+    return Media.query.get(json.loads(response.data)['media_id'])
+
+
+def _age(*media, hours=48):
+    for item in media:
+        item.created_at = datetime.utcnow() - timedelta(hours=hours)
+    db.session.commit()
+
+
+def test_gc_removes_only_old_unattached_media(app, client, upload_folder):
+    """Тестирование удаления старых неприкрепленных медиа и их файлов"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        attached = _upload(client, 'red')
+        orphan = _upload(client, 'green')
+        fresh = _upload(client, 'blue')
+        shared = _upload(client, 'red')  # тот же файл, что у прикрепленного
+        legacy = Media(filename='legacy.png', owner=user)
+        db.session.add(legacy)
+        (upload_folder / 'legacy.png').write_bytes(b'x' * 10)
+        tweet = Tweet(content='With media', author=user)
+        tweet.media.append(attached)
+        db.session.add(tweet)
+        _age(attached, orphan, shared, legacy)
+
+        orphan_path = upload_folder / orphan.filename
+        orphan_size = orphan_path.stat().st_size
+        ids = {'attached': attached.id, 'orphan': orphan.id, 'fresh': fresh.id, 'shared': shared.id}
+
+        result = collect_orphaned_media(grace_seconds=3600, batch_size=1, workers=2)
+        assert (result.media, result.files, result.bytes) == (3, 2, orphan_size + 10)
+
+        db.session.expire_all()
+        assert Media.query.get(ids['orphan']) is None
+        assert Media.query.get(ids['shared']) is None
+        assert Media.query.get(ids['attached']) is not None
+        assert Media.query.get(ids['fresh']) is not None
+        assert not orphan_path.exists()
+        assert not (upload_folder / 'legacy.png').exists()
+        # Файл прикрепленного медиа остается, хотя одна из ссылок на него удалена
+        assert (upload_folder / attached.filename).exists()
+        assert MediaBlob.query.get(attached.blob_hash).ref_count == 1
+
+
+def test_gc_command_after_tweet_delete(app, client, runner, upload_folder):
+    """Тестирование команды flask media gc для медиа удаленного твита"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        media = _upload(client, 'red')
+        tweet = Tweet(content='Soon deleted', author=user)
+        tweet.media.append(media)
+        db.session.add(tweet)
+        _age(media)
+        db.session.delete(tweet)
+        db.session.commit()
+
+        result = runner.invoke(args=['media', 'gc', '--grace-hours', '1'])
+        assert result.exit_code == 0
+        assert 'Deleted 1 media and 1 files' in result.output
+        assert Media.query.count() == 0
+        assert MediaBlob.query.count() == 0
@@ -0,0 +1,88 @@
+import pytest
+import io
+import json
+from PIL import Image
+from models.models import User, Media, MediaBlob, db
+from utils.media_layout import sharded_filename, alternate_filename
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    return tmp_path
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_sharded_filename():
+    """Тестирование вычисления пути в раскладке ab/cd/"""
+    assert sharded_filename('abcdef.png') == 'ab/cd/abcdef.png'
+    assert sharded_filename('ab/cd/abcdef.png') == 'ab/cd/abcdef.png'
+    # Имя не похоже на хэш - префикс берется из sha256 имени
+    assert sharded_filename('cat.jpg').endswith('/cat.jpg')
+    assert sharded_filename('cat.jpg').count('/') == 2
+    assert alternate_filename('ab/cd/abcdef.png') == 'abcdef.png'
+    assert alternate_filename('abcdef.png') == 'ab/cd/abcdef.png'
+
+
+def test_upload_uses_sharded_layout(app, client, upload_folder):
+    """Тестирование сохранения новых загрузок в раскладке ab/cd/"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        response = client.post(
+            '/api/medias',
+            headers={'api-key': 'test_api_key'},
+            data={'file': (io.BytesIO(_png(20, 10)), 'photo.png')},
+            content_type='multipart/form-data'
+        )
+        media = Media.query.get(json.loads(response.data)['media_id'])
+        assert media.filename == f'{media.blob_hash[:2]}/{media.blob_hash[2:4]}/{media.blob_hash}.png'
+        assert (upload_folder / media.filename).exists()
+        assert client.get(media.get_url()).status_code == 200
+
+
+def test_migrate_layout_moves_files(app, client, runner, upload_folder):
+    """Тестирование переноса файлов в новую раскладку командой flask media migrate-layout"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        blob_hash = 'ab12' + '0' * 60
+        flat = f'{blob_hash}.png'
+        db.session.add(MediaBlob(hash=blob_hash, filename=flat, size=3, ref_count=2, variants='150'))
+        db.session.flush()
+        db.session.add_all([
+            Media(filename=flat, owner=user, blob_hash=blob_hash),
+            Media(filename=flat, owner=user, blob_hash=blob_hash),
+            Media(filename='legacy.jpg', owner=user),
+        ])
+        db.session.commit()
+        for name in (flat, f'{blob_hash}_150.png', 'legacy.jpg'):
+            (upload_folder / name).write_bytes(b'img')
+
+        # Пока файлы не перенесены, старые и новые адреса отдают один и тот же файл
+        assert client.get(f'/uploads/{flat}').status_code == 200
+        assert client.get(f'/uploads/{sharded_filename(flat)}').status_code == 200
+
+        result = runner.invoke(args=['media', 'migrate-layout', '--batch-size', '1'])
+        assert result.exit_code == 0
+        assert 'finished: 2 records moved' in result.output
+
+        sharded = sharded_filename(flat)
+        assert MediaBlob.query.get(blob_hash).filename == sharded
+        assert {media.filename for media in Media.query.all()} == {sharded, sharded_filename('legacy.jpg')}
+        assert (upload_folder / 'ab/12' / f'{blob_hash}_150.png').exists()
+        assert not any(path.is_file() for path in upload_folder.iterdir())
+
+        # Закешированные клиентами старые адреса продолжают работать
+        assert client.get(f'/uploads/{flat}').status_code == 200
+        assert client.get('/uploads/legacy.jpg').status_code == 200
+        assert client.get('/uploads/../secret').status_code == 404
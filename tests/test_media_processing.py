@@ -0,0 +1,117 @@
+import pytest
+import io
+import json
+from PIL import Image
+from models.models import User, Tweet, Media, MediaBlob, db
+from utils.media_processing import process_pending_media
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок; медиа обрабатываются только по вызову process_pending_media"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    app.config['MEDIA_VARIANT_SIZES'] = (150,)
+    db.session.add(User(name='User', api_key='test_api_key'))
+    db.session.commit()
+    return tmp_path
+
+
+def _upload(client, content, name='photo.png'):
+    return client.post(
+        '/api/medias?async=1',
+        headers={'api-key': 'test_api_key'},
+        data={'file': (io.BytesIO(content), name)},
+        content_type='multipart/form-data'
+    )
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _status(client, media_id):
+    response = client.get(f'/api/medias/{media_id}', headers={'api-key': 'test_api_key'})
+    return response.status_code, json.loads(response.data)
+
+
+def _timeline(client):
+    response = client.get('/api/tweets', headers={'api-key': 'test_api_key'})
+    return [tweet['id'] for tweet in json.loads(response.data)['tweets']]
+
+
+def test_async_upload_and_pending_tweet(app, client, upload_folder):
+    """Тестирование фоновой загрузки и публикации твита после обработки"""
+    response = _upload(client, _png(400, 200))
+    assert response.status_code == 202
+    data = json.loads(response.data)
+    assert data['status'] == 'processing'
+    media_id = data['media_id']
+
+    code, state = _status(client, media_id)
+    assert code == 200 and state['status'] == 'processing'
+    assert 'url' not in state
+
+    response = client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                           json={'tweet_data': 'Soon', 'tweet_media_ids': [media_id]})
+    assert response.status_code == 201
+    tweet = json.loads(response.data)
+    assert tweet['status'] == 'pending'
+    assert tweet['tweet_id'] not in _timeline(client)
+
+    assert process_pending_media() == 1
+
+    code, state = _status(client, media_id)
+    assert state['status'] == 'ready'
+    assert (state['width'], state['height']) == (400, 200)
+    media = db.session.get(Media, media_id)
+    assert state['url'] == media.get_url()
+    assert MediaBlob.query.get(media.blob_hash).variant_sizes == [150]
+    # Временный файл обработки удален, файл лежит под именем по хэшу
+    assert not list(upload_folder.glob('.processing-*'))
+    assert (upload_folder / media.filename).exists()
+
+    assert db.session.get(Tweet, tweet['tweet_id']).status == 'published'
+    assert tweet['tweet_id'] in _timeline(client)
+
+    # Твит с готовым медиа публикуется сразу
+    response = client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                           json={'tweet_media_ids': [media_id]})
+    assert json.loads(response.data)['status'] == 'published'
+
+
+def test_async_upload_invalid_image(app, client, runner, upload_folder):
+    """Тестирование ошибки обработки: твит не публикуется, медиа нельзя прикрепить"""
+    response = _upload(client, b'not an image at all')
+    assert response.status_code == 202
+    media_id = json.loads(response.data)['media_id']
+    response = client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                           json={'tweet_data': 'Broken', 'tweet_media_ids': [media_id]})
+    tweet_id = json.loads(response.data)['tweet_id']
+
+    result = runner.invoke(args=['media', 'process'])
+    assert result.exit_code == 0
+    assert 'Processed 1 media' in result.output
+
+    code, state = _status(client, media_id)
+    assert state['status'] == 'failed'
+    assert state['error'] == 'File is not a valid image'
+    assert db.session.get(Tweet, tweet_id).status == 'failed'
+    assert not list(upload_folder.glob('.processing-*'))
+
+    response = client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                           json={'tweet_data': 'Retry', 'tweet_media_ids': [media_id]})
+    assert json.loads(response.data)['invalid_media_ids'] == [media_id]
+
+
+def test_media_status_owner_only(app, client, upload_folder):
+    """Тестирование доступа к состоянию чужого медиа"""
+    media_id = json.loads(_upload(client, _png(10, 10)).data)['media_id']
+    db.session.add(User(name='Other', api_key='other_key'))
+    db.session.commit()
+    response = client.get(f'/api/medias/{media_id}', headers={'api-key': 'other_key'})
+    assert response.status_code == 404
+    code, _ = _status(client, media_id + 100)
+    assert code == 404
@@ -0,0 +1,100 @@
+import pytest
+import io
+import json
+from PIL import Image
+from models.models import User, Media, MediaBlob, db
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    # Копии в других форматах проверяются в test_media_variants
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    return tmp_path
+
+
+def _jpeg(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+SAME_MEME = _jpeg('red')
+OTHER_MEME = _jpeg('blue')
+
+
+def _upload(client, content, name='meme.jpg', api_key='test_api_key'):
+    return client.post(
+        '/api/medias',
+        headers={'api-key': api_key},
+        data={'file': (io.BytesIO(content), name)},
+        content_type='multipart/form-data'
+    )
+
+
+def test_identical_uploads_share_blob(app, client, upload_folder):
+    """Тестирование дедупликации одинаковых загрузок"""
+    with app.app_context():
+        user1 = User(name='User 1', api_key='test_api_key')
+        user2 = User(name='User 2', api_key='other_api_key')
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        first = json.loads(_upload(client, SAME_MEME).data)['media_id']
+        second = json.loads(_upload(client, SAME_MEME, api_key='other_api_key').data)['media_id']
+        third = json.loads(_upload(client, OTHER_MEME).data)['media_id']
+
+        media1, media2, media3 = (Media.query.get(media_id) for media_id in (first, second, third))
+        assert media1.filename == media2.filename
+        assert media1.blob_hash == media2.blob_hash
+        assert media3.filename != media1.filename
+
+        blob = MediaBlob.query.get(media1.blob_hash)
+        assert blob.ref_count == 2
+        assert blob.size == len(SAME_MEME)
+
+        # На диске по одному файлу на содержимое, временные файлы убраны
+        stored = [str(path.relative_to(upload_folder)) for path in upload_folder.rglob('*') if path.is_file()]
+        assert sorted(stored) == sorted([media1.filename, media3.filename])
+
+
+def test_blob_removed_with_last_reference(app, client, upload_folder):
+    """Тестирование подсчета ссылок при удалении медиа"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        first = json.loads(_upload(client, SAME_MEME).data)['media_id']
+        second = json.loads(_upload(client, SAME_MEME).data)['media_id']
+        media = Media.query.get(first)
+        path = upload_folder / media.filename
+        blob_hash = media.blob_hash
+
+        db.session.delete(media)
+        db.session.commit()
+        assert path.exists()
+        assert MediaBlob.query.get(blob_hash).ref_count == 1
+
+        db.session.delete(Media.query.get(second))
+        db.session.commit()
+        assert not path.exists()
+        assert MediaBlob.query.get(blob_hash) is None
+
+
+def test_failed_commit_removes_stored_file(app, client, upload_folder, monkeypatch):
+    """Тестирование отката: файл, положенный загрузкой, не остается без строки media_blobs"""
+    with app.app_context():
+        db.session.add(User(name='User', api_key='test_api_key'))
+        db.session.commit()
+
+        def _failed_commit():
+            raise RuntimeError('commit failed')
+
+        monkeypatch.setattr(db.session, 'commit', _failed_commit)
+        assert _upload(client, SAME_MEME).status_code == 500
+        monkeypatch.undo()
+
+        assert MediaBlob.query.count() == 0
+        assert [path for path in upload_folder.rglob('*') if path.is_file()] == []
@@ -0,0 +1,149 @@
+import pytest
+import io
+import json
+import os
+from PIL import Image
+from models.models import User, Media, MediaBlob, db
+from utils.media_variants import render_variants
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    return tmp_path
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color=(200, 30, 30)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_upload_generates_variants(app, client, upload_folder):
+    """Тестирование создания уменьшенных копий при загрузке"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        response = client.post(
+            '/api/medias',
+            headers={'api-key': 'test_api_key'},
+            data={'file': (io.BytesIO(_png(1000, 500)), 'photo.png')},
+            content_type='multipart/form-data'
+        )
+        media = Media.query.get(json.loads(response.data)['media_id'])
+        stem = media.filename.rsplit('.', 1)[0]
+
+        # 1200 больше исходника - такой копии нет
+        assert media.blob.variant_sizes == [150, 600]
+        with Image.open(upload_folder / f'{stem}_150.png') as variant:
+            assert variant.size == (150, 75)
+
+        assert media.get_url(100) == f'/uploads/{stem}_150.png'
+        assert media.get_url(400) == f'/uploads/{stem}_600.png'
+        assert media.get_url(1200) == f'/uploads/{media.filename}'
+        assert media.get_url() == f'/uploads/{media.filename}'
+
+
+def test_get_url_falls_back_until_ready(app, client):
+    """Тестирование отдачи оригинала, пока копии не готовы"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        blob = MediaBlob(hash='a' * 64, filename='a.png', size=1)
+        db.session.add_all([user, blob])
+        db.session.commit()
+
+        media = Media(filename='a.png', owner=user, blob_hash=blob.hash)
+        db.session.add(media)
+        db.session.commit()
+        assert media.get_url(150) == '/uploads/a.png'
+
+        blob.variants = '150'
+        db.session.commit()
+        assert media.get_url(150) == '/uploads/a_150.png'
+
+
+def test_timeline_links_variants(app, client):
+    """Тестирование ссылок на уменьшенные копии в ленте, когда копии готовы"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        blob = MediaBlob(hash='a' * 64, filename='a.png', size=1)
+        db.session.add_all([user, blob])
+        db.session.commit()
+        media = Media(filename='a.png', owner=user, blob_hash=blob.hash, width=1000, height=500)
+        db.session.add(media)
+        db.session.commit()
+        client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                    json={'tweet_data': 'Photo', 'tweet_media_ids': [media.id]})
+
+        def _meta():
+            tweets = json.loads(client.get('/api/tweets', headers={'api-key': 'test_api_key'}).data)['tweets']
+            return tweets[0]['attachments_meta'][0]
+
+        assert _meta()['variants'] == {}
+
+        blob.variants = '150,600,webp,150.webp'
+        db.session.commit()
+        assert _meta()['variants'] == {'150': '/uploads/a_150.png', '600': '/uploads/a_600.png'}
+        assert _meta()['url'] == '/uploads/a.png'
+        assert json.loads(client.get(f'/api/medias/{media.id}', headers={'api-key': 'test_api_key'}).data)[
+            'variants'] == {'150': '/uploads/a_150.png', '600': '/uploads/a_600.png'}
+
+
+def test_render_variants_ignores_non_images(tmp_path):
+    """Тестирование устойчивости к файлам, которые не являются изображениями"""
+    source = tmp_path / 'broken.jpg'
+    source.write_bytes(b'not an image')
+    assert render_variants(str(source), (150,)) == ([], [])
+    assert os.listdir(tmp_path) == ['broken.jpg']
+
+
+def test_modern_format_negotiation(app, client, upload_folder):
+    """Тестирование выбора формата по заголовку Accept"""
+    with app.app_context():
+        user = User(name='User', api_key='test_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        response = client.post(
+            '/api/medias',
+            headers={'api-key': 'test_api_key'},
+            data={'file': (io.BytesIO(_png(800, 600)), 'photo.png')},
+            content_type='multipart/form-data'
+        )
+        media = Media.query.get(json.loads(response.data)['media_id'])
+        assert (upload_folder / f'{media.filename}.webp').exists()
+
+        # Клиент без явной поддержки получает оригинал даже при */*
+        response = client.get(media.get_url(), headers={'Accept': '*/*'})
+        assert response.mimetype == 'image/png'
+        assert 'Accept' in response.headers['Vary']
+
+        response = client.get(media.get_url(), headers={'Accept': 'image/webp,*/*'})
+        assert response.mimetype == 'image/webp'
+        assert 'Accept' in response.headers['Vary']
+
+        # Уменьшенные копии тоже имеют версии в современных форматах
+        response = client.get(media.get_url(150), headers={'Accept': 'image/webp'})
+        assert response.mimetype == 'image/webp'
+        response.close()
+
+
+def test_negotiation_picks_smallest(tmp_path):
+    """Тестирование выбора наименьшего допустимого представления"""
+    from werkzeug.datastructures import MIMEAccept
+    from utils.media_variants import negotiate_representation
+    from utils.storage import LocalStorage
+
+    (tmp_path / 'a.png').write_bytes(b'x' * 100)
+    (tmp_path / 'a.png.webp').write_bytes(b'x' * 50)
+    (tmp_path / 'a.png.avif').write_bytes(b'x' * 30)
+
+    storage = LocalStorage(str(tmp_path))
+    both = MIMEAccept([('image/avif', 1), ('image/webp', 1)])
+    assert negotiate_representation(storage, 'a.png', both) == 'a.png.avif'
+    assert negotiate_representation(storage, 'a.png', MIMEAccept([('image/webp', 1)])) == 'a.png.webp'
+    assert negotiate_representation(storage, 'a.png', MIMEAccept([('image/avif', 0)])) == 'a.png'
+    assert negotiate_representation(storage, 'missing.png', both) == 'missing.png'
@@ -0,0 +1,175 @@
+import pytest
+import json
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from models.models import User, Tweet, Like, db
+from utils.partitions import (add_months, partition_name, partition_month, create_partition_sql,
+                              layout_sql, export_partition, find_archived_tweet, read_manifest,
+                              archive_partitions)
+
+
+class RecordingConnection:
+    """Соединение, которое выполняет чтения, а DDL секций только записывает вместе с признаком транзакции"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = []
+
+    def execute(self, statement, *args):
+        text = str(statement)
+        if text.startswith(('ALTER', 'DROP')):
+            self.statements.append((text, self.connection.in_transaction()))
+            return None
+        return self.connection.execute(statement, *args)
+
+    def begin(self):
+        return self.connection.begin()
+
+    def commit(self):
+        self.connection.commit()
+
+
+def test_partition_months_and_sql():
+    """Тестирование месяцев секций и их DDL"""
+    assert add_months(datetime(2024, 11, 1), 3) == datetime(2025, 2, 1)
+    assert add_months(datetime(2024, 1, 1), -1) == datetime(2023, 12, 1)
+    assert partition_name(datetime(2024, 2, 1)) == 'tweets_p2024_02'
+    assert partition_month('tweets_p2024_02') == datetime(2024, 2, 1)
+    assert partition_month('tweets_default') is None
+    assert create_partition_sql(datetime(2024, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS tweets_p2024_12 PARTITION OF tweets "
+        "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')")
+
+    statements = layout_sql(datetime(2024, 11, 1), datetime(2025, 1, 1))
+    assert any('PARTITION BY RANGE (created_at)' in statement for statement in statements)
+    assert sum('PARTITION OF tweets FOR VALUES' in statement for statement in statements) == 3
+    # Данные копируются до удаления старой таблицы
+    assert statements[-2].startswith('INSERT INTO tweets')
+    assert statements[-1] == 'DROP TABLE tweets_unpartitioned CASCADE'
+
+
+def test_partition_commands_require_postgresql(app, runner):
+    """Тестирование отказа команд секционирования без PostgreSQL"""
+    with app.app_context():
+        db.create_all()
+        result = runner.invoke(args=['partitions', 'create-ahead'])
+        assert result.exit_code != 0
+        assert 'requires PostgreSQL' in result.output
+
+        result = runner.invoke(args=['partitions', 'archive'])
+        assert result.exit_code != 0
+        assert 'TWEETS_ARCHIVE_DIR' in result.output
+
+
+def test_archive_requires_pyarrow(app, runner, tmp_path, monkeypatch):
+    """Тестирование понятной ошибки архивации без pyarrow"""
+    app.config['TWEETS_ARCHIVE_DIR'] = str(tmp_path)
+    monkeypatch.setattr('utils.partitions.pq', None)
+    with app.app_context():
+        result = runner.invoke(args=['partitions', 'archive'])
+    assert result.exit_code != 0
+    assert 'pip install pyarrow' in result.output
+
+
+def test_archive_partitions_transactions(app, tmp_path, monkeypatch):
+    """Тестирование архивации: чтение каталога не мешает отдельной транзакции на каждую секцию"""
+    def _catalog(connection):
+        # Как запросы к pg_class: первое выполнение открывает транзакцию автоматически
+        connection.execute(sa.text('SELECT 1'))
+
+    monkeypatch.setattr('utils.partitions.pq', object())
+    monkeypatch.setattr('utils.partitions.is_partitioned', lambda connection: _catalog(connection) or True)
+    monkeypatch.setattr('utils.partitions.list_partitions', lambda connection: _catalog(connection) or [
+        (datetime(2020, 1, 1), 'tweets_p2020_01'), (datetime(2020, 2, 1), 'tweets_p2020_02'),
+        (datetime(2024, 6, 1), 'tweets_p2024_06')])
+    exported = []
+
+    def _export(connection, name, archive_dir, database):
+        exported.append((name, connection.connection.in_transaction()))
+        return {"partition": name, "rows": 1}
+
+    monkeypatch.setattr('utils.partitions.export_partition', _export)
+    with app.app_context():
+        with db.engine.connect() as connection:
+            recording = RecordingConnection(connection)
+            archived = archive_partitions(recording, str(tmp_path), older_than_months=12,
+                                          now=datetime(2024, 7, 15))
+
+    assert [entry['partition'] for entry in archived] == ['tweets_p2020_01', 'tweets_p2020_02']
+    assert exported == [('tweets_p2020_01', True), ('tweets_p2020_02', True)]
+    assert recording.statements == [
+        ('ALTER TABLE tweets DETACH PARTITION tweets_p2020_01', True), ('DROP TABLE tweets_p2020_01', True),
+        ('ALTER TABLE tweets DETACH PARTITION tweets_p2020_02', True), ('DROP TABLE tweets_p2020_02', True)]
+
+
+@pytest.fixture
+def users(app):
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(name='Author', api_key='author_key'), User(name='Reader', api_key='reader_key')])
+        db.session.commit()
+        yield
+
+
+def test_timeline_reads_recent_partitions(app, client, users):
+    """Тестирование ограничения ленты последними месяцами"""
+    app.config['TWEETS_PARTITIONED'] = True
+    app.config['TIMELINE_MAX_AGE_DAYS'] = 30
+    db.session.add_all([
+        Tweet(content='Old', author_id=1, created_at=datetime.utcnow() - timedelta(days=90)),
+        Tweet(content='New', author_id=1, created_at=datetime.utcnow()),
+    ])
+    db.session.commit()
+
+    response = client.get('/api/tweets', headers={'api-key': 'author_key'})
+    assert [tweet['content'] for tweet in json.loads(response.data)['tweets']] == ['New']
+
+    # Старый твит доступен по id
+    response = client.get('/api/tweets/1', headers={'api-key': 'reader_key'})
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data['tweet']['content'] == 'Old'
+    assert data['tweet']['archived'] is False
+
+
+def test_get_tweet_from_archive(app, client, users, tmp_path, monkeypatch):
+    """Тестирование ответа из архива для отсоединенной секции"""
+    app.config['TWEETS_ARCHIVE_DIR'] = str(tmp_path)
+    db.session.add(Like(user_id=2, tweet_id=77))
+    db.session.commit()
+    archived = {'id': 77, 'content': 'Archived', 'author_id': 1, 'status': 'published',
+                'created_at': datetime(2020, 1, 5)}
+    monkeypatch.setattr('routes.api.find_archived_tweet',
+                        lambda archive_dir, tweet_id: archived if tweet_id == 77 else None)
+
+    response = client.get('/api/tweets/77', headers={'api-key': 'reader_key'})
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data['tweet']['archived'] is True
+    assert data['tweet']['author'] == {'id': 1, 'name': 'Author'}
+    assert data['tweet']['likes'] == [{'user_id': 2, 'name': 'Reader'}]
+
+    response = client.get('/api/tweets/78', headers={'api-key': 'reader_key'})
+    assert response.status_code == 404
+
+
+def test_export_partition_round_trip(app, tmp_path):
+    """Тестирование выгрузки секции в Parquet и поиска твита в архиве"""
+    pytest.importorskip('pyarrow')
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(sa.text(
+                'CREATE TABLE tweets_p2020_01 (id INTEGER PRIMARY KEY, content TEXT, author_id INTEGER, '
+                'status VARCHAR(16), created_at TIMESTAMP)'))
+            connection.execute(sa.text(
+                "INSERT INTO tweets_p2020_01 VALUES (5, 'First', 1, 'published', '2020-01-02 10:00:00'), "
+                "(9, 'Second', 2, 'published', '2020-01-30 12:00:00')"))
+            entry = export_partition(connection, 'tweets_p2020_01', str(tmp_path))
+
+    assert entry['rows'] == 2 and (entry['min_id'], entry['max_id']) == (5, 9)
+    assert read_manifest(str(tmp_path)) == [entry]
+    tweet = find_archived_tweet(str(tmp_path), 9)
+    assert tweet['content'] == 'Second'
+    assert tweet['created_at'] == datetime(2020, 1, 30, 12)
+    assert find_archived_tweet(str(tmp_path), 7) is None
+    assert find_archived_tweet(str(tmp_path), 100) is None
@@ -0,0 +1,60 @@
+import pytest
+import json
+from contextlib import contextmanager
+from models.models import User, Tweet, Like, Follow, Media, db
+
+
+class FakePipelineConnection:
+    """Соединение драйвера с pipeline(): запросы выполняются сразу, блок считается"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.pipelines = 0
+
+    @contextmanager
+    def pipeline(self):
+        self.pipelines += 1
+        yield
+
+    def cursor(self):
+        return self.connection.cursor()
+
+
+@pytest.fixture
+def timeline(app):
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(name='Reader', api_key='reader_key'), User(name='Author', api_key='author_key')])
+        db.session.flush()
+        db.session.add(Follow(follower_id=1, following_id=2))
+        first = Tweet(content='First', author_id=2)
+        first.media.append(Media(filename='first.png', owner_id=2, width=10, height=20))
+        db.session.add_all([first, Tweet(content='Second', author_id=1)])
+        db.session.flush()
+        db.session.add_all([Like(user_id=1, tweet_id=first.id), Like(user_id=2, tweet_id=first.id)])
+        db.session.commit()
+        yield
+
+
+def test_timeline_pipelined(client, timeline, monkeypatch):
+    """Тестирование ленты: в режиме pipeline ответ тот же, что при запросах по очереди"""
+    sequential = json.loads(client.get('/api/tweets', headers={'api-key': 'reader_key'}).data)
+    first = next(tweet for tweet in sequential['tweets'] if tweet['content'] == 'First')
+    assert first['attachments_meta'] == [
+        {"url": '/uploads/first.png', "width": 10, "height": 20, "frame_count": 1, "variants": {}}
+    ]
+    assert first['likes'] == [{"user_id": 1, "name": 'Reader'}, {"user_id": 2, "name": 'Author'}]
+    assert first['author'] == {"id": 2, "name": 'Author'}
+
+    fakes = []
+
+    def _fake_driver(connection):
+        fakes.append(FakePipelineConnection(connection.connection.driver_connection))
+        return fakes[-1]
+
+    monkeypatch.setattr('utils.pipeline._pipelined', lambda connection: True)
+    monkeypatch.setattr('utils.pipeline._driver_connection', _fake_driver)
+    pipelined = json.loads(client.get('/api/tweets', headers={'api-key': 'reader_key'}).data)
+    assert pipelined == sequential
+    # Вложения, лайки и имена - одним блоком
+    assert [fake.pipelines for fake in fakes] == [1]
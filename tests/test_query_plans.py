@@ -0,0 +1,126 @@
+import re
+import pytest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from models.models import db, User, Tweet, Like, Follow
+
+# Полный проход по таблице или индексу, skip-scan по первой колонке чужого индекса
+# и сортировка во временном B-дереве
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)|\bANY\(')
+SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)')
+
+USERS = 40
+TWEETS_PER_USER = 50
+
+
+@pytest.fixture
+def seeded(app):
+    """База с лентами, подписками и лайками; ANALYZE дает планировщику статистику"""
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {"id": user_id, "name": f'User {user_id}', "api_key": f'key_{user_id}'}
+        for user_id in range(1, USERS + 1)
+    ])
+    db.session.execute(insert(Tweet), [
+        {"content": f'Tweet {n}', "author_id": user_id, "created_at": now - timedelta(minutes=n)}
+        for user_id in range(1, USERS + 1) for n in range(TWEETS_PER_USER)
+    ])
+    # Каждый подписан на пятерых следующих; последний пользователь ни на кого не подписан
+    db.session.execute(insert(Follow), [
+        {"follower_id": user_id, "following_id": (user_id + step - 1) % (USERS - 1) + 1}
+        for user_id in range(1, USERS) for step in range(1, 6)
+    ])
+    db.session.execute(insert(Like), [
+        {"user_id": user_id, "tweet_id": tweet_id}
+        for user_id in range(1, USERS + 1) for tweet_id in range(user_id, USERS * TWEETS_PER_USER, 37)
+    ])
+    db.session.commit()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('ANALYZE')
+
+
+@contextmanager
+def captured_selects():
+    """Собирает SELECT запросы приложения вместе с параметрами"""
+    statements = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', _capture)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _capture)
+
+
+def query_plan(statement, parameters):
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    return [row[-1] for row in rows]
+
+
+def assert_indexed(statements, allow_sort=()):
+    """
+    Ни один запрос не читает таблицу целиком и не сортирует результат,
+    кроме запросов, подходящих под шаблоны allow_sort
+    """
+    assert statements
+    for statement, parameters in statements:
+        plan = query_plan(statement, parameters)
+        details = '\n'.join(plan)
+        assert not any(FULL_SCAN.search(step) for step in plan), f'Full scan:\n{statement}\n{details}'
+        if not any(re.search(pattern, statement) for pattern in allow_sort):
+            assert not any(SORT.search(step) for step in plan), f'Sort:\n{statement}\n{details}'
+
+
+def test_timeline_plan(app, client, seeded):
+    """Лента подписок читается диапазонами индекса (author_id, created_at)"""
+    with captured_selects() as statements:
+        response = client.get('/api/tweets', headers={'api-key': 'key_1'})
+    assert response.status_code == 200
+    # Слияние лент нескольких авторов требует сортировки уже отобранных строк
+    assert_indexed(statements, allow_sort=[r'FROM tweets\s+WHERE tweets\.author_id IN'])
+
+
+def test_single_author_timeline_plan(app, client, seeded):
+    """Лента одного автора идет в порядке индекса без сортировки"""
+    with captured_selects() as statements:
+        response = client.get('/api/tweets', headers={'api-key': f'key_{USERS}'})
+    assert response.status_code == 200
+    assert_indexed(statements)
+
+
+def test_snowflake_timeline_plan(app, client, seeded):
+    """С id по времени лента идет в порядке индекса (author_id, id)"""
+    app.config['TWEET_ID_STRATEGY'] = 'snowflake'
+    with captured_selects() as statements:
+        response = client.get('/api/tweets', headers={'api-key': f'key_{USERS}'})
+    assert response.status_code == 200
+    assert_indexed(statements)
+
+
+def test_profile_plans(app, client, seeded):
+    """Подписчики и подписки профиля ищутся по индексам follows"""
+    with captured_selects() as statements:
+        assert client.get('/api/users/me', headers={'api-key': 'key_2'}).status_code == 200
+        assert client.get('/api/users/3').status_code == 200
+    assert_indexed(statements)
+
+
+def test_like_plans(app, client, seeded):
+    """Лайк и его отмена находят строки по индексам"""
+    with captured_selects() as statements:
+        assert client.post('/api/tweets/2/likes', headers={'api-key': 'key_1'}).status_code == 200
+        assert client.delete('/api/tweets/2/likes', headers={'api-key': 'key_1'}).status_code == 200
+    assert_indexed(statements)
+
+
+def test_plan_check_detects_regression(app, seeded):
+    """Проверка плана замечает полное сканирование и сортировку без индекса"""
+    with captured_selects() as statements:
+        db.session.query(Tweet).filter(Tweet.content == 'Tweet 1').order_by(Tweet.content).all()
+    with pytest.raises(AssertionError, match='Full scan'):
+        assert_indexed(statements)
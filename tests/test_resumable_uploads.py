@@ -0,0 +1,169 @@
+import pytest
+import base64
+import fcntl
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta
+from PIL import Image
+from models.models import User, Media, UploadSession, db
+from utils.resumable_uploads import append_chunk, ChunkError
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок для каждого теста"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    return tmp_path
+
+
+@pytest.fixture
+def user(app):
+    user = User(name='User', api_key='test_api_key')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (120, 80), 'red').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def _checksum(chunk):
+    return 'sha256 ' + base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+
+
+def _create(client, size, filename='photo.jpg'):
+    return client.post('/api/medias/uploads', headers={'api-key': 'test_api_key'},
+                       json={'filename': filename, 'size': size})
+
+
+def _put(client, upload_id, offset, chunk, checksum=None):
+    return client.put(
+        f'/api/medias/uploads/{upload_id}',
+        headers={'api-key': 'test_api_key', 'Upload-Offset': str(offset),
+                 'Upload-Checksum': checksum or _checksum(chunk)},
+        data=chunk,
+    )
+
+
+def test_chunked_upload_creates_media(app, client, upload_folder, user):
+    """Тестирование загрузки файла частями с последующим завершением"""
+    content = _jpeg()
+    response = _create(client, len(content))
+    assert response.status_code == 201
+    upload_id = json.loads(response.data)['upload_id']
+
+    middle = len(content) // 2
+    assert json.loads(_put(client, upload_id, 0, content[:middle]).data)['offset'] == middle
+
+    # После обрыва клиент узнает позицию и продолжает с нее
+    state = json.loads(client.get(f'/api/medias/uploads/{upload_id}', headers={'api-key': 'test_api_key'}).data)
+    assert (state['offset'], state['size']) == (middle, len(content))
+    assert _put(client, upload_id, middle, content[middle:]).status_code == 200
+
+    response = client.post(f'/api/medias/uploads/{upload_id}/complete', headers={'api-key': 'test_api_key'})
+    assert response.status_code == 201
+    data = json.loads(response.data)
+    assert (data['width'], data['height']) == (120, 80)
+
+    media = Media.query.get(data['media_id'])
+    assert (upload_folder / media.filename).read_bytes() == content
+    assert UploadSession.query.count() == 0
+    stored = [str(path.relative_to(upload_folder)) for path in upload_folder.rglob('*') if path.is_file()]
+    assert stored == [media.filename]
+
+
+def test_chunk_checksum_and_offset_are_verified(app, client, upload_folder, user):
+    """Тестирование отказа для поврежденной части и неверной позиции"""
+    content = _jpeg()
+    upload_id = json.loads(_create(client, len(content)).data)['upload_id']
+    assert _put(client, upload_id, 0, content[:100]).status_code == 200
+
+    # Поврежденная часть отбрасывается, принятые байты остаются
+    response = _put(client, upload_id, 100, content[100:200], checksum=_checksum(b'other'))
+    assert response.status_code == 400
+    assert (upload_folder / f'.resumable-{upload_id}').stat().st_size == 100
+
+    response = _put(client, upload_id, 50, content[50:150])
+    assert response.status_code == 409
+    assert json.loads(response.data)['error_message'] == 'Upload-Offset must be 100'
+
+    assert _put(client, upload_id, 100, content[100:], checksum='md5 abc').status_code == 400
+    response = client.post(f'/api/medias/uploads/{upload_id}/complete', headers={'api-key': 'test_api_key'})
+    assert response.status_code == 409
+
+
+def test_upload_session_validation(app, client, upload_folder, user):
+    """Тестирование проверок при создании, завершении и отмене сессии"""
+    assert _create(client, 10, filename='script.exe').status_code == 400
+    assert _create(client, 0).status_code == 400
+    app.config['RESUMABLE_UPLOAD_MAX_SIZE'] = 100
+    assert _create(client, 101).status_code == 413
+
+    # Собранный файл не изображение: сессия удаляется
+    upload_id = json.loads(_create(client, 9).data)['upload_id']
+    _put(client, upload_id, 0, b'not image')
+    response = client.post(f'/api/medias/uploads/{upload_id}/complete', headers={'api-key': 'test_api_key'})
+    assert response.status_code == 400
+    assert UploadSession.query.count() == 0
+
+    upload_id = json.loads(_create(client, 9).data)['upload_id']
+    assert client.delete(f'/api/medias/uploads/{upload_id}', headers={'api-key': 'test_api_key'}).status_code == 200
+    assert client.get(f'/api/medias/uploads/{upload_id}', headers={'api-key': 'test_api_key'}).status_code == 404
+    assert list(upload_folder.iterdir()) == []
+
+
+def test_expired_sessions_are_purged(app, client, upload_folder, user):
+    """Тестирование удаления просроченных сессий вместе с файлами"""
+    upload_id = json.loads(_create(client, 9).data)['upload_id']
+    upload_session = db.session.get(UploadSession, upload_id)
+    upload_session.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    assert _put(client, upload_id, 0, b'not image').status_code == 404
+    _create(client, 9)
+    assert db.session.get(UploadSession, upload_id) is None
+    assert not (upload_folder / f'.resumable-{upload_id}').exists()
+
+
+def test_purge_skips_session_being_written(app, client, upload_folder, user):
+    """Тестирование очистки: файл, в который пишется часть, не удаляется; удаленная сессия отвечает 404"""
+    upload_id = json.loads(_create(client, 9).data)['upload_id']
+    upload_session = db.session.get(UploadSession, upload_id)
+    upload_session.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    path = upload_folder / f'.resumable-{upload_id}'
+
+    # Блокировка append_chunk: часть еще пишется
+    with open(path, 'r+b') as writing:
+        fcntl.flock(writing, fcntl.LOCK_EX)
+        _create(client, 9)
+        assert path.exists()
+        assert db.session.get(UploadSession, upload_id) is not None
+
+    _create(client, 9)
+    assert not path.exists()
+    assert db.session.get(UploadSession, upload_id) is None
+
+    # Сессия удалена после проверки срока: часть не пишется в удаленный файл
+    checked = UploadSession(id=upload_id, total_size=9)
+    with pytest.raises(ChunkError) as error:
+        append_chunk(checked, 0, io.BytesIO(b'not image'), 9, hashlib.sha256(b'not image').digest())
+    assert error.value.status == 404
+
+
+def test_failed_session_commit_removes_file(app, client, upload_folder, user, monkeypatch):
+    """Тестирование отката создания сессии: файл частей не остается без строки"""
+    def _failed_commit():
+        raise RuntimeError('commit failed')
+
+    monkeypatch.setattr(db.session, 'commit', _failed_commit)
+    assert _create(client, 9).status_code == 500
+    monkeypatch.undo()
+
+    assert UploadSession.query.count() == 0
+    assert list(upload_folder.glob('.resumable-*')) == []
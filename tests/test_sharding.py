@@ -0,0 +1,301 @@
+import pytest
+import io
+import json
+import sqlalchemy as sa
+from app import create_app
+from models.models import db, User, Tweet, Like, Follow
+from models.session import SHARDS
+from PIL import Image
+from utils.media_processing import process_pending_media
+from utils.sharding import SHARD_BUCKETS, bucket_of, default_map, plan_rebalance
+
+# 1022 и 1023 - корзины, которые при добавлении третьего шарда переезжают на него
+USER_IDS = (1, 2, 3, 4, 1022, 1023)
+
+
+def _headers(user_id):
+    return {'api-key': f'key_{user_id}'}
+
+
+def _make_app(tmp_path, monkeypatch, shard_count):
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path}/primary.db')
+    monkeypatch.setenv('DATABASE_SHARD_URLS', ','.join(
+        f'sqlite:///{tmp_path}/shard-{index}.db' for index in range(shard_count)))
+    monkeypatch.setenv('TWEET_ID_STRATEGY', 'snowflake')
+    monkeypatch.setenv('SNOWFLAKE_LOCK_DIR', str(tmp_path / 'snowflake'))
+    monkeypatch.setenv('SHARD_MAP_TTL', '0')
+    monkeypatch.setenv('MEDIA_PROCESSING_WORKERS', '0')
+    app = create_app()
+    app.config['TESTING'] = True
+    (tmp_path / 'uploads').mkdir(exist_ok=True)
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    app.config['MEDIA_VARIANT_WORKERS'] = 0
+    return app
+
+
+def _dispose(app):
+    db.session.remove()
+    for engine in app.extensions[SHARDS].engines:
+        engine.dispose()
+    db.engine.dispose()
+
+
+@pytest.fixture
+def sharded_app(tmp_path, monkeypatch):
+    """Основная база и два шарда - файлы SQLite; пользователи 1 и 3 на шарде 1, 2 и 4 на шарде 0"""
+    app = _make_app(tmp_path, monkeypatch, 2)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(sa.insert(User), [
+            {"id": user_id, "name": f'User {user_id}', "api_key": f'key_{user_id}'}
+            for user_id in USER_IDS
+        ])
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['shards', 'init'])
+        assert result.exit_code == 0, result.output
+        yield app
+        _dispose(app)
+
+
+def _rows(app, shard, table):
+    with app.extensions[SHARDS].engines[shard].connect() as connection:
+        return connection.execute(sa.select(table.__table__)).all()
+
+
+def _post(client, user_id, text):
+    response = client.post('/api/tweets', headers=_headers(user_id), json={'tweet_data': text})
+    assert response.status_code == 201, response.data
+    return json.loads(response.data)['tweet_id']
+
+
+def test_tweets_stored_on_author_shard(sharded_app):
+    """Тестирование: твит пишется на шард автора, основная база его не хранит"""
+    client = sharded_app.test_client()
+    _post(client, 1, 'One')
+    _post(client, 2, 'Two')
+    assert [row.content for row in _rows(sharded_app, 1, Tweet)] == ['One']
+    assert [row.content for row in _rows(sharded_app, 0, Tweet)] == ['Two']
+    with db.engine.connect() as connection:
+        assert connection.execute(sa.select(sa.func.count()).select_from(Tweet.__table__)).scalar() == 0
+
+
+def test_follows_on_both_shards(sharded_app):
+    """Тестирование подписки: строка на шардах обоих пользователей, профили читаются со своего шарда"""
+    client = sharded_app.test_client()
+    assert client.post('/api/users/2/follow', headers=_headers(1)).status_code == 200
+    assert client.post('/api/users/2/follow', headers=_headers(1)).status_code == 409
+    assert client.post('/api/users/99/follow', headers=_headers(1)).status_code == 404
+    assert len(_rows(sharded_app, 0, Follow)) == len(_rows(sharded_app, 1, Follow)) == 1
+
+    me = json.loads(client.get('/api/users/me', headers=_headers(1)).data)['user']
+    assert me['following'] == [{"id": 2, "name": 'User 2'}]
+    other = json.loads(client.get('/api/users/2').data)['user']
+    assert other['followers'] == [{"id": 1, "name": 'User 1'}]
+
+    assert client.delete('/api/users/2/follow', headers=_headers(1)).status_code == 200
+    assert client.delete('/api/users/2/follow', headers=_headers(1)).status_code == 404
+    assert _rows(sharded_app, 0, Follow) == _rows(sharded_app, 1, Follow) == []
+
+
+def test_timeline_gathers_shards(sharded_app):
+    """Тестирование ленты: твиты с обоих шардов слиты по времени, лайки с шарда твита"""
+    client = sharded_app.test_client()
+    client.post('/api/users/2/follow', headers=_headers(1))
+    ids = [_post(client, author, f'Tweet {n}') for n, author in enumerate([1, 2, 1, 2, 3])]
+    assert client.post(f'/api/tweets/{ids[1]}/likes', headers=_headers(3)).status_code == 200
+    assert client.post(f'/api/tweets/{ids[1]}/likes', headers=_headers(3)).status_code == 409
+    assert [row.tweet_id for row in _rows(sharded_app, 0, Like)] == [ids[1]]
+
+    tweets = json.loads(client.get('/api/tweets', headers=_headers(1)).data)['tweets']
+    assert [tweet['content'] for tweet in tweets] == ['Tweet 3', 'Tweet 2', 'Tweet 1', 'Tweet 0']
+    assert tweets[2]['author'] == {"id": 2, "name": 'User 2'}
+    assert tweets[2]['likes'] == [{"user_id": 3, "name": 'User 3'}]
+    # Шард твита по id вычисляется из корзины автора в младших битах
+    tweet = json.loads(client.get(f'/api/tweets/{ids[1]}', headers=_headers(4)).data)['tweet']
+    assert tweet == tweets[2] | {"archived": False}
+    assert client.get('/api/tweets/12345', headers=_headers(4)).status_code == 404
+
+    assert client.delete(f'/api/tweets/{ids[1]}/likes', headers=_headers(3)).status_code == 200
+    assert client.post('/api/tweets/12345/likes', headers=_headers(3)).status_code == 404
+
+
+def test_tweet_shard_from_id(sharded_app):
+    """Тестирование: id твита несет корзину автора, лайк и чтение идут на один шард"""
+    client = sharded_app.test_client()
+    tweet_ids = [_post(client, author, 'Hello') for author in (1, 2, 1023)]
+    assert [tweet_id % SHARD_BUCKETS for tweet_id in tweet_ids] == [bucket_of(1), bucket_of(2), bucket_of(1023)]
+
+    queried = []
+    for index, engine in enumerate(sharded_app.extensions[SHARDS].engines):
+        sa.event.listen(engine, 'before_cursor_execute',
+                        lambda *args, index=index: queried.append(index))
+    assert client.post(f'/api/tweets/{tweet_ids[1]}/likes', headers=_headers(1)).status_code == 200
+    assert client.get(f'/api/tweets/{tweet_ids[1]}', headers=_headers(1)).status_code == 200
+    assert client.delete(f'/api/tweets/{tweet_ids[1]}/likes', headers=_headers(1)).status_code == 200
+    assert set(queried) == {0}
+
+
+def test_tweet_media_on_primary_with_foreign_keys(sharded_app):
+    """Тестирование: привязка медиа к твиту на шарде проходит при включенных внешних ключах основной базы"""
+    sa.event.listen(db.engine, 'connect', lambda connection, record: connection.execute('PRAGMA foreign_keys=ON'))
+    db.session.remove()
+    db.engine.dispose()
+    client = sharded_app.test_client()
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 20), 'red').save(buffer, format='PNG')
+    response = client.post('/api/medias', headers=_headers(1), content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(buffer.getvalue()), 'photo.png')})
+    media_id = json.loads(response.data)['media_id']
+
+    response = client.post('/api/tweets', headers=_headers(1),
+                           json={'tweet_data': 'With media', 'tweet_media_ids': [media_id]})
+    assert response.status_code == 201, response.data
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA foreign_keys').scalar() == 1
+        assert connection.exec_driver_sql('PRAGMA foreign_key_check').all() == []
+    tweets = json.loads(client.get('/api/tweets', headers=_headers(1)).data)['tweets']
+    assert tweets[0]['attachments_meta'][0]['width'] == 40
+
+
+def test_repair_follows(sharded_app):
+    """Тестирование починки подписок: по шарду подписчика добавляется недостающая копия, лишняя удаляется"""
+    client = sharded_app.test_client()
+    client.post('/api/users/2/follow', headers=_headers(1))
+    client.post('/api/users/1/follow', headers=_headers(4))
+    engines = sharded_app.extensions[SHARDS].engines
+    # Сбой между фиксациями: у 1 -> 2 пропала копия на шарде 0, у 4 -> 1 - на шарде подписчика
+    with engines[0].begin() as connection:
+        connection.execute(sa.delete(Follow.__table__).where(Follow.__table__.c.follower_id == 1))
+        connection.execute(sa.delete(Follow.__table__).where(Follow.__table__.c.follower_id == 4))
+
+    result = sharded_app.test_cli_runner().invoke(args=['shards', 'repair-follows'])
+    assert result.exit_code == 0, result.output
+    assert 'Repaired follows: 1 added, 1 removed' in result.output
+    assert [(row.follower_id, row.following_id) for row in _rows(sharded_app, 0, Follow)] == [(1, 2)]
+    assert [(row.follower_id, row.following_id) for row in _rows(sharded_app, 1, Follow)] == [(1, 2)]
+
+    result = sharded_app.test_cli_runner().invoke(args=['shards', 'repair-follows'])
+    assert 'Repaired follows: 0 added, 0 removed' in result.output
+
+
+def test_delete_tweet(sharded_app):
+    """Тестирование удаления: свой твит, чужой твит на другом шарде, несуществующий твит"""
+    client = sharded_app.test_client()
+    own = _post(client, 1, 'Own')
+    foreign = _post(client, 2, 'Foreign')
+    client.post(f'/api/tweets/{own}/likes', headers=_headers(2))
+
+    assert client.delete(f'/api/tweets/{foreign}', headers=_headers(1)).status_code == 403
+    assert client.delete('/api/tweets/12345', headers=_headers(1)).status_code == 404
+    assert client.delete(f'/api/tweets/{own}', headers=_headers(1)).status_code == 200
+    assert _rows(sharded_app, 1, Tweet) == _rows(sharded_app, 1, Like) == []
+
+
+def test_pending_tweet_published_on_shard(sharded_app):
+    """Тестирование фоновой загрузки: твит на шарде публикуется после обработки медиа в основной базе"""
+    client = sharded_app.test_client()
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 20), 'red').save(buffer, format='PNG')
+    response = client.post('/api/medias?async=1', headers=_headers(1), content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(buffer.getvalue()), 'photo.png')})
+    media_id = json.loads(response.data)['media_id']
+    response = client.post('/api/tweets', headers=_headers(1),
+                           json={'tweet_data': 'Soon', 'tweet_media_ids': [media_id]})
+    assert json.loads(response.data)['status'] == 'pending'
+    assert json.loads(client.get('/api/tweets', headers=_headers(1)).data)['tweets'] == []
+
+    assert process_pending_media() == 1
+    tweets = json.loads(client.get('/api/tweets', headers=_headers(1)).data)['tweets']
+    assert [tweet['content'] for tweet in tweets] == ['Soon']
+    assert tweets[0]['attachments_meta'][0]['width'] == 40
+
+
+def test_moving_bucket_rejects_writes(sharded_app):
+    """Тестирование: запись в переезжающую корзину отвечает 503, чтение работает"""
+    client = sharded_app.test_client()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('UPDATE shard_buckets SET moving = 1 WHERE bucket = 1')
+    response = client.post('/api/tweets', headers=_headers(1), json={'tweet_data': 'Hello'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.get('/api/tweets', headers=_headers(1)).status_code == 200
+    _post(client, 2, 'Other bucket')
+
+
+def test_purge_deleted_user_on_shards(sharded_app):
+    """Тестирование удаления аккаунта: твиты, лайки и подписки удаляются со всех шардов"""
+    client = sharded_app.test_client()
+    own = _post(client, 1, 'Own')
+    other = _post(client, 2, 'Other')
+    client.post(f'/api/tweets/{own}/likes', headers=_headers(2))
+    client.post(f'/api/tweets/{other}/likes', headers=_headers(1))
+    client.post('/api/users/2/follow', headers=_headers(1))
+    assert client.delete('/api/users/me', headers=_headers(1)).status_code == 202
+
+    result = sharded_app.test_cli_runner().invoke(args=['users', 'purge'])
+    assert 'Purged 1 users: 1 tweets, 2 likes, 2 follows' in result.output
+    assert _rows(sharded_app, 1, Tweet) == _rows(sharded_app, 1, Like) == _rows(sharded_app, 1, Follow) == []
+    assert [row.id for row in _rows(sharded_app, 0, Tweet)] == [other]
+    assert _rows(sharded_app, 0, Like) == _rows(sharded_app, 0, Follow) == []
+
+
+def test_batch_relations_not_available(sharded_app):
+    """Тестирование пакетных лайков при шардировании"""
+    client = sharded_app.test_client()
+    response = client.post('/api/batch/likes', headers=_headers(1), json={'items': [{'tweet_id': 1}]})
+    assert response.status_code == 501
+
+
+def test_plan_rebalance_moves_minimum():
+    """Тестирование плана: новому шарду отходит треть корзин, между старыми ничего не переезжает"""
+    moves = plan_rebalance(default_map(2), 3)
+    assert len(moves) == SHARD_BUCKETS // 3
+    assert {target for _, _, target in moves} == {2}
+    assert plan_rebalance(default_map(3), 3) == []
+
+    # Вывод шарда: все его корзины уходят на оставшиеся
+    moves = plan_rebalance(default_map(3), 2)
+    assert {source for _, source, _ in moves} == {2}
+    assert len(moves) == default_map(3).count(2)
+
+
+def test_rebalance_to_new_shard(sharded_app, tmp_path, monkeypatch):
+    """Тестирование перешардирования: данные переезжают на новый шард и читаются через API"""
+    client = sharded_app.test_client()
+    client.post('/api/users/1/follow', headers=_headers(1023))
+    client.post('/api/users/1022/follow', headers=_headers(2))
+    for author in USER_IDS:
+        _post(client, author, f'From {author}')
+    tweet_of_1022 = [row.id for row in _rows(sharded_app, 0, Tweet) if row.author_id == 1022][0]
+    client.post(f'/api/tweets/{tweet_of_1022}/likes', headers=_headers(1))
+    _dispose(sharded_app)
+
+    app = _make_app(tmp_path, monkeypatch, 3)
+    with app.app_context():
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['shards', 'rebalance', '--dry-run'])
+        assert 'Planned 341 buckets' in result.output
+        result = runner.invoke(args=['shards', 'rebalance'])
+        assert result.exit_code == 0, result.output
+
+        shards = app.extensions[SHARDS]
+        assert [shards.shard_for_user(user_id) for user_id in USER_IDS] == [1, 0, 1, 0, 2, 2]
+        for shard in range(3):
+            assert sorted(row.author_id for row in _rows(app, shard, Tweet)) == [
+                user_id for user_id in USER_IDS if shards.shard_for_user(user_id) == shard]
+        # Подписка 1023 -> 1 осталась на шарде 1 и переехала на шард 2; 2 -> 1022 - на шардах 0 и 2
+        follows = {shard: sorted((row.follower_id, row.following_id) for row in _rows(app, shard, Follow))
+                   for shard in range(3)}
+        assert follows == {0: [(2, 1022)], 1: [(1023, 1)], 2: [(2, 1022), (1023, 1)]}
+        assert [(row.user_id, row.tweet_id) for row in _rows(app, 2, Like)] == [(1, tweet_of_1022)]
+
+        client = app.test_client()
+        tweets = json.loads(client.get('/api/tweets', headers=_headers(2)).data)['tweets']
+        assert sorted(tweet['content'] for tweet in tweets) == ['From 1022', 'From 2']
+        assert [tweet['likes'] for tweet in tweets if tweet['id'] == tweet_of_1022] == [[{"user_id": 1, "name": 'User 1'}]]
+        me = json.loads(client.get('/api/users/me', headers=_headers(1023)).data)['user']
+        assert me['following'] == [{"id": 1, "name": 'User 1'}]
+        assert client.post('/api/tweets', headers=_headers(1023), json={'tweet_data': 'After'}).status_code == 201
+        assert 'Shard 2: 341 of 1024 buckets' in runner.invoke(args=['shards', 'status']).output
+        _dispose(app)
@@ -0,0 +1,96 @@
+import pytest
+import json
+from datetime import datetime
+from models.models import User, Tweet, db
+from utils.snowflake import (SnowflakeGenerator, id_timestamp, id_bucket, _claim_slot, EPOCH_MS,
+                             MAX_SEQUENCE, SEQUENCE_BITS, BUCKET_BITS)
+
+
+class FakeClock:
+    """Часы, которые стоят на месте, пока их не сдвинут; sleep генератора их двигает"""
+
+    def __init__(self, now):
+        self.now = now
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.now
+
+
+def test_ids_are_unique_and_ordered(monkeypatch):
+    """Тестирование роста id, переполнения счетчика и отката часов"""
+    clock = FakeClock(EPOCH_MS + 1000)
+    generator = SnowflakeGenerator(5, clock=clock)
+    monkeypatch.setattr('utils.snowflake.time.sleep', lambda seconds: setattr(clock, 'now', clock.now + 1))
+
+    ids = generator.next_ids(MAX_SEQUENCE + 2)
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    # Последний id не поместился в миллисекунду и взят из следующей
+    assert ids[-1] >> (SEQUENCE_BITS + 10) == 1001
+    assert (ids[0] >> SEQUENCE_BITS) & 0x3FF == 5
+    assert id_timestamp(ids[0]) == datetime(2024, 1, 1, 0, 0, 1)
+
+    # Небольшой откат часов пережидается, большой - ошибка
+    clock.now -= 5
+    assert generator.next_id() > ids[-1]
+    clock.now -= 1000
+    with pytest.raises(RuntimeError):
+        generator.next_id()
+
+
+def test_ids_carry_bucket(monkeypatch):
+    """Тестирование раскладки с корзиной: счетчик свой у каждой корзины, корзина читается из id"""
+    clock = FakeClock(EPOCH_MS + 1000)
+    generator = SnowflakeGenerator(5, clock=clock, bucket_bits=BUCKET_BITS)
+    monkeypatch.setattr('utils.snowflake.time.sleep', lambda seconds: setattr(clock, 'now', clock.now + 1))
+
+    ids = generator.next_ids(5, bucket=1023)
+    assert [id_bucket(tweet_id) for tweet_id in ids] == [1023] * 5
+    assert ids == sorted(ids) and len(set(ids)) == 5
+    # Четыре id на корзину в миллисекунду, пятый - из следующей
+    assert [tweet_id >> (SEQUENCE_BITS + 10) for tweet_id in ids] == [1000] * 4 + [1001]
+    other = generator.next_id(7)
+    assert id_bucket(other) == 7 and id_timestamp(other) == id_timestamp(ids[-1])
+    with pytest.raises(ValueError):
+        generator.next_id(1 << BUCKET_BITS)
+
+
+def test_claim_slot_is_exclusive(tmp_path):
+    """Тестирование раздачи слотов процессов через flock"""
+    first, first_handle = _claim_slot(str(tmp_path))
+    second, second_handle = _claim_slot(str(tmp_path))
+    assert first != second
+    first_handle.close()
+    third, third_handle = _claim_slot(str(tmp_path))
+    assert third == first
+    second_handle.close()
+    third_handle.close()
+
+
+@pytest.fixture
+def snowflake_app(app, tmp_path):
+    """Приложение с id твитов, назначаемыми приложением"""
+    app.config['TWEET_ID_STRATEGY'] = 'snowflake'
+    app.config['SNOWFLAKE_LOCK_DIR'] = str(tmp_path)
+    db.session.add(User(name='User', api_key='test_api_key'))
+    db.session.commit()
+    return app
+
+
+def test_tweets_get_snowflake_ids(snowflake_app, client):
+    """Тестирование создания твитов с id по времени и ленты в порядке id"""
+    response = client.post('/api/tweets', headers={'api-key': 'test_api_key'}, json={'tweet_data': 'First'})
+    first_id = json.loads(response.data)['tweet_id']
+    assert first_id > 2 ** 40
+
+    response = client.post('/api/batch/tweets', headers={'api-key': 'test_api_key'},
+                           json={'items': [{'tweet_data': 'Second'}, {'tweet_data': 'Third'}]})
+    batch_ids = [item['tweet_id'] for item in json.loads(response.data)['results']]
+    assert first_id < batch_ids[0] < batch_ids[1]
+    assert db.session.get(Tweet, batch_ids[1]).content == 'Third'
+
+    response = client.get('/api/tweets', headers={'api-key': 'test_api_key'})
+    timeline = [tweet['id'] for tweet in json.loads(response.data)['tweets']]
+    # Твиты пачки созданы в одну миллисекунду, но порядок по id однозначен
+    assert timeline == [batch_ids[1], batch_ids[0], first_id]
@@ -0,0 +1,66 @@
+import pytest
+import json
+from sqlalchemy import event
+from models.models import User, Tweet, Like, Media, tweet_media, db, TWEET_DELETED
+
+
+@pytest.fixture
+def soft_delete(app):
+    """Мягкое удаление: твит 1 с медиа и лайком, твит 2 остается"""
+    app.config['TWEETS_SOFT_DELETE'] = True
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(name='Author', api_key='author_key'), User(name='Reader', api_key='reader_key')])
+        db.session.flush()
+        deleted = Tweet(content='Deleted', author_id=1)
+        deleted.media.append(Media(filename='deleted.png', owner_id=1))
+        db.session.add_all([deleted, Tweet(content='Kept', author_id=1)])
+        db.session.flush()
+        db.session.add(Like(user_id=2, tweet_id=deleted.id))
+        db.session.commit()
+        yield
+
+
+def test_soft_deleted_tweet_hidden(client, soft_delete):
+    """Тестирование мягкого удаления: твит скрыт из чтений, строки остаются до чистки"""
+    headers = {'api-key': 'author_key'}
+    assert client.delete('/api/tweets/1', headers=headers).status_code == 200
+    assert db.session.get(Tweet, 1).status == TWEET_DELETED
+    assert Like.query.filter_by(tweet_id=1).count() == 1
+
+    tweets = json.loads(client.get('/api/tweets', headers=headers).data)['tweets']
+    assert [tweet['content'] for tweet in tweets] == ['Kept']
+    assert client.get('/api/tweets/1', headers=headers).status_code == 404
+    assert client.delete('/api/tweets/1', headers=headers).status_code == 404
+    assert client.post('/api/tweets/1/likes', headers={'api-key': 'reader_key'}).status_code == 404
+    response = client.post('/api/batch/likes', headers={'api-key': 'reader_key'},
+                           json={'items': [{'tweet_id': 1}, {'tweet_id': 2}]})
+    assert [item['result'] for item in json.loads(response.data)['results']] == [False, True]
+
+
+def test_reap_deleted_tweets(app, client, runner, soft_delete):
+    """Тестирование чистки: строки твита, лайки и связи с медиа удаляются, медиа ждет сборки мусора"""
+    client.delete('/api/tweets/1', headers={'api-key': 'author_key'})
+
+    statements = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _record(connection, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT tweets.id'):
+            statements.append((statement, parameters))
+
+    result = runner.invoke(args=['tweets', 'reap', '--batch-size', '1'])
+    event.remove(db.engine, 'before_cursor_execute', _record)
+    assert result.exit_code == 0, result.output
+    assert 'Reaped 1 tweets and 1 likes' in result.output
+
+    assert [tweet.content for tweet in Tweet.query.all()] == ['Kept']
+    assert Like.query.count() == 0
+    assert db.session.execute(tweet_media.select()).all() == []
+    assert Media.query.count() == 1
+
+    # Удаленные твиты находятся по частичному индексу
+    statement, parameters = statements[0]
+    with db.engine.connect() as connection:
+        plan = ' '.join(row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters))
+    assert 'ix_tweets_deleted' in plan
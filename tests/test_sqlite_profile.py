@@ -0,0 +1,111 @@
+import pytest
+import json
+import sqlite3
+import threading
+import sqlalchemy as sa
+from flask import Flask
+from app import create_app
+from models.models import db, User, Tweet
+from models.session import READ_ENGINE
+from utils.sqlite_profile import configure_sqlite
+
+
+@pytest.fixture
+def sqlite_app(tmp_path, monkeypatch):
+    """Приложение на файле SQLite с производственным профилем"""
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path}/app.db')
+    monkeypatch.setenv('SQLITE_PROFILE', 'production')
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(name='User', api_key='test_api_key'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        app.extensions[READ_ENGINE].dispose()
+        db.engine.dispose()
+
+
+def _pragmas(engine):
+    with engine.connect() as connection:
+        return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'query_only')}
+
+
+def test_pragmas_on_every_connection(sqlite_app):
+    """Тестирование PRAGMA соединений записи и чтения"""
+    writer = _pragmas(db.engine)
+    reader = _pragmas(sqlite_app.extensions[READ_ENGINE])
+    for pragmas in (writer, reader):
+        assert pragmas['journal_mode'] == 'wal'
+        assert pragmas['synchronous'] == 1  # NORMAL
+        assert pragmas['busy_timeout'] == 5000
+        assert pragmas['cache_size'] == -64 * 1024
+        assert pragmas['mmap_size'] == 256 * 1024 * 1024
+    assert (writer['query_only'], reader['query_only']) == (0, 1)
+    assert db.engine.pool.size() == 1
+
+
+def test_reads_use_pool_until_first_write(sqlite_app):
+    """Тестирование маршрутизации: чтения в пул, запись и все после нее - в соединение записи"""
+    reader = sqlite_app.extensions[READ_ENGINE]
+    query = sa.select(User)
+    assert db.session.get_bind(clause=query) is reader
+
+    db.session.add(User(name='Other', api_key='other_key'))
+    db.session.flush()
+    assert db.session.get_bind(clause=query) is db.engine
+    # Незафиксированная запись видна в той же транзакции
+    assert User.query.filter_by(api_key='other_key').count() == 1
+    db.session.commit()
+
+    assert db.session.get_bind(clause=query) is reader
+    assert User.query.filter_by(api_key='other_key').count() == 1
+
+
+def test_writer_locks_before_first_read(sqlite_app, tmp_path):
+    """Тестирование BEGIN IMMEDIATE: блокировка записи взята до чтения, а не при первом изменении"""
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('SELECT count(*) FROM users').scalar()
+        assert connection.connection.driver_connection.in_transaction
+
+        other = sqlite3.connect(str(tmp_path / 'app.db'), timeout=0, isolation_level=None)
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            other.execute('BEGIN IMMEDIATE')
+        other.close()
+
+        connection.exec_driver_sql("INSERT INTO users (name, api_key) VALUES ('Other', 'other_key')")
+        connection.commit()
+    assert User.query.filter_by(api_key='other_key').count() == 1
+
+
+def test_concurrent_writers(sqlite_app):
+    """Тестирование одновременной записи из нескольких потоков без "database is locked\""""
+    client = sqlite_app.test_client()
+    errors = []
+
+    def _worker(number):
+        for index in range(10):
+            response = client.post('/api/tweets', headers={'api-key': 'test_api_key'},
+                                   json={'tweet_data': f'Tweet {number}-{index}'})
+            if response.status_code != 201:
+                errors.append(json.loads(response.data))
+            client.get('/api/tweets', headers={'api-key': 'test_api_key'})
+
+    threads = [threading.Thread(target=_worker, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert Tweet.query.count() == 80
+
+
+def test_profile_requires_database_file():
+    """Тестирование отказа для базы в памяти"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLITE_PROFILE'] = 'production'
+    with pytest.raises(ValueError):
+        configure_sqlite(app)
@@ -0,0 +1,189 @@
+import pytest
+import io
+import json
+from PIL import Image
+from models.models import User, Media, MediaBlob, db
+from utils.storage import S3Storage
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3Client:
+    """Заглушка клиента S3: объекты хранятся в словаре"""
+
+    def __init__(self):
+        self.objects = {}
+        self.multipart = {}
+        self.fail_part = None
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body.read()
+
+    def create_multipart_upload(self, Bucket, Key, ContentType=None):
+        upload_id = f'upload-{len(self.multipart)}'
+        self.multipart[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise FakeClientError('500')
+        self.multipart[UploadId][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.multipart.pop(UploadId)
+        self.objects[Key] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.multipart.pop(UploadId)
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise FakeClientError('NoSuchKey')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise FakeClientError('404')
+        return {'ContentLength': len(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f'https://s3.test/{Params["Bucket"]}/{Params["Key"]}?op={operation}&expires={ExpiresIn}'
+
+
+@pytest.fixture
+def s3(app, tmp_path):
+    """Хранилище S3 на заглушке; папка загрузок - только для временных файлов"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['MEDIA_VARIANT_SIZES'] = (150,)
+    app.config['MEDIA_MODERN_FORMATS'] = ()
+    client = FakeS3Client()
+    app.extensions['media_storage'] = S3Storage('media', client=client, prefix='m/')
+    user = User(name='User', api_key='test_api_key')
+    db.session.add(user)
+    db.session.commit()
+    return client
+
+
+def _png(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_multipart_put(tmp_path):
+    """Тестирование загрузки большого файла частями и отмены при ошибке"""
+    client = FakeS3Client()
+    storage = S3Storage('media', client=client, multipart_threshold=1024)
+    source = tmp_path / 'big.bin'
+    content = bytes(range(256)) * (11 * 1024 * 1024 // 256)
+    source.write_bytes(content)
+
+    storage.put_file('big.bin', str(source))
+    assert client.objects['big.bin'] == content
+
+    client.fail_part = 2
+    with pytest.raises(FakeClientError):
+        storage.put_file('other.bin', str(source))
+    assert 'other.bin' not in client.objects
+    assert client.multipart == {}
+
+
+def test_upload_to_s3(app, client, s3, tmp_path):
+    """Тестирование загрузки, копий, отдачи и удаления медиа в S3"""
+    response = client.post(
+        '/api/medias',
+        headers={'api-key': 'test_api_key'},
+        data={'file': (io.BytesIO(_png(400, 200)), 'photo.png')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 201
+    media = Media.query.get(json.loads(response.data)['media_id'])
+    stem = media.filename.rsplit('.', 1)[0]
+    assert set(s3.objects) == {f'm/{media.filename}', f'm/{stem}_150.png'}
+    assert MediaBlob.query.get(media.blob_hash).variant_sizes == [150]
+    # Временные файлы и копии на локальном диске не остаются
+    assert not any(path.is_file() for path in tmp_path.rglob('*'))
+
+    response = client.get(media.get_url(100))
+    assert response.status_code == 302
+    assert response.location == f'https://s3.test/media/m/{stem}_150.png?op=get_object&expires=3600'
+
+    db.session.delete(media)
+    db.session.commit()
+    assert s3.objects == {}
+
+
+def test_direct_upload(app, client, s3):
+    """Тестирование загрузки в хранилище по подписанной ссылке"""
+    response = client.post('/api/medias/direct', headers={'api-key': 'test_api_key'},
+                           json={'filename': 'photo.png', 'size': 100})
+    assert response.status_code == 201
+    data = json.loads(response.data)
+    assert data['upload_url'].startswith(f'https://s3.test/media/m/{data["key"]}?op=put_object')
+
+    # Клиент загружает файл напрямую в хранилище
+    s3.objects[f'm/{data["key"]}'] = _png(30, 20)
+    response = client.post('/api/medias/direct/complete', headers={'api-key': 'test_api_key'},
+                           json={'key': data['key']})
+    assert response.status_code == 201
+    media = Media.query.get(json.loads(response.data)['media_id'])
+    assert (media.width, media.height) == (30, 20)
+    assert set(s3.objects) == {f'm/{media.filename}'}
+
+    # Чужие и несуществующие ключи отклоняются
+    response = client.post('/api/medias/direct/complete', headers={'api-key': 'test_api_key'},
+                           json={'key': 'incoming/999/x.png'})
+    assert response.status_code == 400
+    response = client.post('/api/medias/direct/complete', headers={'api-key': 'test_api_key'},
+                           json={'key': data['key']})
+    assert response.status_code == 404
+
+
+def test_direct_upload_requires_object_storage(app, client):
+    """Тестирование отказа в прямой загрузке для локального хранилища"""
+    db.session.add(User(name='User', api_key='test_api_key'))
+    db.session.commit()
+    response = client.post('/api/medias/direct', headers={'api-key': 'test_api_key'},
+                           json={'filename': 'photo.png', 'size': 100})
+    assert response.status_code == 400
+
+
+def test_s3_formats_recorded_without_object_reads(app, client, s3, monkeypatch):
+    """Тестирование S3: копии строятся из временного файла, формат выбирается по записи в базе"""
+    app.config['MEDIA_MODERN_FORMATS'] = ('webp',)
+    calls = []
+    for name in ('head_object', 'get_object'):
+        monkeypatch.setattr(s3, name, lambda *args, name=name, method=getattr(s3, name), **kwargs:
+                            calls.append(name) or method(*args, **kwargs))
+
+    response = client.post(
+        '/api/medias',
+        headers={'api-key': 'test_api_key'},
+        data={'file': (io.BytesIO(_png(400, 200)), 'photo.png')},
+        content_type='multipart/form-data'
+    )
+    media = Media.query.get(json.loads(response.data)['media_id'])
+    stem = media.filename.rsplit('.', 1)[0]
+    assert MediaBlob.query.get(media.blob_hash).variants == '150,webp,150.webp'
+    assert f'm/{media.filename}.webp' in s3.objects
+    assert 'get_object' not in calls
+    calls.clear()
+
+    response = client.get(media.get_url(), headers={'Accept': 'image/webp'})
+    assert response.location.startswith(f'https://s3.test/media/m/{media.filename}.webp?')
+    response = client.get(media.get_url(100), headers={'Accept': 'image/webp'})
+    assert response.location.startswith(f'https://s3.test/media/m/{stem}_150.png.webp?')
+    response = client.get(media.get_url(), headers={'Accept': 'image/avif,*/*'})
+    assert response.location.startswith(f'https://s3.test/media/m/{media.filename}?')
+    assert calls == []
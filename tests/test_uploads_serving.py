@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    """Отдельная папка загрузок с одним файлом и его WebP версией"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    (tmp_path / 'ab' / 'cd').mkdir(parents=True)
+    (tmp_path / 'ab' / 'cd' / 'abcdef.png').write_bytes(b'0123456789')
+    (tmp_path / 'ab' / 'cd' / 'abcdef.png.webp').write_bytes(b'01234')
+    return tmp_path
+
+
+def test_direct_serving_headers(app, client, upload_folder):
+    """Тестирование строгого ETag, кэширования и Range при отдаче через Flask"""
+    response = client.get('/uploads/ab/cd/abcdef.png')
+    assert response.status_code == 200
+    assert response.data == b'0123456789'
+    assert response.headers['ETag'] == '"abcdef.png"'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert 'Accept' in response.vary
+
+    response = client.get('/uploads/ab/cd/abcdef.png', headers={'Range': 'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == b'2345'
+    assert response.headers['Content-Range'] == 'bytes 2-5/10'
+
+    response = client.get('/uploads/ab/cd/abcdef.png', headers={'If-None-Match': '"abcdef.png"'})
+    assert response.status_code == 304
+
+    response = client.get('/uploads/ab/cd/abcdef.png', headers={'Accept': 'image/webp'})
+    assert response.mimetype == 'image/webp'
+    assert response.headers['ETag'] == '"abcdef.png.webp"'
+
+
+def test_accel_redirect(app, client, upload_folder):
+    """Тестирование передачи отдачи файла nginx через X-Accel-Redirect"""
+    app.config['UPLOADS_ACCEL_REDIRECT'] = True
+
+    response = client.get('/uploads/abcdef.png', headers={'Accept': 'image/webp'})
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-uploads/ab/cd/abcdef.png.webp'
+    assert response.mimetype == 'image/webp'
+    assert response.data == b''
+    assert response.cache_control.immutable
+    assert 'Accept' in response.vary
+
+    assert client.get('/uploads/ab/cd/missing.png').status_code == 404
+
+
+def test_rejected_alternate_path(app, client, upload_folder):
+    """Тестирование имени, путь которого в другой раскладке выходит за папку загрузок"""
+    assert client.get('/uploads/zz/q/..').status_code == 404
+    app.config['UPLOADS_ACCEL_REDIRECT'] = True
+    assert client.get('/uploads/zz/q/..').status_code == 404
@@ -0,0 +1,60 @@
+from models.models import User, Tweet, Like, Follow, db
+from utils.upserts import (add_like, remove_like, add_follow, remove_follow,
+                           CREATED, DELETED, EXISTS, ABSENT, NOT_FOUND)
+
+
+def test_add_like_statuses(app, client):
+    """Тестирование идемпотентной вставки лайка"""
+    with app.app_context():
+        user = User(name='User', api_key='user_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        tweet = Tweet(content='Test tweet', author=user)
+        db.session.add(tweet)
+        db.session.commit()
+
+        # Первая вставка создает лайк, повторная не падает с IntegrityError
+        assert add_like(user.id, tweet.id) == CREATED
+        assert add_like(user.id, tweet.id) == EXISTS
+        db.session.commit()
+        assert Like.query.filter_by(user_id=user.id, tweet_id=tweet.id).count() == 1
+
+        # Несуществующий твит
+        assert add_like(user.id, 99999) == NOT_FOUND
+
+
+def test_remove_like_statuses(app, client):
+    """Тестирование удаления лайка одним запросом"""
+    with app.app_context():
+        user = User(name='User', api_key='user_api_key')
+        db.session.add(user)
+        db.session.commit()
+
+        tweet = Tweet(content='Test tweet', author=user)
+        db.session.add(tweet)
+        db.session.add(Like(user=user, tweet=tweet))
+        db.session.commit()
+
+        assert remove_like(user.id, tweet.id) == DELETED
+        assert remove_like(user.id, tweet.id) == ABSENT
+        assert remove_like(user.id, 99999) == NOT_FOUND
+
+
+def test_follow_statuses(app, client):
+    """Тестирование идемпотентной подписки и отписки"""
+    with app.app_context():
+        user1 = User(name='User 1', api_key='user1_api_key')
+        user2 = User(name='User 2', api_key='user2_api_key')
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        assert add_follow(user1.id, user2.id) == CREATED
+        assert add_follow(user1.id, user2.id) == EXISTS
+        assert add_follow(user1.id, 99999) == NOT_FOUND
+        db.session.commit()
+        assert Follow.query.filter_by(follower_id=user1.id).count() == 1
+
+        assert remove_follow(user1.id, user2.id) == DELETED
+        assert remove_follow(user1.id, user2.id) == ABSENT
+        assert remove_follow(user1.id, 99999) == NOT_FOUND
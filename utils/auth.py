@@ -3,6 +3,6 @@ from models.models import User
 
 def get_user_by_api_key(api_key):
     """
-    Получает пользователя по API ключу
+    Получает пользователя по API ключу; ключ удаленного аккаунта недействителен
     """
-    return User.query.filter_by(api_key=api_key).first()
\ No newline at end of file
+    return User.query.filter_by(api_key=api_key, deleted_at=None).first()
\ No newline at end of file
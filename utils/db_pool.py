@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
+
+
+# Границы гистограммы ожидания соединения, мс
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+
+class PoolMetrics:
+    """
+    Счетчики пула одного процесса: сколько раз и как долго ждали соединение.
+    Ожидание включает установку нового соединения, если свободного в пуле не было
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_checkout(self, seconds):
+        ms = seconds * 1000.0
+        bucket = next((index for index, bound in enumerate(WAIT_BUCKETS_MS) if ms <= bound), len(WAIT_BUCKETS_MS))
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.wait_buckets[bucket] += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            labels = [f'<={bound}ms' for bound in WAIT_BUCKETS_MS] + [f'>{WAIT_BUCKETS_MS[-1]}ms']
+            return {
+                "pid": os.getpid(),
+                "size": pool.size(),
+                "in_use": pool.checkedout(),
+                "idle": pool.checkedin(),
+                # Отрицательное значение - сколько постоянных соединений еще не открыто
+                "overflow": pool.overflow(),
+                "max_overflow": pool._max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "wait_ms_avg": round(self.wait_total * 1000.0 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_max * 1000.0, 3),
+                "wait_histogram": dict(zip(labels, self.wait_buckets)),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool, который считает время ожидания соединения и таймауты
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except sa.exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - started)
+        return record
+
+    def _create_connection(self):
+        self.metrics.record_connect()
+        return super()._create_connection()
+
+    def recreate(self):
+        # dispose() пересоздает пул - счетчики процесса сохраняются
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def is_memory_database(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def pool_options(config, url, options=None):
+    """
+    Параметры движка с пулом из конфигурации (DB_POOL_*) поверх options.
+    DB_POOL_MODE=pgbouncer - режим для PgBouncer в transaction pooling: соединение
+    сервера меняется между транзакциями, поэтому никакого состояния сессии и
+    серверных подготовленных запросов
+    """
+    options = dict(options or {})
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=config.get('DB_POOL_SIZE', 5),
+        max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+        pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+        pool_pre_ping=config.get('DB_POOL_PRE_PING', True),
+        # Последнее возвращенное соединение выдается первым: лишние простаивают и закрываются
+        pool_use_lifo=True,
+    )
+
+    mode = config.get('DB_POOL_MODE', 'direct')
+    if mode == 'pgbouncer':
+        if url.get_backend_name() != 'postgresql':
+            raise ValueError('DB_POOL_MODE=pgbouncer requires a PostgreSQL database URL')
+        connect_args = dict(options.get('connect_args') or {})
+        if url.get_driver_name() == 'psycopg':
+            # psycopg 3 готовит запросы на сервере после нескольких повторов - отключаем
+            connect_args['prepare_threshold'] = None
+        options['connect_args'] = connect_args
+        # Уровень изоляции через SET SESSION остался бы на чужом серверном соединении
+        options.pop('isolation_level', None)
+    elif mode != 'direct':
+        raise ValueError(f'Unknown DB_POOL_MODE: {mode}')
+    elif url.get_driver_name() == 'psycopg':
+        # psycopg 3 готовит запрос на сервере после DB_PREPARE_THRESHOLD выполнений на соединении:
+        # горячие запросы больше не разбираются и не планируются заново
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args['prepare_threshold'] = config.get('DB_PREPARE_THRESHOLD', 5)
+        options['connect_args'] = connect_args
+    return options
+
+
+def configure_pool(app):
+    """
+    Параметры пула основного движка. Вызывается до db.init_app
+    """
+    url = sa.engine.make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if is_memory_database(url):
+        # База в памяти живет в одном соединении (StaticPool)
+        return False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_options(
+        app.config, url, app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
+    return True
+
+
+def pooled_engine(app, uri):
+    """
+    Отдельный движок (реплика, шард) с теми же параметрами пула, что у основного
+    """
+    url = sa.engine.make_url(uri)
+    if is_memory_database(url):
+        raise ValueError('An additional database must be a file or a server, not an in-memory database')
+    if url.get_backend_name() == 'sqlite' and not os.path.isabs(url.database):
+        # Относительный путь считается от instance_path, как у основной базы в Flask-SQLAlchemy
+        url = url.set(database=os.path.join(app.instance_path, url.database))
+    return sa.create_engine(url, **pool_options(app.config, url))
+
+
+def pool_stats(engine):
+    """
+    Состояние пула движка в текущем процессе или None, если пул без счетчиков
+    """
+    metrics = getattr(engine.pool, 'metrics', None)
+    if metrics is None:
+        return None
+    return metrics.snapshot(engine.pool)
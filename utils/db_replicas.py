@@ -0,0 +1,173 @@
+import itertools
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, request
+
+from models.session import REPLICA_ENGINE
+from utils.db_pool import pooled_engine
+
+
+REPLICAS = 'db_replicas'
+# Кука с моментом (unix time), до которого чтения клиента идут в основную базу:
+# запись и следующее чтение могут попасть в разные воркеры
+STICKY_COOKIE = 'read_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# После скольких записей в памяти чистить истекшие окна
+STICKY_PRUNE_SIZE = 10000
+
+# Реплика, проигравшая весь WAL, не отстает, даже если на основной базе давно не было записи
+_POSTGRES_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+def measure_lag(connection):
+    """
+    Отставание реплики в секундах; у копии файла SQLite его измерить нечем - 0
+    """
+    if connection.dialect.name == 'postgresql':
+        return float(connection.exec_driver_sql(_POSTGRES_LAG_SQL).scalar() or 0)
+    connection.exec_driver_sql('SELECT 1')
+    return 0.0
+
+
+class Replica:
+    """
+    Движок реплики и результат последней проверки
+    """
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+        self._checking = threading.Lock()
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as connection:
+                self.lag = measure_lag(connection)
+            self.error = None if self.lag <= max_lag else f'Replication lag {self.lag:.1f}s'
+        except Exception as e:
+            self.lag = None
+            self.error = str(e)
+        self.healthy = self.error is None
+        self.checked_at = time.monotonic()
+
+    def available(self, max_lag, interval):
+        """
+        Результат проверки не старше interval секунд; проверку делает один поток,
+        остальные пока используют предыдущий результат
+        """
+        if self.checked_at is None or time.monotonic() - self.checked_at >= interval:
+            if self._checking.acquire(blocking=self.checked_at is None):
+                try:
+                    if self.checked_at is None or time.monotonic() - self.checked_at >= interval:
+                        self.check(max_lag)
+                finally:
+                    self._checking.release()
+        return self.healthy
+
+    def state(self):
+        return {"name": self.name, "healthy": self.healthy,
+                "lag_seconds": self.lag, "error": self.error}
+
+
+class ReplicaSet:
+    """
+    Реплики для чтения: выбор по кругу среди здоровых и окно read-your-writes
+    """
+
+    def __init__(self, app, replicas):
+        self.app = app
+        self.replicas = replicas
+        self._cycle = itertools.count()
+        self._lock = threading.Lock()
+        # api-key -> time.monotonic(), до которого чтения идут в основную базу
+        self._sticky = {}
+
+    def choose(self):
+        """
+        Движок следующей здоровой реплики или None - читать из основной базы
+        """
+        config = self.app.config
+        max_lag = config.get('REPLICA_MAX_LAG_SECONDS', 5)
+        interval = config.get('REPLICA_CHECK_INTERVAL', 5)
+        start = next(self._cycle)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.available(max_lag, interval):
+                return replica.engine
+        return None
+
+    def sticky(self, api_key):
+        """
+        Клиент недавно писал: его чтения должны видеть эту запись
+        """
+        until = request.cookies.get(STICKY_COOKIE)
+        try:
+            if until and float(until) > time.time():
+                return True
+        except ValueError:
+            pass
+        if api_key:
+            with self._lock:
+                deadline = self._sticky.get(api_key)
+            return deadline is not None and deadline > time.monotonic()
+        return False
+
+    def remember_write(self, response):
+        """
+        after_request: успешный изменяющий запрос открывает окно чтения из основной базы
+        """
+        window = self.app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+        if request.method in SAFE_METHODS or response.status_code >= 400 or window <= 0:
+            return response
+        api_key = request.headers.get('api-key')
+        if api_key:
+            now = time.monotonic()
+            with self._lock:
+                if len(self._sticky) >= STICKY_PRUNE_SIZE:
+                    self._sticky = {key: deadline for key, deadline in self._sticky.items() if deadline > now}
+                self._sticky[api_key] = now + window
+        response.set_cookie(STICKY_COOKIE, f'{time.time() + window:.3f}', max_age=math.ceil(window),
+                            httponly=True, samesite='Lax')
+        return response
+
+
+def configure_replicas(app):
+    """
+    Подключает реплики из DATABASE_REPLICA_URLS. Вызывается после db.init_app
+    """
+    urls = app.config.get('DATABASE_REPLICA_URLS') or ()
+    if not urls:
+        return False
+    replicas = [Replica(f'replica-{index}', pooled_engine(app, uri)) for index, uri in enumerate(urls)]
+    replica_set = ReplicaSet(app, replicas)
+    app.extensions[REPLICAS] = replica_set
+    app.after_request(replica_set.remember_write)
+    return True
+
+
+def replica_reads(view):
+    """
+    Эндпоинт только читает: запросы идут на реплику, если у клиента нет недавней записи
+    и есть здоровая реплика. Одна реплика на весь запрос - один снимок данных
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replica_set = current_app.extensions.get(REPLICAS)
+        if replica_set is not None and not replica_set.sticky(request.headers.get('api-key')):
+            engine = replica_set.choose()
+            if engine is not None:
+                setattr(g, REPLICA_ENGINE, engine)
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,130 @@
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from models.models import db, User, Tweet, Like, Follow, UploadSession, tweet_media, TWEET_DELETED
+from utils.media_gc import collect_user_media
+from utils.sharding import get_shards
+
+
+class PurgeResult:
+    def __init__(self):
+        self.users = 0
+        self.tweets = 0
+        self.likes = 0
+        self.follows = 0
+        self.media = 0
+
+
+def _tweet_engines():
+    """
+    Базы с твитами, лайками и подписками: все шарды или основная
+    """
+    shards = get_shards()
+    return list(shards.engines) if shards is not None else [db.engine]
+
+
+def _delete_in_chunks(engine, table, condition, batch_size, pause):
+    """
+    Удаляет строки порциями по batch_size, каждая порция - своя короткая транзакция.
+    Возвращает число удаленных строк
+    """
+    total = 0
+    while True:
+        with engine.begin() as connection:
+            ids = connection.execute(
+                sa.select(table.c.id).where(condition).order_by(table.c.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return total
+            connection.execute(sa.delete(table).where(table.c.id.in_(ids)))
+        total += len(ids)
+        if pause:
+            time.sleep(pause)
+
+
+def _purge_tweets(engine, condition, batch_size, pause, result):
+    """
+    Твиты по условию порциями: сначала лайки и связи с медиа порции, затем сами твиты.
+    Связи с медиа при шардировании лежат в основной базе
+    """
+    tweets = Tweet.__table__
+    likes = Like.__table__
+    while True:
+        with engine.connect() as connection:
+            ids = connection.execute(
+                sa.select(tweets.c.id).where(condition).order_by(tweets.c.id).limit(batch_size)
+            ).scalars().all()
+        if not ids:
+            return
+        # У популярного твита лайков может быть много больше, чем твитов в порции
+        result.likes += _delete_in_chunks(engine, likes, likes.c.tweet_id.in_(ids), batch_size, pause)
+        with db.engine.begin() as connection:
+            connection.execute(tweet_media.delete().where(tweet_media.c.tweet_id.in_(ids)))
+        with engine.begin() as connection:
+            connection.execute(sa.delete(tweets).where(tweets.c.id.in_(ids)))
+        result.tweets += len(ids)
+        if pause:
+            time.sleep(pause)
+
+
+def purge_user(user_id, batch_size=1000, pause=0.0, workers=8, result=None):
+    """
+    Удаляет данные пользователя порциями и в конце саму запись пользователя.
+    Память не растет с числом строк, блокировки держатся одну порцию.
+    Прерванное удаление безопасно продолжить повторным запуском
+    """
+    result = result or PurgeResult()
+    likes = Like.__table__
+    follows = Follow.__table__
+    for engine in _tweet_engines():
+        _purge_tweets(engine, Tweet.__table__.c.author_id == user_id, batch_size, pause, result)
+        result.likes += _delete_in_chunks(engine, likes, likes.c.user_id == user_id, batch_size, pause)
+        result.follows += _delete_in_chunks(
+            engine, follows, sa.or_(follows.c.follower_id == user_id, follows.c.following_id == user_id),
+            batch_size, pause)
+    result.media += collect_user_media(user_id, batch_size, workers).media
+
+    sessions = UploadSession.__table__
+    with db.engine.begin() as connection:
+        connection.execute(sa.delete(sessions).where(sessions.c.owner_id == user_id))
+        connection.execute(sa.delete(User.__table__).where(User.__table__.c.id == user_id))
+    result.users += 1
+    return result
+
+
+def purge_deleted_users(batch_size=1000, pause=0.0, workers=8, log=None):
+    """
+    Удаляет данные всех аккаунтов, помеченных удаленными (DELETE /api/users/me)
+    """
+    result = PurgeResult()
+    users = User.__table__
+    user_ids = db.session.execute(
+        sa.select(users.c.id).where(users.c.deleted_at.isnot(None)).order_by(users.c.deleted_at)
+    ).scalars().all()
+    db.session.rollback()
+    for user_id in user_ids:
+        try:
+            purge_user(user_id, batch_size, pause, workers, result)
+        except IntegrityError as e:
+            # Параллельная запись сослалась на пользователя - повторим при следующем запуске
+            if log is not None:
+                log(f'User {user_id} is not purged yet: {e.orig}')
+            continue
+        if log is not None:
+            log(f'Purged user {user_id}')
+    return result
+
+
+def reap_deleted_tweets(batch_size=1000, pause=0.0):
+    """
+    Удаляет строки твитов, удаленных в режиме TWEETS_SOFT_DELETE, вместе с лайками
+    и связями с медиа. Запускать в часы низкой нагрузки; pause разгружает базу между порциями
+    """
+    result = PurgeResult()
+    # Статус подставляется в текст запроса: с параметром планировщик не выберет частичный индекс
+    deleted = Tweet.__table__.c.status == sa.literal(TWEET_DELETED, literal_execute=True)
+    for engine in _tweet_engines():
+        _purge_tweets(engine, deleted, batch_size, pause, result)
+    return result
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import request, jsonify, current_app, make_response
+
+from models.models import db, IdempotencyKey
+from utils.auth import get_user_by_api_key
+from utils.upserts import insert_or_ignore
+
+
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+
+# Доля запросов, которые попутно удаляют просроченные ключи
+_PURGE_PROBABILITY = 0.01
+_PURGE_BATCH_SIZE = 500
+
+_TIMEOUT = object()
+
+# Заголовки, без которых повторенный ответ не равен первому; остальные
+# (Content-Length, Vary, служебные) формируются заново
+REPLAYED_HEADERS = ('Location', 'Content-Location', 'ETag', 'Last-Modified', 'Retry-After')
+
+
+def _scope(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def _fingerprint():
+    """
+    Отпечаток запроса: повторное использование ключа с другим телом - ошибка клиента.
+    Тело multipart не читаем, чтобы не буферизовать загружаемый файл в памяти
+    """
+    digest = hashlib.sha256(f'{request.method} {request.path}'.encode('utf-8'))
+    if request.is_json:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _load(scope, key):
+    table = IdempotencyKey.__table__
+    return db.session.execute(
+        sa.select(table).where(table.c.scope == scope, table.c.key == key)
+    ).first()
+
+
+def _delete(scope, key):
+    table = IdempotencyKey.__table__
+    db.session.execute(sa.delete(table).where(table.c.scope == scope, table.c.key == key))
+    db.session.commit()
+
+
+def _delete_stale(record):
+    """
+    Удаляет именно прочитанную запись: если параллельный запрос уже удалил ее
+    и занял ключ заново, его запись не трогаем (SQLite может выдать новой строке тот же id,
+    поэтому сверяется и время создания)
+    """
+    table = IdempotencyKey.__table__
+    db.session.execute(sa.delete(table).where(table.c.id == record.id, table.c.created_at == record.created_at))
+    db.session.commit()
+
+
+def _purge_expired():
+    table = IdempotencyKey.__table__
+    expired = sa.select(table.c.id).where(
+        table.c.expires_at < datetime.utcnow()
+    ).limit(_PURGE_BATCH_SIZE).scalar_subquery()
+    db.session.execute(sa.delete(table).where(table.c.id.in_(expired)))
+
+
+def _claim(scope, key, request_hash):
+    """
+    Пытается занять ключ. Возвращает None, если ключ занят нами,
+    иначе существующую запись
+    """
+    now = datetime.utcnow()
+    ttl = current_app.config.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60)
+    lock_timeout = current_app.config.get('IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', 60)
+
+    if random.random() < _PURGE_PROBABILITY:
+        _purge_expired()
+
+    row = {
+        'scope': scope,
+        'key': key,
+        'request_hash': request_hash,
+        'status': PROCESSING,
+        'created_at': now,
+        'expires_at': now + timedelta(seconds=ttl),
+    }
+    if insert_or_ignore(IdempotencyKey.__table__, row, ['scope', 'key']):
+        db.session.commit()
+        return None
+
+    record = _load(scope, key)
+    db.session.rollback()
+    abandoned = (record is not None and record.status == PROCESSING
+                 and record.created_at < now - timedelta(seconds=lock_timeout))
+    if record is None or record.expires_at < now or abandoned:
+        # Просроченный или брошенный упавшим воркером ключ занимаем заново
+        if record is not None:
+            _delete_stale(record)
+        return _claim(scope, key, request_hash)
+    return record
+
+
+def _wait_for_completion(scope, key):
+    """
+    Ждет, пока параллельный запрос с тем же ключом завершится.
+    Возвращает завершенную запись, None если ключ освобожден, или _TIMEOUT
+    """
+    deadline = time.monotonic() + current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 10)
+    interval = current_app.config.get('IDEMPOTENCY_POLL_INTERVAL', 0.05)
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        record = _load(scope, key)
+        # Закрываем транзакцию, чтобы следующее чтение видело свежие данные
+        db.session.rollback()
+        if record is None or record.status == COMPLETED:
+            return record
+    return _TIMEOUT
+
+
+def _replay(record):
+    response = current_app.response_class(
+        record.response_body, status=record.response_status, mimetype=record.response_mimetype
+    )
+    if record.response_headers:
+        response.headers.update(json.loads(record.response_headers))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _saved_headers(response):
+    headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+    return json.dumps(headers) if headers else None
+
+
+def idempotent(view):
+    """
+    Поддержка заголовка Idempotency-Key для POST обработчиков.
+
+    Первый ответ сохраняется на IDEMPOTENCY_TTL_SECONDS, повторы получают его
+    без повторного выполнения обработчика. Параллельный дубликат ждет завершения
+    первого запроса. Ответы 5xx не сохраняются, чтобы клиент мог повторить запрос.
+    Повтор возвращает тело, статус и заголовки из REPLAYED_HEADERS
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        api_key = request.headers.get('api-key')
+        if not key or not api_key:
+            return view(*args, **kwargs)
+
+        # Запрос с неизвестным API ключом ключ не занимает: обработчик сам ответит 401
+        if get_user_by_api_key(api_key) is None:
+            return view(*args, **kwargs)
+
+        if len(key) > 255:
+            return jsonify({"result": False, "error_type": "BadRequest",
+                            "error_message": "Idempotency-Key is too long"}), 400
+
+        scope = _scope(api_key)
+        request_hash = _fingerprint()
+        while True:
+            record = _claim(scope, key, request_hash)
+            if record is None:
+                break
+
+            if record.request_hash != request_hash:
+                return jsonify({"result": False, "error_type": "UnprocessableEntity",
+                                "error_message": "Idempotency-Key was used with a different request"}), 422
+            if record.status == PROCESSING:
+                record = _wait_for_completion(scope, key)
+                if record is _TIMEOUT:
+                    return jsonify({"result": False, "error_type": "Conflict",
+                                    "error_message": "A request with this Idempotency-Key is in progress"}), 409
+                if record is None:
+                    # Первый запрос завершился ошибкой и освободил ключ - выполняем сами
+                    continue
+            return _replay(record)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _delete(scope, key)
+            raise
+
+        if response.status_code >= 500:
+            _delete(scope, key)
+            return response
+
+        table = IdempotencyKey.__table__
+        db.session.execute(sa.update(table).where(
+            table.c.scope == scope, table.c.key == key
+        ).values(
+            status=COMPLETED,
+            response_status=response.status_code,
+            response_body=response.get_data(as_text=True),
+            response_mimetype=response.mimetype,
+            response_headers=_saved_headers(response),
+        ))
+        db.session.commit()
+        return response
+
+    return wrapper
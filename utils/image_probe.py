@@ -0,0 +1,153 @@
+import struct
+
+
+# Допустимые расширения имени файла для каждого распознанного формата
+FORMAT_EXTENSIONS = {
+    'PNG': ('png',),
+    'JPEG': ('jpg', 'jpeg'),
+    'GIF': ('gif',),
+}
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SIGNATURE = b'\xff\xd8\xff'
+_GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+
+# Маркеры JPEG SOFn, в которых лежат размеры кадра (кроме DHT, JPG и DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageProbeError(ValueError):
+    """
+    Файл не является поддерживаемым изображением или поврежден
+    """
+
+
+class ImageInfo:
+    def __init__(self, format, width, height, frame_count=1):
+        self.format = format
+        self.width = width
+        self.height = height
+        self.frame_count = frame_count
+
+    def matches_extension(self, extension):
+        return extension.lower() in FORMAT_EXTENSIONS[self.format]
+
+    @property
+    def pixels(self):
+        # Для анимации считаем все кадры: столько пикселей придется декодировать
+        return self.width * self.height * self.frame_count
+
+
+def _read_exact(handle, size):
+    data = handle.read(size)
+    if len(data) != size:
+        raise ImageProbeError('Unexpected end of file')
+    return data
+
+
+def _probe_png(handle):
+    handle.seek(len(_PNG_SIGNATURE))
+    length, chunk_type = struct.unpack('>I4s', _read_exact(handle, 8))
+    if chunk_type != b'IHDR' or length != 13:
+        raise ImageProbeError('PNG without IHDR')
+    width, height = struct.unpack('>II', _read_exact(handle, 8))
+    handle.seek(length - 8 + 4, 1)  # остаток IHDR и CRC
+
+    # APNG объявляет число кадров в acTL, который идет до первого IDAT
+    frame_count = 1
+    while True:
+        header = handle.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'acTL':
+            frame_count = max(1, struct.unpack('>I', _read_exact(handle, 4))[0])
+            break
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        handle.seek(length + 4, 1)
+    return ImageInfo('PNG', width, height, frame_count)
+
+
+def _probe_jpeg(handle):
+    handle.seek(2)
+    while True:
+        byte = _read_exact(handle, 1)
+        if byte != b'\xff':
+            raise ImageProbeError('Corrupted JPEG marker')
+        marker = _read_exact(handle, 1)[0]
+        while marker == 0xFF:  # допустимые байты-заполнители
+            marker = _read_exact(handle, 1)[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker in (0xD9, 0xDA):
+            raise ImageProbeError('JPEG without frame header')
+        length = struct.unpack('>H', _read_exact(handle, 2))[0]
+        if length < 2:
+            raise ImageProbeError('Corrupted JPEG segment')
+        if marker in _JPEG_SOF_MARKERS:
+            _precision, height, width = struct.unpack('>BHH', _read_exact(handle, 5))
+            return ImageInfo('JPEG', width, height)
+        handle.seek(length - 2, 1)
+
+
+def _skip_gif_sub_blocks(handle):
+    while True:
+        size = _read_exact(handle, 1)[0]
+        if size == 0:
+            return
+        handle.seek(size, 1)
+
+
+def _probe_gif(handle):
+    handle.seek(6)
+    width, height, flags = struct.unpack('<HHB', _read_exact(handle, 5))
+    handle.seek(2, 1)  # фон и соотношение сторон
+    if flags & 0x80:
+        handle.seek(3 * (2 << (flags & 0x07)), 1)
+
+    # Считаем кадры по дескрипторам изображений, пропуская данные без декодирования
+    frame_count = 0
+    while True:
+        introducer = handle.read(1)
+        if not introducer or introducer == b'\x3b':
+            break
+        if introducer == b'\x21':
+            handle.seek(1, 1)
+            _skip_gif_sub_blocks(handle)
+        elif introducer == b'\x2c':
+            frame_count += 1
+            local_flags = _read_exact(handle, 9)[8]
+            if local_flags & 0x80:
+                handle.seek(3 * (2 << (local_flags & 0x07)), 1)
+            handle.seek(1, 1)  # минимальный размер кода LZW
+            _skip_gif_sub_blocks(handle)
+        else:
+            raise ImageProbeError('Corrupted GIF block')
+    if frame_count == 0:
+        raise ImageProbeError('GIF without frames')
+    return ImageInfo('GIF', width, height, frame_count)
+
+
+def probe_image(path):
+    """
+    Определяет формат по сигнатуре и читает размеры и число кадров из заголовков,
+    не декодируя изображение
+    """
+    with open(path, 'rb') as handle:
+        head = handle.read(16)
+        try:
+            if head.startswith(_PNG_SIGNATURE):
+                info = _probe_png(handle)
+            elif head.startswith(_JPEG_SIGNATURE):
+                info = _probe_jpeg(handle)
+            elif head[:6] in _GIF_SIGNATURES:
+                info = _probe_gif(handle)
+            else:
+                raise ImageProbeError('Unsupported image format')
+        except struct.error:
+            raise ImageProbeError('Corrupted image header')
+
+    if info.width <= 0 or info.height <= 0:
+        raise ImageProbeError('Image has zero dimensions')
+    return info
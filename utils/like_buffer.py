@@ -0,0 +1,292 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from models.models import db, Tweet, Like, TWEET_DELETED
+from utils.upserts import bulk_add_likes, bulk_remove_likes, CREATED, DELETED, EXISTS, ABSENT, NOT_FOUND
+
+
+LIKE = 'like'
+UNLIKE = 'unlike'
+
+# Как часто, секунд, искать журналы упавших процессов
+RECOVERY_INTERVAL = 1.0
+
+
+class LikeWriteBehind:
+    """
+    Отложенная запись лайков (write-behind).
+
+    Лайк подтверждается после записи в локальный журнал (append-only, fsync),
+    а в таблицу likes попадает пачкой из фонового потока раз в несколько миллисекунд.
+    Каждый процесс пишет в свой журнал и держит на нем flock; журналы без блокировки
+    остались от упавших процессов и доигрываются в базу при следующем сбросе.
+    Несброшенные лайки видны только процессу, который их принял: при нескольких
+    воркерах соседний воркер увидит лайк после сброса (LIKES_FLUSH_INTERVAL_MS).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pending = {}      # (user_id, tweet_id) -> LIKE | UNLIKE
+        self._flushing = {}     # снимок, который сейчас пишется в базу
+        self._generation = 0    # растет, когда снимок записан в базу и убран из памяти
+        self._log = None
+        self._flushing_log = None   # журнал снимка: держим flock, пока не удалим .flushing
+        self._log_path = None
+        self._recovered_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIKES_WRITE_BEHIND', False)
+        app.config.setdefault('LIKES_WRITE_BEHIND_DIR', os.path.join(app.instance_path, 'like_log'))
+        app.config.setdefault('LIKES_FLUSH_INTERVAL_MS', 5)
+        app.config.setdefault('LIKES_FLUSH_BATCH_SIZE', 1000)
+
+        if not app.config['LIKES_WRITE_BEHIND']:
+            return
+
+        self.app = app
+        os.makedirs(app.config['LIKES_WRITE_BEHIND_DIR'], exist_ok=True)
+        app.extensions['like_write_behind'] = self
+
+    def _ensure_started(self):
+        """
+        Журнал и поток сброса создаются лениво в процессе, который принимает запросы:
+        gunicorn --preload создает приложение до fork, а потоки fork не переживают
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Состояние родителя после fork не наше: его журнал доиграет сам родитель или восстановление
+            self._pending, self._flushing = {}, {}
+            self._log = self._flushing_log = None
+            self._recovered_at = None
+            self._stop = threading.Event()
+
+            log_dir = self.app.config['LIKES_WRITE_BEHIND_DIR']
+            self._log_path = os.path.join(log_dir, f'likes-{os.getpid()}.log')
+            # Журналы с тем же pid остались от упавшего процесса: отдаем их на восстановление
+            for suffix in ('.flushing', ''):
+                if os.path.exists(self._log_path + suffix):
+                    os.replace(self._log_path + suffix,
+                               os.path.join(log_dir, f'likes-{os.getpid()}-{time.time_ns()}.log{suffix}'))
+            self._open_log()
+
+            interval = self.app.config['LIKES_FLUSH_INTERVAL_MS']
+            self._thread = None
+            if interval > 0:
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval / 1000.0,), name='like-write-behind', daemon=True
+                )
+                self._thread.start()
+            self._pid = os.getpid()
+
+    # Журнал
+
+    def _open_log(self):
+        # Журнал блокируется под временным именем, которое восстановление не ищет,
+        # и только потом появляется под своим: пустой журнал не успеют счесть брошенным
+        temp_path = os.path.join(os.path.dirname(self._log_path), f'.likes-{os.getpid()}.tmp')
+        self._log = open(temp_path, 'a', encoding='utf-8')
+        fcntl.flock(self._log.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.replace(temp_path, self._log_path)
+
+    def _append(self, op, user_id, tweet_id):
+        record = {'op': op, 'user_id': user_id, 'tweet_id': tweet_id, 'ts': time.time()}
+        self._log.write(json.dumps(record) + '\n')
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def _rotate_log(self):
+        """
+        Переименовывает текущий журнал в .flushing и открывает новый.
+        Вызывается под self._lock вместе со снятием снимка pending.
+        flock остается на файле после переименования: пока снимок пишется в базу,
+        восстановление в других процессах этот журнал не возьмет
+        """
+        os.replace(self._log_path, self._log_path + '.flushing')
+        self._flushing_log = self._log
+        self._open_log()
+
+    @staticmethod
+    def _read_log(path):
+        operations = {}
+        with open(path, encoding='utf-8') as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Недописанная последняя строка после сбоя
+                    continue
+                operations[(record['user_id'], record['tweet_id'])] = record['op']
+        return operations
+
+    def _orphan_logs(self):
+        """
+        Журналы других процессов, которые никто не держит
+        """
+        pattern = os.path.join(os.path.dirname(self._log_path), 'likes-*.log*')
+        own = {self._log_path, self._log_path + '.flushing'}
+        # .flushing старше основного журнала того же процесса, поэтому идет первым
+        paths = sorted(glob.glob(pattern),
+                       key=lambda path: (path.replace('.flushing', ''), not path.endswith('.flushing')))
+        for path in paths:
+            if path in own:
+                continue
+            try:
+                handle = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with handle:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                # Владелец мог сбросить и удалить журнал, пока мы его открывали
+                try:
+                    if not os.path.samestat(os.fstat(handle.fileno()), os.stat(path)):
+                        continue
+                except FileNotFoundError:
+                    continue
+                yield path
+
+    # Запись
+
+    def _write(self, user_id, tweet_id, op):
+        """
+        Пишет op в журнал, если лайк еще не в этом состоянии с учетом несброшенных записей.
+        Проверка и запись идут под одной блокировкой: из двух одновременных одинаковых
+        запросов проходит один. Возвращает NOT_FOUND, True (записано) или False (уже так)
+        """
+        self._ensure_started()
+        key = (user_id, tweet_id)
+        while True:
+            with self._lock:
+                generation = self._generation
+            row = db.session.query(Tweet.id, Like.id).outerjoin(
+                Like, (Like.tweet_id == Tweet.id) & (Like.user_id == user_id)
+            ).filter(Tweet.id == tweet_id, Tweet.status != TWEET_DELETED).first()
+            if row is None:
+                return NOT_FOUND
+            with self._lock:
+                if self._generation != generation:
+                    # Пока шел запрос, снимок записан в базу и убран из памяти: читаем заново
+                    # в новой транзакции, старая могла не видеть сброшенные строки
+                    db.session.rollback()
+                    continue
+                state = self._pending.get(key) or self._flushing.get(key) or (LIKE if row[1] is not None else UNLIKE)
+                if state == op:
+                    return False
+                self._append(op, user_id, tweet_id)
+                self._pending[key] = op
+                return True
+
+    def like(self, user_id, tweet_id):
+        written = self._write(user_id, tweet_id, LIKE)
+        if written == NOT_FOUND:
+            return NOT_FOUND
+        return CREATED if written else EXISTS
+
+    def unlike(self, user_id, tweet_id):
+        written = self._write(user_id, tweet_id, UNLIKE)
+        if written == NOT_FOUND:
+            return NOT_FOUND
+        return DELETED if written else ABSENT
+
+    def pending_for_user(self, user_id):
+        """
+        Несброшенные операции пользователя в этом процессе: {tweet_id: LIKE | UNLIKE}
+        """
+        self._ensure_started()
+        with self._lock:
+            merged = dict(self._flushing)
+            merged.update(self._pending)
+        return {tweet_id: op for (owner_id, tweet_id), op in merged.items() if owner_id == user_id}
+
+    # Сброс в базу
+
+    def _apply(self, operations):
+        batch_size = self.app.config['LIKES_FLUSH_BATCH_SIZE']
+        likes = [key for key, op in operations.items() if op == LIKE]
+        unlikes = [key for key, op in operations.items() if op == UNLIKE]
+        if likes:
+            bulk_add_likes(likes, chunk_size=batch_size)
+        if unlikes:
+            bulk_remove_likes(unlikes, chunk_size=batch_size)
+        db.session.commit()
+
+    def _recover(self):
+        for path in self._orphan_logs():
+            self._apply(self._read_log(path))
+            os.remove(path)
+        self._recovered_at = time.monotonic()
+
+    def flush(self):
+        """
+        Сбрасывает накопленные лайки в базу одной транзакцией.
+        Должен вызываться в контексте приложения
+        """
+        self._ensure_started()
+        with self._flush_lock:
+            try:
+                # Журналы воркеров, перезапущенных после падения, подбираются не только при старте
+                if self._recovered_at is None or time.monotonic() - self._recovered_at >= RECOVERY_INTERVAL:
+                    self._recover()
+
+                # Неудачный прошлый снимок повторяем до того, как брать новый
+                if not self._flushing:
+                    with self._lock:
+                        if not self._pending:
+                            return 0
+                        self._flushing, self._pending = self._pending, {}
+                        self._rotate_log()
+
+                count = len(self._flushing)
+                self._apply(self._flushing)
+            except Exception:
+                db.session.rollback()
+                raise
+
+            with self._lock:
+                self._flushing = {}
+                self._generation += 1
+            os.remove(self._log_path + '.flushing')
+            # Закрытие снимает flock уже после удаления файла
+            self._flushing_log.close()
+            self._flushing_log = None
+            return count
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    self.app.logger.exception('Like write-behind flush failed')
+
+    def close(self):
+        """
+        Останавливает фоновый поток и сбрасывает остаток
+        """
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self.app.app_context():
+            self.flush()
+
+
+like_write_behind = LikeWriteBehind()
@@ -0,0 +1,149 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from models.models import db, Media, MediaBlob, tweet_media
+from utils.media_layout import related_filenames
+from utils.media_storage import tombstone_blobs, drop_blobs
+from utils.storage import get_storage
+
+
+class GCResult:
+    def __init__(self):
+        self.media = 0
+        self.files = 0
+        self.bytes = 0
+
+
+def _unreferenced(media):
+    # Анти-join: у медиа нет ни одной строки в tweet_media
+    return ~sa.exists().where(tweet_media.c.media_id == media.c.id)
+
+
+def _find_orphans(cutoff, after_id, batch_size):
+    media = Media.__table__
+    rows = db.session.execute(
+        sa.select(media.c.id).where(
+            media.c.id > after_id,
+            media.c.created_at < cutoff,
+            _unreferenced(media),
+        ).order_by(media.c.id).limit(batch_size)
+    ).scalars().all()
+    db.session.rollback()
+    return rows
+
+
+def _delete_orphans(ids, cutoff):
+    """
+    Удаляет порцию медиа. Условие повторяется в DELETE: медиа, которое успели
+    прикрепить к твиту после выборки, не удаляется.
+    Возвращает (число удаленных медиа, освобожденные хэши, файлы медиа без хэша)
+    """
+    media = Media.__table__
+    blobs = MediaBlob.__table__
+    try:
+        deleted = db.session.execute(
+            sa.delete(media).where(
+                media.c.id.in_(ids),
+                media.c.created_at < cutoff,
+                _unreferenced(media),
+            ).returning(media.c.blob_hash, media.c.filename)
+        ).all()
+        released = Counter(row.blob_hash for row in deleted if row.blob_hash)
+        for blob_hash, count in released.items():
+            db.session.execute(
+                sa.update(blobs).where(blobs.c.hash == blob_hash)
+                .values(ref_count=blobs.c.ref_count - count)
+            )
+        legacy = {row.filename for row in deleted if not row.blob_hash}
+        if legacy:
+            # Файл без хэша удаляем, только если на него не ссылаются другие медиа
+            legacy -= set(db.session.execute(
+                sa.select(media.c.filename).where(media.c.filename.in_(legacy))
+            ).scalars())
+        db.session.commit()
+    except IntegrityError:
+        # Параллельный твит сослался на медиа внутри нашей транзакции - повторим в следующий раз
+        db.session.rollback()
+        return 0, set(), set()
+    return len(deleted), set(released), legacy
+
+
+def _remove_files(pool, storage, blobs, legacy, result):
+    """
+    Удаляет файлы порции параллельно в пуле потоков; база в потоках не используется
+    """
+    filenames = [name for row in blobs for name in related_filenames(row.filename, row.variants)]
+    filenames += legacy
+    for size in pool.map(storage.delete, filenames):
+        if size:
+            result.files += 1
+            result.bytes += size
+
+
+def _release(pool, storage, hashes, legacy, result):
+    blobs = tombstone_blobs(hashes) if hashes else []
+    _remove_files(pool, storage, blobs, legacy, result)
+    if blobs:
+        drop_blobs(row.hash for row in blobs)
+
+
+def collect_orphaned_media(grace_seconds=24 * 60 * 60, batch_size=500, workers=8):
+    """
+    Удаляет медиа, не прикрепленные ни к одному твиту дольше grace_seconds,
+    и файлы, на которые больше нет ссылок. Безопасно запускать на работающем сервисе:
+    новые загрузки защищены периодом ожидания, а прикрепление - повторной проверкой в DELETE
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    storage = get_storage()
+    result = GCResult()
+    blobs = MediaBlob.__table__
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        after_id = 0
+        while True:
+            ids = _find_orphans(cutoff, after_id, batch_size)
+            if not ids:
+                break
+            after_id = ids[-1]
+            count, released, legacy = _delete_orphans(ids, cutoff)
+            result.media += count
+            _release(pool, storage, released, list(legacy), result)
+
+        # Файлы, оставшиеся без ссылок после сбоя между коммитом и очисткой
+        leftover = db.session.execute(
+            sa.select(blobs.c.hash).where(blobs.c.ref_count == 0)
+        ).scalars().all()
+        db.session.rollback()
+        for start in range(0, len(leftover), batch_size):
+            _release(pool, storage, leftover[start:start + batch_size], [], result)
+    return result
+
+
+def collect_user_media(owner_id, batch_size=500, workers=8):
+    """
+    Удаляет медиа пользователя (удаление аккаунта) и файлы, на которые больше нет ссылок.
+    Медиа, прикрепленное к твиту, остается: твиты удаляются раньше
+    """
+    storage = get_storage()
+    result = GCResult()
+    media = Media.__table__
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        after_id = 0
+        while True:
+            ids = db.session.execute(
+                sa.select(media.c.id).where(media.c.owner_id == owner_id, media.c.id > after_id)
+                .order_by(media.c.id).limit(batch_size)
+            ).scalars().all()
+            db.session.rollback()
+            if not ids:
+                break
+            after_id = ids[-1]
+            count, released, legacy = _delete_orphans(ids, datetime.max)
+            result.media += count
+            _release(pool, storage, released, list(legacy), result)
+    return result
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import string
+
+import sqlalchemy as sa
+
+from models.models import db, Media, MediaBlob, parse_variant_sizes, variant_filename
+from utils.media_variants import MODERN_FORMATS, format_filename
+
+
+# Файлы раскладываются по двум уровням каталогов: ab/cd/<имя>
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+_HEX_DIGITS = set(string.hexdigits.lower())
+
+
+def is_sharded(filename):
+    return '/' in filename
+
+
+def sharded_filename(filename):
+    """
+    Путь файла в двухуровневой раскладке: ab/cd/<имя>.
+    Префикс берется из имени, если оно уже хэш (sha256 или uuid), иначе из sha256 имени
+    """
+    name = os.path.basename(filename)
+    stem = name.split('.', 1)[0].lower()
+    if len(stem) < SHARD_DEPTH * SHARD_WIDTH or not set(stem) <= _HEX_DIGITS:
+        stem = hashlib.sha256(name.encode('utf-8')).hexdigest()
+    shards = [stem[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+    return '/'.join(shards + [name])
+
+
+def alternate_filename(filename):
+    """
+    Путь того же файла в другой раскладке: пока идет миграция, читаются обе
+    """
+    if is_sharded(filename):
+        return os.path.basename(filename)
+    return sharded_filename(filename)
+
+
+def related_filenames(filename, variants=None):
+    """
+    Оригинал, его уменьшенные копии и их версии в современных форматах
+    """
+    originals = [filename] + [variant_filename(filename, size) for size in parse_variant_sizes(variants)]
+    return originals + [
+        format_filename(original, extension) for original in originals for extension in MODERN_FORMATS
+    ]
+
+
+def _link(folder, source, target):
+    """
+    Создает жесткую ссылку на новом месте; старый файл удаляется только после коммита
+    """
+    source_path = os.path.join(folder, source)
+    if not os.path.exists(source_path):
+        return False
+    target_path = os.path.join(folder, target)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    temp_path = f'{target_path}.migrating'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    os.link(source_path, temp_path)
+    os.replace(temp_path, target_path)
+    return True
+
+
+def _remove(folder, filenames):
+    for filename in filenames:
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _migrate_blob(folder, blob_hash, filename, variants):
+    """
+    Переносит файл с копиями в новую раскладку. Порядок: ссылка на новом месте,
+    коммит нового имени в базе, удаление старого файла - так файл всегда доступен
+    """
+    old_names = related_filenames(filename, variants)
+    new_filename = sharded_filename(filename)
+    new_names = related_filenames(new_filename, variants)
+    linked = [new for old, new in zip(old_names, new_names) if _link(folder, old, new)]
+
+    blobs = MediaBlob.__table__
+    media = Media.__table__
+    moved = db.session.execute(
+        sa.update(blobs).where(blobs.c.hash == blob_hash, blobs.c.filename == filename, blobs.c.ref_count >= 0)
+        .values(filename=new_filename)
+    ).rowcount
+    if not moved:
+        # Файл успели удалить или перенести параллельно - убираем свои ссылки
+        db.session.rollback()
+        _remove(folder, linked)
+        return 0
+    db.session.execute(
+        sa.update(media).where(media.c.blob_hash == blob_hash, media.c.filename == filename)
+        .values(filename=new_filename)
+    )
+    db.session.commit()
+    _remove(folder, old_names)
+    return 1
+
+
+def _migrate_legacy_media(folder, media_id, filename):
+    """
+    Медиа, загруженные до хранения по хэшу, переносятся по одной
+    """
+    new_filename = sharded_filename(filename)
+    linked = _link(folder, filename, new_filename)
+    table = Media.__table__
+    moved = db.session.execute(
+        sa.update(table).where(table.c.id == media_id, table.c.filename == filename)
+        .values(filename=new_filename)
+    ).rowcount
+    db.session.commit()
+    if moved:
+        # Один и тот же старый файл мог принадлежать нескольким медиа
+        still_used = db.session.execute(
+            sa.select(table.c.id).where(table.c.filename == filename).limit(1)
+        ).first()
+        db.session.rollback()
+        if still_used is None:
+            _remove(folder, [filename])
+    elif linked:
+        _remove(folder, [new_filename])
+    return moved
+
+
+def migrate_batch(folder, batch_size=500):
+    """
+    Переносит очередную порцию файлов из плоской папки в раскладку ab/cd/.
+    Возвращает число перенесенных записей; 0 - миграция завершена
+    """
+    blobs = MediaBlob.__table__
+    media = Media.__table__
+    moved = 0
+
+    rows = db.session.execute(
+        sa.select(blobs.c.hash, blobs.c.filename, blobs.c.variants)
+        .where(blobs.c.filename.notlike('%/%'), blobs.c.ref_count >= 0)
+        .limit(batch_size)
+    ).all()
+    db.session.rollback()
+    for row in rows:
+        moved += _migrate_blob(folder, row.hash, row.filename, row.variants)
+
+    # Медиа, созданные со старым именем файла, пока шла миграция его записи
+    moved += db.session.execute(
+        sa.update(media).where(
+            media.c.blob_hash.isnot(None),
+            media.c.filename.notlike('%/%'),
+            sa.exists().where(blobs.c.hash == media.c.blob_hash, blobs.c.filename.like('%/%')),
+        ).values(filename=sa.select(blobs.c.filename).where(blobs.c.hash == media.c.blob_hash)
+                .scalar_subquery())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    legacy = db.session.execute(
+        sa.select(media.c.id, media.c.filename)
+        .where(media.c.blob_hash.is_(None), media.c.filename.notlike('%/%'))
+        .limit(batch_size)
+    ).all()
+    db.session.rollback()
+    for row in legacy:
+        moved += _migrate_legacy_media(folder, row.id, row.filename)
+    return moved
@@ -0,0 +1,235 @@
+import fcntl
+import os
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from flask import current_app
+
+from models.models import (db, Media, Tweet, tweet_media, MEDIA_PROCESSING, MEDIA_READY, MEDIA_FAILED,
+                           TWEET_PENDING, TWEET_PUBLISHED, TWEET_FAILED)
+from models.session import SHARDS
+from utils.media_storage import (hash_file, validate_image, acquire_blob, finalize_upload, discard_stored,
+                                 MediaValidationError)
+from utils.media_variants import queue_variants
+
+
+# Временные файлы загрузок, ожидающих обработки: .processing-<uuid>.<расширение>
+PENDING_PREFIX = '.processing-'
+
+# Пул потоков создается лениво и отдельно в каждом процессе (после fork)
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def pending_path(filename):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+
+def _get_executor(workers):
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-processing')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def enqueue_media(path, extension, owner_id):
+    """
+    Создает Media в состоянии processing для файла path и ставит его обработку в очередь.
+    Файл переносится в папку загрузок и дальше принадлежит обработчику
+    """
+    filename = f'{PENDING_PREFIX}{uuid.uuid4().hex}.{extension}'
+    target = pending_path(filename)
+    os.replace(path, target)
+    try:
+        media = Media(filename=filename, owner_id=owner_id, status=MEDIA_PROCESSING)
+        db.session.add(media)
+        db.session.commit()
+    except Exception:
+        os.replace(target, path)
+        raise
+    submit_processing(media.id)
+    return media
+
+
+def submit_processing(media_id):
+    """
+    Запускает обработку в пуле потоков процесса. При MEDIA_PROCESSING_WORKERS = 0
+    медиа обрабатывает отдельный воркер: flask media process
+    """
+    app = current_app._get_current_object()
+    workers = app.config.get('MEDIA_PROCESSING_WORKERS', 2)
+    if workers <= 0:
+        return False
+
+    def _run():
+        with app.app_context():
+            try:
+                process_media(media_id)
+            except Exception:
+                # Медиа остается в processing и будет обработано воркером повторно
+                app.logger.exception('Media processing failed for media %s', media_id)
+            finally:
+                db.session.remove()
+
+    _get_executor(workers).submit(_run)
+    return True
+
+
+def _fail(media, message):
+    media.status = MEDIA_FAILED
+    media.error = message
+    db.session.commit()
+
+
+def process_media(media_id):
+    """
+    Проверяет и сохраняет загруженный файл, затем публикует ожидавшие его твиты.
+    Файл блокируется flock, поэтому пул и воркер не обработают одно медиа дважды
+    """
+    media = db.session.get(Media, media_id)
+    if media is None or media.status != MEDIA_PROCESSING:
+        return None
+    path = pending_path(media.filename)
+    extension = media.filename.rsplit('.', 1)[1]
+
+    try:
+        handle = open(path, 'rb')
+    except FileNotFoundError:
+        db.session.refresh(media)
+        if media.status == MEDIA_PROCESSING:
+            _fail(media, 'Uploaded file is missing')
+            publish_ready_tweets(media_id=media_id)
+        return media.status
+
+    with handle:
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        # Пока мы ждали файл, его мог обработать другой процесс
+        db.session.refresh(media)
+        if media.status != MEDIA_PROCESSING:
+            return media.status
+
+        upload = hash_file(path, extension)
+        try:
+            image = validate_image(path, extension)
+        except MediaValidationError as e:
+            _fail(media, str(e))
+            upload.discard()
+            publish_ready_tweets(media_id=media_id)
+            return media.status
+
+        try:
+            blob = acquire_blob(upload)
+            media.filename = blob.filename
+            media.blob_hash = upload.hash
+            media.width, media.height, media.frame_count = image.width, image.height, image.frame_count
+            media.status = MEDIA_READY
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            discard_stored(upload)
+            raise
+        if blob.ref_count == 1:
+            queue_variants(upload.hash, blob.filename, upload.temp_path)
+        finalize_upload(upload, blob.filename)
+
+    publish_ready_tweets(media_id=media_id)
+    return media.status
+
+
+def _publish_on_shards(shards, tweet_ids, media_id):
+    """
+    publish_ready_tweets для шардов: состояния вложений читаются из основной базы,
+    твиты обновляются на шардах. Медиа только переходят из processing в ready или failed,
+    а чтение идет после фиксации медиа, поэтому устаревшим может быть лишь "еще не готово" -
+    тогда твит опубликует вызов после обработки этого медиа
+    """
+    media = Media.__table__
+    links = sa.select(tweet_media.c.tweet_id, media.c.status).join(media, media.c.id == tweet_media.c.media_id)
+    if media_id is not None:
+        links = links.where(tweet_media.c.tweet_id.in_(
+            sa.select(tweet_media.c.tweet_id).where(tweet_media.c.media_id == media_id)))
+    else:
+        links = links.where(tweet_media.c.tweet_id.in_(list(tweet_ids)))
+    statuses = defaultdict(set)
+    for tweet_id, status in db.session.execute(links):
+        statuses[tweet_id].add(status)
+    db.session.rollback()
+
+    scope = statuses.keys() if media_id is not None else tweet_ids
+    failed = [tweet_id for tweet_id in scope if MEDIA_FAILED in statuses[tweet_id]]
+    ready = [tweet_id for tweet_id in scope if statuses[tweet_id] <= {MEDIA_READY}]
+    tweets = Tweet.__table__
+
+    def _update(connection, shard):
+        # Шард твита по id неизвестен: UPDATE по первичному ключу на каждом шарде
+        with connection.begin():
+            for ids, status in ((failed, TWEET_FAILED), (ready, TWEET_PUBLISHED)):
+                if ids:
+                    connection.execute(sa.update(tweets).where(
+                        tweets.c.id.in_(ids), tweets.c.status == TWEET_PENDING).values(status=status))
+
+    shards.scatter(_update)
+
+
+def publish_ready_tweets(tweet_ids=None, media_id=None):
+    """
+    Публикует ожидающие твиты, все вложения которых готовы; твиты с вложением,
+    которое не удалось обработать, помечаются failed. Проверка идет в самом UPDATE,
+    поэтому одновременный вызов из запроса и из обработчика не теряет твит
+    """
+    shards = current_app.extensions.get(SHARDS)
+    if shards is not None:
+        return _publish_on_shards(shards, tweet_ids, media_id)
+
+    tweets = Tweet.__table__
+    media = Media.__table__
+    if media_id is not None:
+        scope = tweets.c.id.in_(sa.select(tweet_media.c.tweet_id).where(tweet_media.c.media_id == media_id))
+    else:
+        scope = tweets.c.id.in_(list(tweet_ids))
+
+    def _attached(*conditions):
+        return sa.exists().where(
+            tweet_media.c.tweet_id == tweets.c.id,
+            media.c.id == tweet_media.c.media_id,
+            *conditions
+        )
+
+    db.session.execute(
+        sa.update(tweets).where(scope, tweets.c.status == TWEET_PENDING, _attached(media.c.status == MEDIA_FAILED))
+        .values(status=TWEET_FAILED)
+    )
+    db.session.execute(
+        sa.update(tweets).where(scope, tweets.c.status == TWEET_PENDING, ~_attached(media.c.status != MEDIA_READY))
+        .values(status=TWEET_PUBLISHED)
+    )
+    db.session.commit()
+
+
+def process_pending_media(limit=100):
+    """
+    Обрабатывает медиа, оставшиеся в processing (воркер или перезапуск процесса).
+    Возвращает число обработанных
+    """
+    media_ids = db.session.execute(
+        sa.select(Media.id).where(Media.status == MEDIA_PROCESSING).order_by(Media.id).limit(limit)
+    ).scalars().all()
+    db.session.rollback()
+    processed = 0
+    for media_id in media_ids:
+        try:
+            if process_media(media_id) is not None:
+                processed += 1
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Media processing failed for media %s', media_id)
+    return processed
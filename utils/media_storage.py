@@ -0,0 +1,282 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models.models import db, Media, MediaBlob
+from utils.image_probe import probe_image, ImageProbeError
+from utils.media_layout import sharded_filename, related_filenames
+from utils.media_variants import queue_variants
+from utils.storage import get_storage, content_type
+from utils.upserts import insert_or_increment
+
+
+# Размер блока при потоковом копировании и хэшировании загрузки
+CHUNK_SIZE = 64 * 1024
+
+# Сколько раз ждать, пока файл с тем же содержимым доудаляется
+_ACQUIRE_ATTEMPTS = 50
+_ACQUIRE_RETRY_DELAY = 0.01
+
+
+class MediaValidationError(ValueError):
+    """
+    Загруженный файл не прошел проверку: сообщение отдается клиенту
+    """
+
+
+class StoredUpload:
+    """
+    Загруженный файл во временном файле рядом с хранилищем.
+    source_key - объект, уже лежащий в хранилище (прямая загрузка): его копируем, а не загружаем
+    """
+
+    def __init__(self, temp_path, digest, size, extension, source_key=None):
+        self.temp_path = temp_path
+        self.source_key = source_key
+        self.hash = digest
+        self.size = size
+        # Новые файлы сразу кладутся в раскладку ab/cd/<хэш>.<расширение>
+        self.filename = sharded_filename(f'{digest}.{extension}')
+        # Файл положен в хранилище этой загрузкой (а не найден там)
+        self.stored = False
+
+    def discard(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def _upload_folder():
+    return current_app.config['UPLOAD_FOLDER']
+
+
+def _store(upload, filename):
+    """
+    Кладет файл в хранилище под именем по хэшу, если его там еще нет.
+    Возвращает True, если файл положен этим вызовом
+    """
+    storage = get_storage()
+    if storage.exists(filename):
+        return False
+    if upload.source_key:
+        storage.copy(upload.source_key, filename)
+    else:
+        storage.put_file(filename, upload.temp_path, content_type(filename))
+    return True
+
+
+def stream_to_temp(stream, extension, source_key=None):
+    """
+    Копирует поток загрузки во временный файл блоками, попутно считая sha256
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    def _hash(chunk):
+        nonlocal size
+        digest.update(chunk)
+        size += len(chunk)
+
+    temp_path = spool_to_temp(stream, _hash)
+    return StoredUpload(temp_path, digest.hexdigest(), size, extension, source_key)
+
+
+def spool_to_temp(stream, on_chunk=None):
+    """
+    Копирует поток загрузки во временный файл в папке загрузок, возвращает путь
+    """
+    handle, temp_path = tempfile.mkstemp(dir=_upload_folder(), prefix='.upload-')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if on_chunk is not None:
+                    on_chunk(chunk)
+                temp_file.write(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def hash_file(path, extension):
+    """
+    Считает sha256 уже записанного файла (например, собранного из частей)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return StoredUpload(path, digest.hexdigest(), size, extension)
+
+
+def acquire_blob(upload):
+    """
+    Увеличивает счетчик ссылок на файл (или создает запись) в текущей транзакции.
+    Возвращает строку (filename, ref_count); ref_count = 1 - файл новый
+    """
+    upload.stored = _store(upload, upload.filename)
+    table = MediaBlob.__table__
+    row = {'hash': upload.hash, 'filename': upload.filename, 'size': upload.size, 'ref_count': 1}
+
+    for _ in range(_ACQUIRE_ATTEMPTS):
+        if insert_or_increment(table, row, ['hash'], 'ref_count'):
+            return db.session.execute(
+                sa.select(table.c.filename, table.c.ref_count).where(table.c.hash == upload.hash)
+            ).one()
+        # Запись помечена к удалению (ref_count = -1): ждем, пока ее уберут
+        time.sleep(_ACQUIRE_RETRY_DELAY)
+    raise RuntimeError(f'Media blob {upload.hash} is being deleted')
+
+
+def discard_stored(upload):
+    """
+    Вызывается после отката транзакции с acquire_blob: файл, положенный этой загрузкой,
+    удаляется, если на него не ссылается ни одна записанная строка media_blobs
+    (иначе он остался бы в хранилище без строки, и flask media gc его не увидит).
+    Параллельная загрузка того же файла вернет его на место в finalize_upload
+    """
+    if not upload.stored:
+        return
+    table = MediaBlob.__table__
+    if db.session.execute(sa.select(table.c.hash).where(table.c.hash == upload.hash)).first() is None:
+        get_storage().delete(upload.filename)
+    upload.stored = False
+
+
+def finalize_upload(upload, filename):
+    """
+    Вызывается после коммита: файл мог быть удален параллельной очисткой
+    до того, как мы захватили ссылку, поэтому возвращаем его на место
+    """
+    _store(upload, filename)
+    upload.discard()
+
+
+def validate_image(path, extension):
+    """
+    Проверяет сигнатуру и размеры по заголовку, не декодируя изображение
+    """
+    try:
+        image = probe_image(path)
+    except ImageProbeError:
+        raise MediaValidationError('File is not a valid image')
+    if not image.matches_extension(extension):
+        raise MediaValidationError('File content does not match its extension')
+    if image.pixels > current_app.config.get('MAX_IMAGE_PIXELS', 50000000):
+        raise MediaValidationError('Image dimensions are too large')
+    return image
+
+
+def save_media(upload, extension, owner_id):
+    """
+    Проверяет изображение по заголовку и сохраняет его как Media владельца.
+    Временный файл остается на вызывающем (upload.discard)
+    """
+    image = validate_image(upload.temp_path, extension)
+    try:
+        blob = acquire_blob(upload)
+        media = Media(filename=blob.filename, owner_id=owner_id, blob_hash=upload.hash,
+                      width=image.width, height=image.height, frame_count=image.frame_count)
+        db.session.add(media)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        discard_stored(upload)
+        raise
+
+    # Уменьшенные копии для нового файла строятся в пуле процессов вне запроса,
+    # из временного файла загрузки, пока он не удален
+    if blob.ref_count == 1:
+        queue_variants(upload.hash, blob.filename, upload.temp_path)
+    finalize_upload(upload, blob.filename)
+    return media
+
+
+def tombstone_blobs(hashes):
+    """
+    Помечает записи без ссылок ref_count = -1, чтобы параллельная загрузка
+    того же содержимого не воскресила их, пока файлы удаляются.
+    Возвращает помеченные строки (hash, filename, variants)
+    """
+    table = MediaBlob.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(
+            sa.update(table).where(table.c.hash.in_(list(hashes)), table.c.ref_count == 0)
+            .values(ref_count=-1).returning(table.c.hash, table.c.filename, table.c.variants)
+        ).all()
+
+
+def drop_blobs(hashes):
+    """
+    Удаляет помеченные записи после удаления их файлов
+    """
+    table = MediaBlob.__table__
+    with db.engine.begin() as connection:
+        connection.execute(sa.delete(table).where(table.c.hash.in_(list(hashes)), table.c.ref_count == -1))
+
+
+def sweep_blob(blob_hash):
+    """
+    Удаляет файл, на который больше нет ссылок. Возвращает число освобожденных байт
+    """
+    rows = tombstone_blobs([blob_hash])
+    if not rows:
+        return 0
+
+    # Вместе с оригиналом удаляем его уменьшенные копии и версии в других форматах
+    storage = get_storage()
+    size = sum(storage.delete(filename) for filename in related_filenames(rows[0].filename, rows[0].variants))
+    drop_blobs([blob_hash])
+    return size
+
+
+@event.listens_for(Media, 'after_delete')
+def _release_blob(mapper, connection, target):
+    """
+    При удалении Media уменьшает счетчик ссылок; файл удаляется после коммита
+    """
+    if not target.blob_hash:
+        return
+    table = MediaBlob.__table__
+    connection.execute(
+        sa.update(table).where(table.c.hash == target.blob_hash)
+        .values(ref_count=table.c.ref_count - 1)
+    )
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('released_blobs', set()).add(target.blob_hash)
+
+
+@event.listens_for(Session, 'after_commit')
+def _commit_released_blobs(session):
+    released = session.info.pop('released_blobs', None)
+    if released:
+        session.info.setdefault('committed_blobs', set()).update(released)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _sweep_released_blobs(session, transaction):
+    # Очистка идет после того, как сессия вернула соединения в пул:
+    # при единственном соединении записи (SQLite) иначе ждали бы сами себя
+    if transaction.parent is not None:
+        return
+    for blob_hash in session.info.pop('committed_blobs', None) or ():
+        sweep_blob(blob_hash)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_released_blobs(session):
+    session.info.pop('released_blobs', None)
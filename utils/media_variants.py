@@ -0,0 +1,252 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import sqlalchemy as sa
+from flask import current_app
+from PIL import Image, features
+
+from models.models import db, MediaBlob, parse_variant_formats, variant_filename
+from utils.storage import get_storage, content_type
+
+
+DEFAULT_VARIANT_SIZES = (150, 600, 1200)
+
+# Современные форматы: расширение -> (формат Pillow, MIME тип).
+# Копия лежит рядом с файлом под именем <файл>.<расширение>, например abc_600.png.webp
+MODERN_FORMATS = {
+    'avif': ('AVIF', 'image/avif'),
+    'webp': ('WEBP', 'image/webp'),
+}
+DEFAULT_MODERN_FORMATS = ('avif', 'webp')
+
+# Пул процессов создается лениво и отдельно в каждом процессе (после fork)
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def format_filename(filename, extension):
+    """
+    Имя копии файла в другом формате: <файл>.<расширение>
+    """
+    return f'{filename}.{extension}'
+
+
+def _transcode(image, path, formats):
+    """
+    Сохраняет копии в современных форматах, если они меньше исходного файла.
+    Возвращает расширения готовых копий
+    """
+    original_size = os.path.getsize(path)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    ready = []
+    for extension in formats:
+        pillow_format = MODERN_FORMATS[extension][0]
+        target = format_filename(path, extension)
+        if os.path.exists(target):
+            ready.append(extension)
+            continue
+        if not features.check(extension):
+            continue
+        temp_path = f'{target}.tmp'
+        image.save(temp_path, format=pillow_format, quality=80)
+        if os.path.getsize(temp_path) < original_size:
+            os.replace(temp_path, target)
+            ready.append(extension)
+        else:
+            os.remove(temp_path)
+    return ready
+
+
+def render_variants(source_path, sizes, formats=()):
+    """
+    Создает уменьшенные копии изображения по длинной стороне и их версии
+    в форматах formats (для оригинала тоже).
+    Выполняется в процессе пула, поэтому не трогает базу и контекст приложения.
+    Возвращает (размеры готовых копий, готовые версии в форматах: "webp" для оригинала,
+    "150.webp" для копии)
+    """
+    ready = []
+    transcoded = []
+    try:
+        with Image.open(source_path) as image:
+            # Анимацию не режем до первого кадра - для нее отдаем оригинал
+            if getattr(image, 'n_frames', 1) > 1:
+                return ready, transcoded
+            image.load()
+            transcoded += _transcode(image, source_path, formats)
+            for size in sorted(sizes):
+                if max(image.size) <= size:
+                    break
+                target = variant_filename(source_path, size)
+                variant = image.copy()
+                variant.thumbnail((size, size))
+                if not os.path.exists(target):
+                    temp_path = f'{target}.tmp'
+                    variant.save(temp_path, format=image.format)
+                    os.replace(temp_path, target)
+                transcoded += [f'{size}.{extension}' for extension in _transcode(variant, target, formats)]
+                ready.append(size)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Не изображение или поврежденный файл: остаемся с оригиналом
+        pass
+    return ready, transcoded
+
+
+def _prepare_source(storage, blob_hash, filename, upload_path=None):
+    """
+    Путь к оригиналу на локальном диске. Для объектного хранилища оригинал кладется
+    во временную папку, где пул и создает копии: жесткой ссылкой на еще не удаленный
+    временный файл загрузки, а без него - скачиванием
+    """
+    local_path = storage.local_path(filename)
+    if local_path is not None:
+        return local_path, None
+    scratch = os.path.join(current_app.config['UPLOAD_FOLDER'], f'.variants-{blob_hash}')
+    os.makedirs(scratch, exist_ok=True)
+    source_path = os.path.join(scratch, os.path.basename(filename))
+    if upload_path is not None and os.path.exists(upload_path):
+        if os.path.exists(source_path):
+            os.remove(source_path)
+        try:
+            os.link(upload_path, source_path)
+        except OSError:
+            shutil.copyfile(upload_path, source_path)
+    else:
+        storage.download(filename, source_path)
+    return source_path, scratch
+
+
+def _publish(storage, filename, scratch, sizes, formats):
+    """
+    Загружает созданные во временной папке копии в хранилище
+    """
+    directory, name = os.path.split(filename)
+    originals = [name] + [variant_filename(name, size) for size in sizes]
+    rendered = originals[1:] + [
+        format_filename(original, extension) for original in originals for extension in formats
+    ]
+    for rendered_name in rendered:
+        path = os.path.join(scratch, rendered_name)
+        if os.path.exists(path):
+            key = f'{directory}/{rendered_name}' if directory else rendered_name
+            storage.put_file(key, path, content_type(key))
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _mark_ready(app, blob_hash, rendered, storage=None, filename=None, scratch=None, formats=()):
+    sizes, transcoded = rendered
+    if scratch is not None:
+        _publish(storage, filename, scratch, sizes, formats)
+    table = MediaBlob.__table__
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(
+                sa.update(table).where(table.c.hash == blob_hash)
+                .values(variants=','.join([str(size) for size in sizes] + transcoded))
+            )
+
+
+def _get_pool(workers, queue_size):
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+            _pool_slots = threading.BoundedSemaphore(queue_size)
+        return _pool, _pool_slots
+
+
+def queue_variants(blob_hash, filename, upload_path=None):
+    """
+    Ставит создание уменьшенных копий в очередь пула процессов.
+    upload_path - временный файл загрузки: копии строятся из него, а не из хранилища.
+    При MEDIA_VARIANT_WORKERS = 0 копии создаются сразу (для тестов и отладки).
+    Если очередь заполнена, задача отбрасывается - клиенты получают оригинал
+    """
+    app = current_app._get_current_object()
+    sizes = app.config.get('MEDIA_VARIANT_SIZES', DEFAULT_VARIANT_SIZES)
+    formats = app.config.get('MEDIA_MODERN_FORMATS', DEFAULT_MODERN_FORMATS)
+    workers = app.config.get('MEDIA_VARIANT_WORKERS', 2)
+    storage = get_storage()
+
+    if workers <= 0:
+        source_path, scratch = _prepare_source(storage, blob_hash, filename, upload_path)
+        rendered = render_variants(source_path, sizes, formats)
+        _mark_ready(app, blob_hash, rendered, storage, filename, scratch, formats)
+        return True
+
+    pool, slots = _get_pool(workers, app.config.get('MEDIA_VARIANT_QUEUE_SIZE', 256))
+    if not slots.acquire(blocking=False):
+        app.logger.warning('Media variant queue is full, skipping %s', filename)
+        return False
+
+    def _done(future):
+        slots.release()
+        try:
+            _mark_ready(app, blob_hash, future.result(), storage, filename, scratch, formats)
+        except Exception:
+            app.logger.exception('Media variant generation failed for %s', filename)
+
+    try:
+        source_path, scratch = _prepare_source(storage, blob_hash, filename, upload_path)
+        future = pool.submit(render_variants, source_path, sizes, formats)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(_done)
+    return True
+
+
+def _explicitly_accepts(accept_mimetypes, mimetype):
+    # */* не считаем: старые клиенты шлют его, не умея декодировать WebP/AVIF
+    return any(value == mimetype and quality > 0 for value, quality in accept_mimetypes)
+
+
+def _negotiate_recorded(filename, accept_mimetypes):
+    """
+    Выбор по версиям, записанным в media_blobs.variants: один запрос к базе по ключу
+    вместо запросов размеров к объектному хранилищу. Из допустимых форматов берется
+    первый по порядку MODERN_FORMATS (AVIF обычно меньше WebP); каждая записанная версия
+    меньше оригинала
+    """
+    stem = os.path.basename(filename).split('.', 1)[0]
+    blob_hash, _, size = stem.partition('_')
+    if len(blob_hash) != 64 or (size and not size.isdigit()):
+        return filename
+    variants = db.session.execute(
+        sa.select(MediaBlob.variants).where(MediaBlob.hash == blob_hash)
+    ).scalar()
+    available = parse_variant_formats(variants).get(int(size) if size else None, set())
+    for extension, (_, mimetype) in MODERN_FORMATS.items():
+        if extension in available and _explicitly_accepts(accept_mimetypes, mimetype):
+            return format_filename(filename, extension)
+    return filename
+
+
+def negotiate_representation(storage, filename, accept_mimetypes):
+    """
+    Выбирает наименьшее по размеру представление файла из тех, что допускает Accept.
+    На локальном диске размеры сравниваются напрямую, для объектного хранилища
+    берутся версии, записанные при создании копий. Возвращает имя файла для отдачи
+    """
+    if not storage.local:
+        return _negotiate_recorded(filename, accept_mimetypes)
+
+    best_size = storage.size(filename)
+    if best_size is None:
+        return filename
+
+    best = filename
+    for extension, (_, mimetype) in MODERN_FORMATS.items():
+        if not _explicitly_accepts(accept_mimetypes, mimetype):
+            continue
+        candidate = format_filename(filename, extension)
+        size = storage.size(candidate)
+        if size is not None and size < best_size:
+            best, best_size = candidate, size
+    return best
@@ -0,0 +1,303 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import current_app
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - архив нужен только при TWEETS_ARCHIVE_DIR
+    pa = None
+    pq = None
+
+
+# Помесячные секции таблицы tweets (декларативное секционирование PostgreSQL по created_at)
+PARTITION_PREFIX = 'tweets_p'
+DEFAULT_PARTITION = 'tweets_default'
+MANIFEST = 'manifest.json'
+EXPORT_BATCH_SIZE = 10000
+_PARTITION_NAME = re.compile(rf'^{PARTITION_PREFIX}(\d{{4}})_(\d{{2}})$')
+_COLUMNS = ('id', 'content', 'author_id', 'status', 'created_at')
+
+# Путь манифеста -> (st_mtime_ns, записи)
+_manifest_cache: dict[str, tuple[int, list]] = {}
+_manifest_lock = threading.Lock()
+
+
+def month_floor(moment):
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _months(first, last):
+    month = first
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month:%Y_%m}'
+
+
+def partition_month(name):
+    """
+    Месяц секции по ее имени или None для чужих таблиц (в том числе секции по умолчанию)
+    """
+    match = _PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def create_partition_sql(month):
+    return (f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF tweets '
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+
+
+def layout_sql(first_month, last_month):
+    """
+    Перевод tweets в секционированную таблицу одной транзакцией: таблица копируется целиком,
+    поэтому запускать в окно обслуживания. Ключ секционирования обязан входить в первичный
+    ключ, а внешний ключ может ссылаться только на уникальный столбец - ссылки likes и
+    tweet_media на tweets удаляются, целостность держит приложение
+    """
+    statements = [
+        'ALTER TABLE tweets RENAME TO tweets_unpartitioned',
+        'ALTER INDEX ix_tweets_author_id_created_at RENAME TO ix_tweets_unpartitioned_author_id_created_at',
+        'ALTER INDEX ix_tweets_author_id_id RENAME TO ix_tweets_unpartitioned_author_id_id',
+        'ALTER INDEX IF EXISTS ix_tweets_deleted RENAME TO ix_tweets_unpartitioned_deleted',
+        # Последовательность id переживет удаление старой таблицы
+        'ALTER SEQUENCE tweets_id_seq OWNED BY NONE',
+        """CREATE TABLE tweets (
+    id BIGINT NOT NULL DEFAULT nextval('tweets_id_seq'),
+    content TEXT NOT NULL,
+    author_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(16) NOT NULL DEFAULT 'published',
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)""",
+        'ALTER SEQUENCE tweets_id_seq OWNED BY tweets.id',
+        'CREATE INDEX ix_tweets_author_id_created_at ON tweets (author_id, created_at DESC, id)',
+        'CREATE INDEX ix_tweets_author_id_id ON tweets (author_id, id DESC)',
+        "CREATE INDEX ix_tweets_deleted ON tweets (id) WHERE status = 'deleted'",
+        # Строки вне созданных месяцев не теряются, но секцию для их месяца уже не создать
+        # без переноса - поэтому create-ahead запускается заранее
+        f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF tweets DEFAULT',
+    ]
+    statements += [create_partition_sql(month) for month in _months(first_month, last_month)]
+    statements += [
+        'INSERT INTO tweets (id, content, author_id, status, created_at) '
+        'SELECT id, content, author_id, status, COALESCE(created_at, CURRENT_TIMESTAMP) FROM tweets_unpartitioned',
+        # CASCADE удаляет только внешние ключи likes и tweet_media, сами таблицы остаются
+        'DROP TABLE tweets_unpartitioned CASCADE',
+    ]
+    return statements
+
+
+def _require_postgresql(connection):
+    if connection.dialect.name != 'postgresql':
+        raise RuntimeError('Tweet partitioning requires PostgreSQL')
+
+
+def is_partitioned(connection):
+    _require_postgresql(connection)
+    return connection.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('tweets'))"
+    )).scalar()
+
+
+def list_partitions(connection):
+    """
+    Помесячные секции tweets по возрастанию месяца: [(месяц, имя), ...]
+    """
+    names = connection.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('tweets')"
+    )).scalars()
+    return sorted((partition_month(name), name) for name in names if partition_month(name) is not None)
+
+
+def partition_tweets(connection, months_ahead=3, now=None):
+    """
+    Секционирует tweets: секции от месяца самого старого твита до months_ahead месяцев вперед
+    """
+    if is_partitioned(connection):
+        raise RuntimeError('Table tweets is already partitioned')
+    current = month_floor(now or datetime.utcnow())
+    oldest = connection.execute(sa.text('SELECT MIN(created_at) FROM tweets')).scalar()
+    first = min(month_floor(oldest), current) if oldest is not None else current
+    last = add_months(current, months_ahead)
+    for statement in layout_sql(first, last):
+        connection.execute(sa.text(statement))
+    return [partition_name(month) for month in _months(first, last)]
+
+
+def create_future_partitions(connection, months_ahead=3, now=None):
+    """
+    Создает недостающие секции с текущего месяца до months_ahead месяцев вперед.
+    Запускается по расписанию (cron), повторный запуск ничего не меняет
+    """
+    if not is_partitioned(connection):
+        raise RuntimeError('Table tweets is not partitioned, run "flask partitions init" first')
+    existing = {month for month, _ in list_partitions(connection)}
+    current = month_floor(now or datetime.utcnow())
+    created = []
+    for month in _months(current, add_months(current, months_ahead)):
+        if month not in existing:
+            connection.execute(sa.text(create_partition_sql(month)))
+            created.append(partition_name(month))
+    return created
+
+
+# Архив: секции выгружаются в Parquet (zstd) и отсоединяются
+
+def archive_supported():
+    return pq is not None
+
+
+def _require_pyarrow():
+    if not archive_supported():
+        raise RuntimeError('Tweet archive requires pyarrow (pip install pyarrow)')
+
+
+def _schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('content', pa.string()),
+        ('author_id', pa.int32()),
+        ('status', pa.string()),
+        ('created_at', pa.timestamp('us')),
+    ])
+
+
+def read_manifest(archive_dir):
+    """
+    Выгруженные секции: [{database, partition, month, path, rows, min_id, max_id}, ...].
+    Кэшируется до изменения файла
+    """
+    path = os.path.join(archive_dir, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    with _manifest_lock:
+        cached = _manifest_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)['partitions']
+    with _manifest_lock:
+        _manifest_cache[path] = (mtime, entries)
+    return entries
+
+
+def _write_manifest(archive_dir, entries):
+    path = os.path.join(archive_dir, MANIFEST)
+    temp = f'{path}.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump({"partitions": entries}, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def export_partition(connection, name, archive_dir, database='primary'):
+    """
+    Выгружает секцию в <archive_dir>/<database>/<name>.parquet и добавляет ее в манифест.
+    Файл пишется порциями через временный файл: читатели не увидят недописанный архив
+    """
+    _require_pyarrow()
+    month = partition_month(name)
+    if month is None:
+        raise ValueError(f'Not a monthly tweets partition: {name}')
+    relative = os.path.join(database, f'{name}.parquet')
+    path = os.path.join(archive_dir, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.tmp'
+
+    schema = _schema()
+    rows = 0
+    min_id = max_id = None
+    result = connection.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(
+        sa.text(f"SELECT {', '.join(_COLUMNS)} FROM {name} ORDER BY id"))
+    with pq.ParquetWriter(temp, schema, compression='zstd') as writer:
+        for batch in result.partitions(EXPORT_BATCH_SIZE):
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            rows += len(batch)
+            min_id = batch[0][0] if min_id is None else min_id
+            max_id = batch[-1][0]
+    os.replace(temp, path)
+
+    entry = {"database": database, "partition": name, "month": f'{month:%Y-%m}', "path": relative,
+             "rows": rows, "min_id": min_id, "max_id": max_id}
+    entries = [item for item in read_manifest(archive_dir)
+               if (item['database'], item['partition']) != (database, name)]
+    entries.append(entry)
+    entries.sort(key=lambda item: (item['database'], item['partition']))
+    _write_manifest(archive_dir, entries)
+    return entry
+
+
+def archive_partitions(connection, archive_dir, older_than_months=12, database='primary',
+                       drop=True, now=None, log=None):
+    """
+    Выгружает и отсоединяет секции старше older_than_months месяцев.
+    Секция отсоединяется только после записи архива и манифеста: прерванный запуск
+    можно повторить. Каждая секция - своя транзакция
+    """
+    _require_pyarrow()
+    if not is_partitioned(connection):
+        raise RuntimeError('Table tweets is not partitioned, run "flask partitions init" first')
+    cutoff = add_months(month_floor(now or datetime.utcnow()), -older_than_months)
+    expired = [name for month, name in list_partitions(connection) if month < cutoff]
+    # Чтение каталога открыло транзакцию автоматически - закрываем ее до транзакций секций
+    connection.commit()
+    archived = []
+    for name in expired:
+        with connection.begin():
+            entry = export_partition(connection, name, archive_dir, database)
+            connection.execute(sa.text(f'ALTER TABLE tweets DETACH PARTITION {name}'))
+            if drop:
+                connection.execute(sa.text(f'DROP TABLE {name}'))
+        if log is not None:
+            log(f"{database}: archived {name} ({entry['rows']} tweets)")
+        archived.append(entry)
+    return archived
+
+
+def find_archived_tweet(archive_dir, tweet_id):
+    """
+    Твит из архива по id или None. Файлы выбираются по диапазону id из манифеста,
+    внутри файла pyarrow пропускает группы строк по статистике столбца id
+    """
+    for entry in read_manifest(archive_dir):
+        if entry['rows'] and entry['min_id'] <= tweet_id <= entry['max_id']:
+            _require_pyarrow()
+            table = pq.read_table(os.path.join(archive_dir, entry['path']),
+                                  filters=[('id', '=', tweet_id)])
+            rows = table.to_pylist()
+            if rows:
+                return rows[0]
+    return None
+
+
+def timeline_since():
+    """
+    Нижняя граница created_at для ленты: при секционировании запрос читает только
+    последние секции. None - без ограничения
+    """
+    config = current_app.config
+    if not config.get('TWEETS_PARTITIONED', False):
+        return None
+    return datetime.utcnow() - timedelta(days=config.get('TIMELINE_MAX_AGE_DAYS', 62))
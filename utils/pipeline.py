@@ -0,0 +1,50 @@
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.dialects import postgresql
+
+from models.models import db
+
+
+def id_in(column, ids):
+    """
+    column IN (ids). В PostgreSQL - column = ANY(:массив): текст запроса не зависит от числа id,
+    и psycopg 3 переиспользует подготовленный на сервере запрос вместо разбора и планирования заново
+    """
+    ids = list(ids)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return column == sa.any_(sa.bindparam(None, ids, type_=postgresql.ARRAY(column.type)))
+    return column.in_(ids)
+
+
+def _pipelined(connection):
+    return connection.dialect.driver == 'psycopg' and current_app.config.get('DB_PIPELINE', True)
+
+
+def _driver_connection(connection):
+    return connection.connection.driver_connection
+
+
+def fetch_all(statements):
+    """
+    Выполняет независимые SELECT в транзакции сессии и возвращает их строки списками.
+    На psycopg 3 запросы уходят в режиме pipeline - за один сетевой обмен с сервером,
+    на остальных драйверах выполняются по очереди. Все запросы должны идти в одну базу
+    """
+    connection = db.session.connection(bind_arguments={'clause': statements[0]})
+    if not _pipelined(connection):
+        return [connection.execute(statement).all() for statement in statements]
+
+    driver = _driver_connection(connection)
+    cursors = []
+    with driver.pipeline():
+        for statement in statements:
+            compiled = statement.compile(dialect=connection.dialect,
+                                         compile_kwargs={'render_postcompile': True})
+            params = compiled.construct_params()
+            if compiled.positional:
+                params = [params[name] for name in compiled.positiontup]
+            cursor = driver.cursor()
+            cursor.execute(compiled.string, params)
+            cursors.append(cursor)
+    # Выход из блока pipeline дожидается всех ответов
+    return [cursor.fetchall() for cursor in cursors]
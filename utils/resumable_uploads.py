@@ -0,0 +1,202 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import current_app
+
+from models.models import db, UploadSession
+from utils.media_storage import CHUNK_SIZE
+
+
+# Сколько просроченных сессий удалять за один вызов
+_PURGE_BATCH_SIZE = 100
+
+
+class ChunkError(ValueError):
+    """
+    Часть файла не принята; status - HTTP код ответа
+    """
+
+    def __init__(self, message, error_type='ValidationError', status=400):
+        super().__init__(message)
+        self.error_type = error_type
+        self.status = status
+
+
+def _ttl():
+    return timedelta(seconds=current_app.config.get('RESUMABLE_UPLOAD_TTL_SECONDS', 24 * 60 * 60))
+
+
+def part_path(upload_id):
+    """
+    Файл собирается прямо в папке загрузок, чтобы потом попасть в хранилище жесткой ссылкой
+    """
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], f'.resumable-{upload_id}')
+
+
+def parse_checksum(header):
+    """
+    Разбирает заголовок Upload-Checksum: "sha256 <base64>". Возвращает digest или None
+    """
+    algorithm, _, value = (header or '').partition(' ')
+    if algorithm.lower() != 'sha256':
+        return None
+    try:
+        digest = base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest if len(digest) == hashlib.sha256().digest_size else None
+
+
+def create_session(owner_id, extension, total_size):
+    _purge_expired()
+    upload_session = UploadSession(
+        id=uuid.uuid4().hex,
+        owner_id=owner_id,
+        extension=extension,
+        total_size=total_size,
+        upload_offset=0,
+        expires_at=datetime.utcnow() + _ttl(),
+    )
+    path = part_path(upload_session.id)
+    open(path, 'wb').close()
+    try:
+        db.session.add(upload_session)
+        db.session.commit()
+    except Exception:
+        # Без строки сессии файл не найдет и очистка просроченных сессий
+        db.session.rollback()
+        os.remove(path)
+        raise
+    return upload_session
+
+
+def get_session(upload_id, owner_id):
+    """
+    Сессия владельца, если она еще не просрочена
+    """
+    upload_session = db.session.get(UploadSession, upload_id)
+    if (upload_session is None or upload_session.owner_id != owner_id
+            or upload_session.expires_at < datetime.utcnow()):
+        return None
+    return upload_session
+
+
+def append_chunk(upload_session, offset, stream, length, expected_digest):
+    """
+    Дописывает часть файла с позиции offset прямо в собираемый файл.
+    Часть принимается целиком, только если совпала контрольная сумма,
+    иначе файл обрезается обратно до последней подтвержденной позиции.
+    Возвращает новую позицию
+    """
+    table = UploadSession.__table__
+    path = part_path(upload_session.id)
+    try:
+        target = open(path, 'r+b')
+    except FileNotFoundError:
+        raise ChunkError('Upload session not found', 'NotFound', 404)
+    with target:
+        # Две части одной сессии не пишем одновременно; очистка просроченных сессий
+        # берет ту же блокировку
+        try:
+            fcntl.flock(target, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ChunkError('Another chunk is being uploaded', 'Conflict', 409)
+        if not _is_current_file(target, path):
+            # Файл удалила очистка, пока мы ждали блокировку
+            raise ChunkError('Upload session not found', 'NotFound', 404)
+
+        # Под блокировкой перечитываем позицию: ее мог сдвинуть параллельный запрос
+        current = db.session.execute(
+            sa.select(table.c.upload_offset).where(table.c.id == upload_session.id)
+        ).scalar()
+        db.session.rollback()
+        if current is None:
+            raise ChunkError('Upload session not found', 'NotFound', 404)
+        if offset != current:
+            raise ChunkError(f'Upload-Offset must be {current}', 'Conflict', 409)
+        if offset + length > upload_session.total_size:
+            raise ChunkError('Chunk exceeds the declared upload size')
+
+        target.truncate(current)
+        target.seek(current)
+        digest = hashlib.sha256()
+        received = 0
+        try:
+            while received < length:
+                chunk = stream.read(min(CHUNK_SIZE, length - received))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                target.write(chunk)
+                received += len(chunk)
+            if received != length:
+                raise ChunkError('Chunk is shorter than Content-Length')
+            if digest.digest() != expected_digest:
+                raise ChunkError('Chunk checksum mismatch')
+            target.flush()
+            os.fsync(target.fileno())
+        except Exception:
+            target.truncate(current)
+            raise
+
+        db.session.execute(sa.update(table).where(table.c.id == upload_session.id).values(
+            upload_offset=current + length,
+            expires_at=datetime.utcnow() + _ttl(),
+        ))
+        db.session.commit()
+    return current + length
+
+
+def discard_session(upload_session):
+    """
+    Удаляет сессию в текущей транзакции и собираемый файл
+    """
+    db.session.delete(upload_session)
+    path = part_path(upload_session.id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _is_current_file(handle, path):
+    try:
+        return os.path.samestat(os.fstat(handle.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def _purge_expired():
+    """
+    Удаляет просроченные сессии и их файлы в текущей транзакции. Файл, в который
+    сейчас пишется часть (занята блокировка append_chunk), пропускается до следующего раза
+    """
+    table = UploadSession.__table__
+    expired = db.session.execute(
+        sa.select(table.c.id).where(table.c.expires_at < datetime.utcnow()).limit(_PURGE_BATCH_SIZE)
+    ).scalars().all()
+    for upload_id in expired:
+        path = part_path(upload_id)
+        try:
+            handle = open(path, 'r+b')
+        except FileNotFoundError:
+            handle = None
+        try:
+            if handle is not None:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+            # Пока мы брали блокировку, принятая часть могла продлить сессию
+            deleted = db.session.execute(sa.delete(table).where(
+                table.c.id == upload_id, table.c.expires_at < datetime.utcnow()
+            )).rowcount
+            if deleted and handle is not None:
+                os.remove(path)
+        finally:
+            if handle is not None:
+                handle.close()
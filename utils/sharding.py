@@ -0,0 +1,530 @@
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models.models import db, User, Tweet, Like, Follow, ShardBucket, TWEET_PUBLISHED
+from models.session import SHARDS, SHARDED_TABLES
+from utils.db_pool import pooled_engine
+from utils.snowflake import BUCKET_BITS, id_bucket
+from utils.upserts import insert_or_ignore, CREATED, DELETED, EXISTS, ABSENT, NOT_FOUND
+
+
+# Пользователи делятся на корзины (user_id % SHARD_BUCKETS), корзины - по шардам.
+# Корзин заметно больше, чем шардов: при добавлении шарда переезжает только часть корзин.
+# Корзина автора зашита в младшие биты id твита (utils/snowflake.py)
+SHARD_BUCKETS = 1 << BUCKET_BITS
+
+_INSERT_IGNORE = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+class ShardMovingError(Exception):
+    """
+    Корзина пользователя переезжает на другой шард: запись нужно повторить позже
+    """
+
+
+def bucket_of(user_id):
+    return user_id % SHARD_BUCKETS
+
+
+def default_map(shard_count):
+    return [bucket % shard_count for bucket in range(SHARD_BUCKETS)]
+
+
+class ShardSet:
+    """
+    Движки шардов и карта корзин. Карта читается из основной базы (shard_buckets)
+    и кэшируется в процессе на SHARD_MAP_TTL секунд
+    """
+
+    def __init__(self, app, engines):
+        self.app = app
+        self.engines = engines
+        self._lock = threading.Lock()
+        self._map = None
+        self._loaded_at = None
+        self._executor = None
+        self._executor_pid = None
+
+    def _load(self):
+        shards = default_map(len(self.engines))
+        moving = set()
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                sa.select(ShardBucket.bucket, ShardBucket.shard, ShardBucket.moving)
+            ).all()
+        for bucket, shard, is_moving in rows:
+            shards[bucket] = shard
+            if is_moving:
+                moving.add(bucket)
+        return shards, frozenset(moving)
+
+    def bucket_map(self):
+        """
+        (шард каждой корзины, переезжающие корзины)
+        """
+        ttl = self.app.config.get('SHARD_MAP_TTL', 5)
+        with self._lock:
+            if self._map is None or time.monotonic() - self._loaded_at >= ttl:
+                self._map = self._load()
+                self._loaded_at = time.monotonic()
+            return self._map
+
+    def invalidate(self):
+        with self._lock:
+            self._map = None
+
+    def _shard_for_bucket(self, bucket, write):
+        shards, moving = self.bucket_map()
+        if write and bucket in moving:
+            raise ShardMovingError('User data is being moved to another shard, retry later')
+        return shards[bucket]
+
+    def shard_for_user(self, user_id, write=False):
+        return self._shard_for_bucket(bucket_of(user_id), write)
+
+    def shard_for_tweet(self, tweet_id, write=False):
+        """
+        Шард твита по корзине автора в его id - без запросов к шардам
+        """
+        return self._shard_for_bucket(id_bucket(tweet_id), write)
+
+    def group_users(self, user_ids):
+        """
+        {шард: [user_id, ...]}
+        """
+        shards, _ = self.bucket_map()
+        groups = defaultdict(list)
+        for user_id in user_ids:
+            groups[shards[bucket_of(user_id)]].append(user_id)
+        return dict(groups)
+
+    def _get_executor(self):
+        # Пул потоков создается заново в каждом процессе (после fork)
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get('SHARD_SCATTER_WORKERS') or len(self.engines) * 4,
+                    thread_name_prefix='shard-scatter')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, shard):
+        with self.engines[shard].connect() as connection:
+            return fn(connection, shard)
+
+    def scatter(self, fn, shards=None):
+        """
+        Выполняет fn(connection, shard) на шардах параллельно. Возвращает {шард: результат}
+        """
+        shards = list(range(len(self.engines)) if shards is None else shards)
+        if len(shards) == 1:
+            return {shards[0]: self._run(fn, shards[0])}
+        executor = self._get_executor()
+        futures = {shard: executor.submit(self._run, fn, shard) for shard in shards}
+        return {shard: future.result() for shard, future in futures.items()}
+
+
+def get_shards():
+    return current_app.extensions.get(SHARDS)
+
+
+def configure_shards(app):
+    """
+    Подключает шарды из DATABASE_SHARD_URLS. Вызывается после db.init_app
+    """
+    urls = app.config.get('DATABASE_SHARD_URLS') or ()
+    if not urls:
+        return False
+    if app.config.get('TWEET_ID_STRATEGY', 'serial') != 'snowflake':
+        # Последовательности шардов выдали бы одинаковые id
+        raise ValueError('Sharding requires TWEET_ID_STRATEGY=snowflake')
+    if app.config.get('LIKES_WRITE_BEHIND'):
+        raise ValueError('Sharding does not support LIKES_WRITE_BEHIND')
+    engines = [pooled_engine(app, uri) for uri in urls]
+    dialect = sa.engine.make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    if any(engine.dialect.name != dialect for engine in engines):
+        raise ValueError('Shards must use the same database backend as the primary database')
+    app.extensions[SHARDS] = ShardSet(app, engines)
+    return True
+
+
+def use_shard(shard):
+    """
+    Запросы сессии к шардированным таблицам идут на этот шард
+    """
+    db.session.info['shard'] = shard
+
+
+def use_user_shard(user_id, write=False):
+    """
+    Выбирает шард пользователя; без шардирования ничего не делает и возвращает None
+    """
+    shards = get_shards()
+    if shards is None:
+        return None
+    shard = shards.shard_for_user(user_id, write=write)
+    use_shard(shard)
+    return shard
+
+
+def use_tweet_shard(tweet_id, write=False):
+    """
+    Выбирает шард твита (там же его лайки); без шардирования ничего не делает и возвращает None
+    """
+    shards = get_shards()
+    if shards is None:
+        return None
+    shard = shards.shard_for_tweet(tweet_id, write=write)
+    use_shard(shard)
+    return shard
+
+
+# Подписки
+
+def _follow_shards(shards, follower_id, following_id):
+    # Подписка хранится на шардах обоих пользователей: подписки и подписчики читаются с одного шарда.
+    # Общей транзакции у шардов нет - разошедшиеся копии чинит flask shards repair-follows
+    return list(dict.fromkeys((shards.shard_for_user(follower_id, write=True),
+                               shards.shard_for_user(following_id, write=True))))
+
+
+def _user_exists(user_id):
+    return db.session.query(sa.exists().where(User.id == user_id)).scalar()
+
+
+def add_follow_on_shards(shards, follower_id, following_id):
+    """
+    add_follow для шардов. Возвращает CREATED, EXISTS или NOT_FOUND
+    """
+    if not _user_exists(following_id):
+        return NOT_FOUND
+    row = {"follower_id": follower_id, "following_id": following_id, "created_at": datetime.utcnow()}
+    created = []
+    for shard in _follow_shards(shards, follower_id, following_id):
+        use_shard(shard)
+        created.append(insert_or_ignore(Follow.__table__, row, ['follower_id', 'following_id']))
+    # Первый шард - шард подписчика, по нему и отвечаем
+    return CREATED if created[0] else EXISTS
+
+
+def remove_follow_on_shards(shards, follower_id, following_id):
+    """
+    remove_follow для шардов. Возвращает DELETED, ABSENT или NOT_FOUND
+    """
+    table = Follow.__table__
+    deleted = []
+    for shard in _follow_shards(shards, follower_id, following_id):
+        use_shard(shard)
+        deleted.append(db.session.execute(sa.delete(table).where(
+            table.c.follower_id == follower_id, table.c.following_id == following_id
+        )).rowcount)
+    if deleted[0]:
+        return DELETED
+    return ABSENT if _user_exists(following_id) else NOT_FOUND
+
+
+def _follow_rows(engine, chunk_size):
+    """
+    Подписки шарда порциями по id
+    """
+    table = Follow.__table__
+    last_id = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                sa.select(table.c.id, table.c.follower_id, table.c.following_id, table.c.created_at)
+                .where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)
+            ).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def repair_follows(shards, chunk_size=1000, log=None):
+    """
+    Сверяет копии подписок между шардами. Подписка пишется на два шарда без общей транзакции:
+    если фиксация на втором не удалась, копии расходятся. Верной считается строка на шарде
+    подписчика (по ней отвечает API): недостающие копии на шарде автора добавляются, лишние
+    удаляются. Возвращает (добавлено, удалено)
+    """
+    log = log or (lambda message: None)
+    shards.invalidate()
+    mapping, moving = shards.bucket_map()
+    if moving:
+        raise RuntimeError('Buckets are being moved, run repair after the rebalance finishes')
+    table = Follow.__table__
+    expected = defaultdict(dict)
+    present = defaultdict(dict)
+    for shard, engine in enumerate(shards.engines):
+        for row in _follow_rows(engine, chunk_size):
+            follower_shard = mapping[bucket_of(row.follower_id)]
+            following_shard = mapping[bucket_of(row.following_id)]
+            if follower_shard == following_shard:
+                continue
+            pair = (row.follower_id, row.following_id)
+            if shard == follower_shard:
+                expected[following_shard][pair] = row.created_at
+            elif shard == following_shard:
+                present[shard][pair] = row.id
+
+    added = removed = 0
+    insert = _INSERT_IGNORE[shards.engines[0].dialect.name]
+    for shard, engine in enumerate(shards.engines):
+        missing = [{"follower_id": follower_id, "following_id": following_id, "created_at": created_at}
+                   for (follower_id, following_id), created_at in expected[shard].items()
+                   if (follower_id, following_id) not in present[shard]]
+        stale = [row_id for pair, row_id in present[shard].items() if pair not in expected[shard]]
+        with engine.begin() as connection:
+            for start in range(0, len(missing), chunk_size):
+                connection.execute(insert(table).on_conflict_do_nothing(), missing[start:start + chunk_size])
+            for start in range(0, len(stale), chunk_size):
+                connection.execute(sa.delete(table).where(table.c.id.in_(stale[start:start + chunk_size])))
+        if missing or stale:
+            log(f'Shard {shard}: added {len(missing)} and removed {len(stale)} follow copies')
+        added += len(missing)
+        removed += len(stale)
+    return added, removed
+
+
+# Лента
+
+def gather_timeline(shards, author_ids, since=None):
+    """
+    Опубликованные твиты авторов со всех их шардов, новые сначала, и лайки к ним.
+    Шарды опрашиваются параллельно; id твитов по времени, поэтому слияние идет по id.
+    since - нижняя граница created_at. Возвращает (твиты, {tweet_id: [user_id, ...]})
+    """
+    tweets = Tweet.__table__
+    likes = Like.__table__
+    groups = shards.group_users(author_ids)
+
+    def _fetch(connection, shard):
+        authored = sa.and_(tweets.c.author_id.in_(groups[shard]), tweets.c.status == TWEET_PUBLISHED)
+        if since is not None:
+            authored = sa.and_(authored, tweets.c.created_at >= since)
+        rows = connection.execute(
+            sa.select(tweets.c.id, tweets.c.content, tweets.c.author_id)
+            .where(authored).order_by(tweets.c.id.desc())
+        ).all()
+        liked = connection.execute(
+            sa.select(likes.c.tweet_id, likes.c.user_id)
+            .join(tweets, tweets.c.id == likes.c.tweet_id)
+            .where(authored).order_by(likes.c.id)
+        ).all()
+        return rows, liked
+
+    results = shards.scatter(_fetch, groups)
+    timeline = list(heapq.merge(*(rows for rows, _ in results.values()),
+                                key=lambda row: row.id, reverse=True))
+    likers = defaultdict(list)
+    for _, liked in results.values():
+        for tweet_id, user_id in liked:
+            likers[tweet_id].append(user_id)
+    return timeline, likers
+
+
+# Схема и перешардирование
+
+def shard_metadata():
+    """
+    Таблицы шарда: копии шардированных таблиц без внешних ключей на таблицы основной базы
+    """
+    metadata = sa.MetaData()
+    for name in sorted(SHARDED_TABLES):
+        table = db.metadata.tables[name].to_metadata(metadata)
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split('.')[0] not in SHARDED_TABLES:
+                table.constraints.discard(constraint)
+                for element in constraint.elements:
+                    element.parent.foreign_keys.discard(element)
+                    table.foreign_keys.discard(element)
+    return metadata
+
+
+def create_shard_tables(shards):
+    metadata = shard_metadata()
+    for engine in shards.engines:
+        metadata.create_all(engine)
+
+
+def init_shards(shards):
+    """
+    Создает таблицы на шардах, снимает внешний ключ tweet_media.tweet_id в основной базе
+    и сохраняет карту корзин, если ее еще нет.
+    Без сохраненной карты корзины делятся по модулю числа шардов, и добавление
+    шарда в DATABASE_SHARD_URLS перемешало бы данные
+    """
+    create_shard_tables(shards)
+    if db.engine.dialect.name == 'postgresql':
+        # Таблица создана до шардирования: ссылка на пустую tweets основной базы отклоняла бы привязку медиа
+        db.session.execute(sa.text('ALTER TABLE tweet_media DROP CONSTRAINT IF EXISTS tweet_media_tweet_id_fkey'))
+    ShardBucket.__table__.create(db.engine, checkfirst=True)
+    if not db.session.query(ShardBucket.bucket).first():
+        db.session.execute(sa.insert(ShardBucket), [
+            {"bucket": bucket, "shard": shard, "moving": False}
+            for bucket, shard in enumerate(default_map(len(shards.engines)))
+        ])
+    db.session.commit()
+    shards.invalidate()
+
+
+def plan_rebalance(mapping, shard_count):
+    """
+    Минимальный набор переездов [(корзина, откуда, куда)], после которого у каждого
+    из shard_count шардов поровну корзин. Корзины шардов с номером >= shard_count
+    переезжают целиком (вывод шарда)
+    """
+    target = [SHARD_BUCKETS // shard_count + (1 if shard < SHARD_BUCKETS % shard_count else 0)
+              for shard in range(shard_count)]
+    owned = defaultdict(list)
+    for bucket, shard in enumerate(mapping):
+        owned[shard].append(bucket)
+
+    surplus = []
+    for shard, buckets in sorted(owned.items()):
+        keep = target[shard] if shard < shard_count else 0
+        surplus.extend(buckets[keep:])
+    moves = []
+    for shard in range(shard_count):
+        for _ in range(target[shard] - min(len(owned[shard]), target[shard])):
+            bucket = surplus.pop()
+            moves.append((bucket, mapping[bucket], shard))
+    return moves
+
+
+def _in_buckets(column, buckets):
+    return (column % SHARD_BUCKETS).in_(buckets)
+
+
+def _copy_rows(source, target, table, where, chunk_size, keep_id):
+    """
+    Копирует строки порциями по id. Повторный запуск безопасен: конфликты пропускаются.
+    Id лайков и подписок у каждого шарда свои - на новом шарде выдаются заново
+    """
+    columns = [column.name for column in table.c if keep_id or column.name != 'id']
+    insert = _INSERT_IGNORE[target.dialect.name]
+    copied = 0
+    last_id = None
+    while True:
+        query = sa.select(table).where(where).order_by(table.c.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        with source.connect() as connection:
+            rows = connection.execute(query).mappings().all()
+        if not rows:
+            return copied
+        last_id = rows[-1]['id']
+        with target.begin() as connection:
+            connection.execute(insert(table).on_conflict_do_nothing(),
+                               [{name: row[name] for name in columns} for row in rows])
+        copied += len(rows)
+
+
+def _bucket_rows(buckets):
+    tweets, likes, follows = Tweet.__table__, Like.__table__, Follow.__table__
+    moved_tweets = _in_buckets(tweets.c.author_id, buckets)
+    return {
+        tweets: moved_tweets,
+        likes: likes.c.tweet_id.in_(sa.select(tweets.c.id).where(moved_tweets)),
+        follows: sa.or_(_in_buckets(follows.c.follower_id, buckets), _in_buckets(follows.c.following_id, buckets)),
+    }
+
+
+def _purge(engine, shard, buckets, mapping, chunk_size):
+    """
+    Удаляет с шарда строки корзин, которые ему не принадлежат. Подписка остается,
+    если на шарде живет второй ее участник
+    """
+    tweets, likes, follows = Tweet.__table__, Like.__table__, Follow.__table__
+    rows = _bucket_rows(buckets)
+    with engine.begin() as connection:
+        stale = [row.id for row in connection.execute(
+            sa.select(follows.c.id, follows.c.follower_id, follows.c.following_id).where(rows[follows])
+        ) if shard not in (mapping[bucket_of(row.follower_id)], mapping[bucket_of(row.following_id)])]
+        for start in range(0, len(stale), chunk_size):
+            connection.execute(sa.delete(follows).where(follows.c.id.in_(stale[start:start + chunk_size])))
+        connection.execute(sa.delete(likes).where(rows[likes]))
+        connection.execute(sa.delete(tweets).where(rows[tweets]))
+
+
+def _set_buckets(buckets, **values):
+    db.session.execute(sa.update(ShardBucket).where(ShardBucket.bucket.in_(buckets)).values(**values))
+    db.session.commit()
+
+
+def move_buckets(shards, buckets, source, target, chunk_size=1000, log=None):
+    """
+    Переносит корзины с шарда source на target:
+    1. корзины помечаются moving - запись в них отвечает 503; ждем, пока все процессы увидят карту;
+    2. с target удаляются остатки прерванного переезда, строки копируются на target,
+       пока source продолжает отвечать на чтения;
+    3. карта переключается на target; ждем обновления карты в процессах;
+    4. строки корзин удаляются с source.
+    Пока корзина помечена moving, карта указывает на source, поэтому прерванный переезд
+    можно просто запустить заново
+    """
+    wait = shards.app.config.get('SHARD_MAP_TTL', 5)
+    log = log or (lambda message: None)
+    source_engine, target_engine = shards.engines[source], shards.engines[target]
+
+    _set_buckets(buckets, moving=True)
+    time.sleep(wait)
+
+    shards.invalidate()
+    mapping, _ = shards.bucket_map()
+    _purge(target_engine, target, buckets, mapping, chunk_size)
+    for table, where in _bucket_rows(buckets).items():
+        copied = _copy_rows(source_engine, target_engine, table, where, chunk_size, keep_id=table.name == 'tweets')
+        log(f'{table.name}: copied {copied} rows from shard {source} to shard {target}')
+
+    _set_buckets(buckets, shard=target, moving=False)
+    shards.invalidate()
+    time.sleep(wait)
+
+    mapping, _ = shards.bucket_map()
+    _purge(source_engine, source, buckets, mapping, chunk_size)
+    log(f'Shard {source}: removed moved rows of {len(buckets)} buckets')
+
+
+def rebalance(shards, shard_count=None, chunk_size=1000, dry_run=False, log=None):
+    """
+    Выравнивает корзины по shard_count шардам (по умолчанию - все из DATABASE_SHARD_URLS).
+    Возвращает план переездов
+    """
+    shard_count = shard_count or len(shards.engines)
+    log = log or (lambda message: None)
+    if not 0 < shard_count <= len(shards.engines):
+        raise ValueError(f'shard_count must be in [1, {len(shards.engines)}]')
+    if not db.session.query(ShardBucket.bucket).first():
+        raise RuntimeError('The shard map is not saved yet, run "flask shards init" first')
+    shards.invalidate()
+    mapping, moving = shards.bucket_map()
+    moves = plan_rebalance(mapping, shard_count)
+    if dry_run:
+        return moves
+
+    # Новые шарды получают таблицы до первого переезда
+    create_shard_tables(shards)
+    if moving:
+        # Прерванный переезд: карта еще указывает на старый шард, данные там целы
+        _set_buckets(sorted(moving), moving=False)
+        log(f'Reset {len(moving)} buckets left moving by an interrupted run')
+    pairs = defaultdict(list)
+    for bucket, source, target in moves:
+        pairs[(source, target)].append(bucket)
+    for (source, target), buckets in sorted(pairs.items()):
+        move_buckets(shards, buckets, source, target, chunk_size, log)
+    return moves
@@ -0,0 +1,158 @@
+import fcntl
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+
+
+# Раскладка id (как у Twitter Snowflake): 41 бит миллисекунд от EPOCH_MS,
+# 10 бит номера процесса (5 бит узла + 5 бит слота на узле) и 12 бит счетчика в пределах миллисекунды
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 5
+SLOT_BITS = 5
+SEQUENCE_BITS = 12
+WORKER_BITS = NODE_BITS + SLOT_BITS
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SLOT = (1 << SLOT_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# При шардировании младшие BUCKET_BITS бит счетчика - корзина автора (author_id % 1024):
+# шард твита вычисляется по id. На счетчик остается 2 бита - 4 id в миллисекунду на корзину
+BUCKET_BITS = 10
+
+# На сколько миллисекунд часы могут отступить назад, прежде чем генератор откажется выдавать id
+MAX_CLOCK_DRIFT_MS = 10
+
+
+class SnowflakeGenerator:
+    """
+    Потокобезопасный генератор k-сортируемых 64-битных id.
+    Id возрастают вместе со временем, поэтому по ним можно сортировать вместо created_at
+    """
+
+    def __init__(self, worker_id, clock=None, bucket_bits=0):
+        if not 0 <= worker_id < (1 << WORKER_BITS):
+            raise ValueError(f'worker_id must be in [0, {1 << WORKER_BITS})')
+        if not 0 <= bucket_bits < SEQUENCE_BITS:
+            raise ValueError(f'bucket_bits must be in [0, {SEQUENCE_BITS})')
+        self.worker_id = worker_id
+        self.bucket_bits = bucket_bits
+        self._max_sequence = MAX_SEQUENCE >> bucket_bits
+        self._clock = clock or (lambda: time.time_ns() // 1_000_000)
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        # Счетчики текущей миллисекунды по корзинам
+        self._sequences = {}
+
+    def _wait_until(self, target_ms):
+        now = self._clock()
+        while now < target_ms:
+            time.sleep((target_ms - now) / 1000.0)
+            now = self._clock()
+        return now
+
+    def next_id(self, bucket=0):
+        if not 0 <= bucket < (1 << self.bucket_bits):
+            raise ValueError(f'bucket must be in [0, {1 << self.bucket_bits})')
+        with self._lock:
+            now = self._clock()
+            if now < self._last_ms:
+                # Часы перевели назад (NTP): небольшой откат пережидаем, большой - ошибка
+                if self._last_ms - now > MAX_CLOCK_DRIFT_MS:
+                    raise RuntimeError(f'Clock moved backwards by {self._last_ms - now} ms')
+                now = self._wait_until(self._last_ms)
+            if now != self._last_ms:
+                self._sequences = {}
+            sequence = self._sequences.get(bucket, -1) + 1
+            if sequence > self._max_sequence:
+                # Счетчик миллисекунды исчерпан - ждем следующую
+                now = self._wait_until(self._last_ms + 1)
+                self._sequences = {}
+                sequence = 0
+            self._sequences[bucket] = sequence
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) \
+                | (sequence << self.bucket_bits) | bucket
+
+    def next_ids(self, count, bucket=0):
+        return [self.next_id(bucket) for _ in range(count)]
+
+
+def id_timestamp(snowflake_id):
+    """
+    Время создания, зашитое в id
+    """
+    ms = (snowflake_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _claim_slot(lock_dir):
+    """
+    Занимает свободный слот процесса на узле через flock: два процесса одного узла
+    не получат один номер. Файл остается открытым, пока жив процесс
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(MAX_SLOT + 1):
+        handle = open(os.path.join(lock_dir, f'snowflake-{slot}.lock'), 'a')
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            continue
+        return slot, handle
+    raise RuntimeError(f'All {MAX_SLOT + 1} snowflake worker slots on this node are taken')
+
+
+# Генератор создается лениво и отдельно в каждом процессе (после fork)
+_generator = None
+_generator_pid = None
+_slot_handle = None
+_generator_lock = threading.Lock()
+
+
+def _bucket_bits():
+    # Корзина в id нужна только шардам (utils/sharding.py)
+    return BUCKET_BITS if current_app.config.get('DATABASE_SHARD_URLS') else 0
+
+
+def get_id_generator():
+    global _generator, _generator_pid, _slot_handle
+    with _generator_lock:
+        if _generator is not None and _generator_pid == os.getpid() and _generator.bucket_bits != _bucket_bits():
+            # Другая раскладка id (приложение с шардами в том же процессе): слот процесса тот же
+            _generator = SnowflakeGenerator(_generator.worker_id, bucket_bits=_bucket_bits())
+        if _generator is None or _generator_pid != os.getpid():
+            if _slot_handle is not None:
+                # Унаследованный от родителя файл: блокировку держит родитель
+                _slot_handle.close()
+            node = current_app.config.get('SNOWFLAKE_NODE_ID', 0)
+            if not 0 <= node <= MAX_NODE:
+                raise ValueError(f'SNOWFLAKE_NODE_ID must be in [0, {MAX_NODE}]')
+            lock_dir = current_app.config.get('SNOWFLAKE_LOCK_DIR') or os.path.join(
+                current_app.instance_path, 'snowflake')
+            slot, _slot_handle = _claim_slot(lock_dir)
+            _generator = SnowflakeGenerator((node << SLOT_BITS) | slot, bucket_bits=_bucket_bits())
+            _generator_pid = os.getpid()
+        return _generator
+
+
+def snowflake_enabled():
+    return current_app.config.get('TWEET_ID_STRATEGY', 'serial') == 'snowflake'
+
+
+def id_bucket(snowflake_id):
+    """
+    Корзина автора, зашитая в id твита при шардировании
+    """
+    return snowflake_id & ((1 << BUCKET_BITS) - 1)
+
+
+def new_tweet_ids(count, author_id):
+    """
+    Id для новых твитов автора, назначенные приложением, или None - id выдаст база (SERIAL)
+    """
+    if not snowflake_enabled():
+        return None
+    generator = get_id_generator()
+    return generator.next_ids(count, author_id & ((1 << generator.bucket_bits) - 1))
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from models.session import READ_ENGINE
+from utils.db_pool import InstrumentedQueuePool
+
+
+# Производственный профиль SQLite: WAL, настроенные PRAGMA на каждом соединении,
+# одно соединение для записи на процесс и пул соединений только для чтения
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KB = 64 * 1024
+DEFAULT_READ_POOL_SIZE = 8
+DEFAULT_WRITE_TIMEOUT = 30
+
+
+class _WriterConnection(sqlite3.Connection):
+    """
+    Соединение записи: транзакцию на нем открывает _begin_immediate, а не pysqlite
+    """
+
+
+@event.listens_for(sa.engine.Engine, 'begin')
+def _begin_immediate(connection):
+    # pysqlite в устаревшем режиме отправляет BEGIN только перед первым INSERT/UPDATE/DELETE,
+    # и запись после чтения упиралась бы в SQLITE_BUSY при повышении блокировки.
+    # Драйвер писателя работает без своих транзакций (isolation_level=None), а BEGIN IMMEDIATE
+    # отправляется в начале транзакции SQLAlchemy: блокировка записи берется до первого чтения
+    if isinstance(connection.connection.driver_connection, _WriterConnection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def _database_path(app, uri):
+    """
+    Путь к файлу базы; относительный путь считается от instance_path, как в Flask-SQLAlchemy
+    """
+    url = sa.engine.make_url(uri)
+    if url.get_backend_name() != 'sqlite':
+        raise ValueError('SQLITE_PROFILE=production requires an sqlite:/// database URL')
+    if url.database in (None, '', ':memory:') or url.query.get('uri'):
+        raise ValueError('SQLITE_PROFILE=production requires a database file path')
+    if os.path.isabs(url.database):
+        return url.database
+    os.makedirs(app.instance_path, exist_ok=True)
+    return os.path.join(app.instance_path, url.database)
+
+
+def _connector(path, config, writer):
+    busy_timeout = config.get('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS)
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={config.get('SQLITE_MMAP_SIZE', DEFAULT_MMAP_SIZE)}",
+        # Отрицательное значение - размер кэша в КиБ, а не в страницах
+        f"PRAGMA cache_size=-{config.get('SQLITE_CACHE_SIZE_KB', DEFAULT_CACHE_SIZE_KB)}",
+        f'PRAGMA busy_timeout={busy_timeout}',
+    ]
+    if not writer:
+        # Ошибка маршрутизации не превратится в запись мимо единственного писателя
+        pragmas.append('PRAGMA query_only=ON')
+
+    def connect():
+        # Писатель начинает каждую транзакцию с BEGIN IMMEDIATE (см. _begin_immediate): если запись
+        # занята другим процессом, SQLite ждет busy_timeout в начале транзакции, а не падает посреди нее
+        if writer:
+            connection = sqlite3.connect(path, timeout=busy_timeout / 1000.0, check_same_thread=False,
+                                         isolation_level=None, factory=_WriterConnection)
+        else:
+            connection = sqlite3.connect(path, timeout=busy_timeout / 1000.0, check_same_thread=False)
+        for pragma in pragmas:
+            connection.execute(pragma)
+        return connection
+
+    return connect
+
+
+def configure_sqlite(app):
+    """
+    Включает производственный профиль SQLite (SQLITE_PROFILE=production).
+    Вызывается до db.init_app: основной движок Flask-SQLAlchemy становится
+    единственным соединением записи, а чтения идут через отдельный пул
+    """
+    if app.config.get('SQLITE_PROFILE', 'default') != 'production':
+        return False
+
+    path = _database_path(app, app.config['SQLALCHEMY_DATABASE_URI'])
+    config = app.config
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    # Пул из одного соединения сериализует запись внутри процесса: остальные потоки ждут
+    # его до SQLITE_WRITE_TIMEOUT секунд; между процессами запись упорядочивает сам SQLite
+    options.update(
+        creator=_connector(path, config, writer=True),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=config.get('SQLITE_WRITE_TIMEOUT', DEFAULT_WRITE_TIMEOUT),
+    )
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    app.extensions[READ_ENGINE] = sa.create_engine(
+        f'sqlite:///{path}',
+        creator=_connector(path, config, writer=False),
+        poolclass=InstrumentedQueuePool,
+        pool_size=config.get('SQLITE_READ_POOL_SIZE', DEFAULT_READ_POOL_SIZE),
+        max_overflow=0,
+    )
+    return True
@@ -0,0 +1,240 @@
+import mimetypes
+import os
+import shutil
+
+from flask import current_app
+from werkzeug.security import safe_join
+
+try:
+    import boto3
+except ImportError:  # boto3 нужен только для хранилища S3
+    boto3 = None
+
+
+# MIME типы версий в современных форматах (mimetypes знает их не во всех версиях Python)
+_EXTRA_MIMETYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+
+
+def content_type(key):
+    extension = key.rsplit('.', 1)[-1].lower()
+    if extension in _EXTRA_MIMETYPES:
+        return _EXTRA_MIMETYPES[extension]
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class LocalStorage:
+    """
+    Файлы в папке на локальном диске; ключ - относительный путь (ab/cd/<имя>)
+    """
+
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f'Invalid storage key: {key}')
+        return path
+
+    def put_file(self, key, source_path, content_type=None):
+        # Жесткая ссылка вместо копирования: временный файл лежит в той же папке
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            temp_path = f'{path}.tmp'
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+
+    def copy(self, source_key, key):
+        self.put_file(key, self.local_path(source_key))
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def download(self, key, target_path):
+        shutil.copyfile(self.local_path(key), target_path)
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.local_path(key))
+        except (OSError, ValueError):
+            return None
+
+    def exists(self, key):
+        return self.size(key) is not None
+
+    def delete(self, key):
+        """
+        Удаляет файл; возвращает число освобожденных байт
+        """
+        size = self.size(key)
+        if size is None:
+            return 0
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def url(self, key):
+        return f'/uploads/{key}'
+
+    def presigned_upload(self, key, content_type, size, expires):
+        # Прямая загрузка в обход Flask возможна только в объектное хранилище
+        return None
+
+
+class S3Storage:
+    """
+    Объектное хранилище с API S3 (AWS, MinIO, Ceph).
+    Клиент можно передать явно - например, заглушку в тестах
+    """
+
+    local = False
+
+    def __init__(self, bucket, client=None, prefix='', public_url=None, url_expires=3600,
+                 multipart_threshold=8 * 1024 * 1024, multipart_chunk_size=8 * 1024 * 1024,
+                 endpoint_url=None, region=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError('boto3 is required for MEDIA_STORAGE=s3')
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expires = url_expires
+        self.multipart_threshold = multipart_threshold
+        # Части меньше 5 МБ S3 не принимает (кроме последней)
+        self.multipart_chunk_size = max(multipart_chunk_size, 5 * 1024 * 1024)
+
+    def _key(self, key):
+        return f'{self.prefix}{key}'
+
+    def local_path(self, key):
+        return None
+
+    def put_file(self, key, source_path, content_type=None):
+        """
+        Загружает файл потоком: маленькие одним запросом, большие частями (multipart)
+        """
+        extra = {'ContentType': content_type} if content_type else {}
+        if os.path.getsize(source_path) <= self.multipart_threshold:
+            with open(source_path, 'rb') as source:
+                self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=source, **extra)
+            return
+
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=self._key(key), **extra
+        )['UploadId']
+        try:
+            parts = []
+            with open(source_path, 'rb') as source:
+                while True:
+                    chunk = source.read(self.multipart_chunk_size)
+                    if not chunk:
+                        break
+                    part_number = len(parts) + 1
+                    result = self.client.upload_part(
+                        Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                        PartNumber=part_number, Body=chunk,
+                    )
+                    parts.append({'ETag': result['ETag'], 'PartNumber': part_number})
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except Exception:
+            # Незавершенные части занимают место в бакете, пока их явно не отменить
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id)
+            raise
+
+    def copy(self, source_key, key):
+        # Копирование внутри хранилища, без передачи байт через Flask
+        self.client.copy_object(
+            Bucket=self.bucket, Key=self._key(key),
+            CopySource={'Bucket': self.bucket, 'Key': self._key(source_key)},
+        )
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+
+    def download(self, key, target_path):
+        body = self.open(key)
+        with open(target_path, 'wb') as target:
+            shutil.copyfileobj(body, target, 64 * 1024)
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))['ContentLength']
+        except Exception as e:
+            # botocore ClientError: отсутствие объекта - не ошибка
+            code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self.size(key) is not None
+
+    def delete(self, key):
+        size = self.size(key)
+        if size is None:
+            return 0
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return size
+
+    def url(self, key):
+        if self.public_url:
+            return f'{self.public_url}/{self._key(key)}'
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._key(key)}, ExpiresIn=self.url_expires,
+        )
+
+    def presigned_upload(self, key, content_type, size, expires):
+        """
+        Ссылка для загрузки файла клиентом напрямую в хранилище (PUT)
+        """
+        return self.client.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': self.bucket, 'Key': self._key(key),
+                    'ContentType': content_type, 'ContentLength': size},
+            ExpiresIn=expires,
+        )
+
+
+def create_storage(config):
+    backend = config.get('MEDIA_STORAGE', 'local')
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    if backend == 's3':
+        return S3Storage(
+            config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            public_url=config.get('S3_PUBLIC_URL'),
+            url_expires=config.get('S3_URL_EXPIRES', 3600),
+            multipart_threshold=config.get('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024),
+            multipart_chunk_size=config.get('S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+        )
+    raise ValueError(f'Unknown MEDIA_STORAGE: {backend}')
+
+
+def get_storage():
+    """
+    Хранилище медиафайлов текущего приложения; создается при первом обращении
+    """
+    storage = current_app.extensions.get('media_storage')
+    if storage is None:
+        storage = current_app.extensions['media_storage'] = create_storage(current_app.config)
+    return storage
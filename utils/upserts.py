@@ -0,0 +1,277 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models.models import db, User, Tweet, Like, Follow, TWEET_DELETED
+
+
+# Результаты операций над связями (лайки, подписки)
+CREATED = 'created'
+DELETED = 'deleted'
+EXISTS = 'exists'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+
+# Диалекты, поддерживающие INSERT ... ON CONFLICT DO NOTHING RETURNING
+_UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def insert_or_ignore(table, row, index_elements):
+    """
+    Вставляет строку, если нет конфликта по index_elements.
+    Возвращает True, если строка вставлена
+    """
+    insert = _UPSERT_INSERTS.get(_dialect_name())
+    if insert is not None:
+        stmt = insert(table).values(row).on_conflict_do_nothing(
+            index_elements=index_elements
+        ).returning(*[table.c[name] for name in index_elements])
+        return db.session.execute(stmt).first() is not None
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(sa.insert(table).values(row))
+    except IntegrityError:
+        return False
+    return True
+
+
+def insert_or_increment(table, row, index_elements, counter):
+    """
+    Вставляет строку или увеличивает счетчик counter у существующей.
+    Строки с отрицательным счетчиком помечены к удалению и не воскрешаются.
+    Возвращает True при успехе
+    """
+    column = table.c[counter]
+    insert = _UPSERT_INSERTS.get(_dialect_name())
+    if insert is not None:
+        stmt = insert(table).values(row).on_conflict_do_update(
+            index_elements=index_elements,
+            set_={counter: column + 1},
+            where=column >= 0
+        ).returning(column)
+        return db.session.execute(stmt).first() is not None
+
+    criteria = [table.c[name] == row[name] for name in index_elements]
+    result = db.session.execute(
+        sa.update(table).where(*criteria, column >= 0).values({counter: column + 1})
+    )
+    if result.rowcount:
+        return True
+    return insert_or_ignore(table, row, index_elements)
+
+
+def _live(parent):
+    # Удаленный твит (TWEETS_SOFT_DELETE) для связей уже не существует
+    if parent is Tweet:
+        return (parent.status != TWEET_DELETED,)
+    return ()
+
+
+def _parent_criteria(parent, parent_id):
+    return (parent.id == parent_id, *_live(parent))
+
+
+def _parent_exists(parent, parent_id):
+    return db.session.query(
+        sa.exists().where(*_parent_criteria(parent, parent_id))
+    ).scalar()
+
+
+def _insert_child(table, owner_column, owner_id, parent_column, parent, parent_id):
+    """
+    Вставляет строку связи одним запросом, если родитель существует.
+    Возвращает CREATED, EXISTS или NOT_FOUND
+    """
+    columns = [owner_column, parent_column, 'created_at']
+    insert = _UPSERT_INSERTS.get(_dialect_name())
+
+    if insert is not None:
+        # INSERT ... SELECT ... FROM parent WHERE id = :id ON CONFLICT DO NOTHING RETURNING id:
+        # отсутствие родителя и дубликат дают пустой результат без исключения
+        source = sa.select(
+            sa.literal(owner_id), parent.id, sa.literal(datetime.utcnow())
+        ).where(*_parent_criteria(parent, parent_id))
+        stmt = insert(table).from_select(columns, source).on_conflict_do_nothing(
+            index_elements=[owner_column, parent_column]
+        ).returning(table.c.id)
+
+        if db.session.execute(stmt).first() is not None:
+            return CREATED
+        # Второй запрос нужен только на редком пути ошибки
+        return EXISTS if _parent_exists(parent, parent_id) else NOT_FOUND
+
+    # Запасной вариант для остальных диалектов
+    if not _parent_exists(parent, parent_id):
+        return NOT_FOUND
+    try:
+        with db.session.begin_nested():
+            db.session.execute(sa.insert(table).values(
+                dict(zip(columns, (owner_id, parent_id, datetime.utcnow())))
+            ))
+    except IntegrityError:
+        return EXISTS
+    return CREATED
+
+
+def _delete_child(table, criteria, parent, parent_id):
+    """
+    Удаляет строку связи одним запросом.
+    Возвращает DELETED, ABSENT или NOT_FOUND
+    """
+    result = db.session.execute(sa.delete(table).where(*criteria))
+    if result.rowcount:
+        return DELETED
+    return ABSENT if _parent_exists(parent, parent_id) else NOT_FOUND
+
+
+def add_like(user_id, tweet_id):
+    """
+    Ставит лайк твиту
+    """
+    return _insert_child(Like.__table__, 'user_id', user_id, 'tweet_id', Tweet, tweet_id)
+
+
+def remove_like(user_id, tweet_id):
+    """
+    Убирает лайк с твита
+    """
+    table = Like.__table__
+    return _delete_child(
+        table, (table.c.user_id == user_id, table.c.tweet_id == tweet_id),
+        Tweet, tweet_id
+    )
+
+
+def add_follow(follower_id, following_id):
+    """
+    Подписывает пользователя на другого пользователя
+    """
+    return _insert_child(
+        Follow.__table__, 'follower_id', follower_id, 'following_id', User, following_id
+    )
+
+
+def remove_follow(follower_id, following_id):
+    """
+    Отписывает пользователя от другого пользователя
+    """
+    table = Follow.__table__
+    return _delete_child(
+        table,
+        (table.c.follower_id == follower_id, table.c.following_id == following_id),
+        User, following_id
+    )
+
+
+# Размер пачки для многострочных запросов: держимся ниже лимита параметров SQLite
+BULK_CHUNK_SIZE = 500
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bulk_insert_children(table, owner_column, parent_column, parent, pairs, chunk_size):
+    """
+    Вставляет пары (owner_id, parent_id) многострочными INSERT ... ON CONFLICT DO NOTHING.
+    Возвращает словарь {пара: CREATED | EXISTS | NOT_FOUND}
+    """
+    pairs = list(dict.fromkeys(pairs))
+    statuses = {}
+    insert = _UPSERT_INSERTS.get(_dialect_name())
+    now = datetime.utcnow()
+
+    for chunk in _chunks(pairs, chunk_size):
+        parent_ids = {parent_id for _, parent_id in chunk}
+        existing = {row[0] for row in db.session.query(parent.id).filter(
+            parent.id.in_(parent_ids), *_live(parent))}
+        rows = [
+            {owner_column: owner_id, parent_column: parent_id, 'created_at': now}
+            for owner_id, parent_id in chunk if parent_id in existing
+        ]
+
+        created = set()
+        if rows and insert is not None:
+            stmt = insert(table).values(rows).on_conflict_do_nothing(
+                index_elements=[owner_column, parent_column]
+            ).returning(table.c[owner_column], table.c[parent_column])
+            created = {tuple(row) for row in db.session.execute(stmt)}
+        elif rows:
+            for row in rows:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(sa.insert(table).values(row))
+                    created.add((row[owner_column], row[parent_column]))
+                except IntegrityError:
+                    pass
+
+        for pair in chunk:
+            if pair[1] not in existing:
+                statuses[pair] = NOT_FOUND
+            else:
+                statuses[pair] = CREATED if pair in created else EXISTS
+
+    return statuses
+
+
+def _bulk_delete_children(table, owner_column, parent_column, pairs, chunk_size):
+    """
+    Удаляет пары (owner_id, parent_id) запросами DELETE ... WHERE (a, b) IN (...).
+    Возвращает словарь {пара: DELETED | ABSENT}
+    """
+    pairs = list(dict.fromkeys(pairs))
+    statuses = {}
+    owner, parent = table.c[owner_column], table.c[parent_column]
+    returning = db.session.get_bind().dialect.delete_returning
+
+    for chunk in _chunks(pairs, chunk_size):
+        deleted = set()
+        if returning:
+            stmt = sa.delete(table).where(
+                sa.tuple_(owner, parent).in_(chunk)
+            ).returning(owner, parent)
+            deleted = {tuple(row) for row in db.session.execute(stmt)}
+        else:
+            for owner_id, parent_id in chunk:
+                result = db.session.execute(
+                    sa.delete(table).where(owner == owner_id, parent == parent_id)
+                )
+                if result.rowcount:
+                    deleted.add((owner_id, parent_id))
+
+        for pair in chunk:
+            statuses[pair] = DELETED if pair in deleted else ABSENT
+
+    return statuses
+
+
+def bulk_add_likes(pairs, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Ставит пачку лайков, pairs - последовательность (user_id, tweet_id)
+    """
+    return _bulk_insert_children(Like.__table__, 'user_id', 'tweet_id', Tweet, pairs, chunk_size)
+
+
+def bulk_remove_likes(pairs, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Убирает пачку лайков, pairs - последовательность (user_id, tweet_id)
+    """
+    return _bulk_delete_children(Like.__table__, 'user_id', 'tweet_id', pairs, chunk_size)
+
+
+def bulk_add_follows(pairs, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Создает пачку подписок, pairs - последовательность (follower_id, following_id)
+    """
+    return _bulk_insert_children(Follow.__table__, 'follower_id', 'following_id', User, pairs, chunk_size)
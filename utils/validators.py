@@ -13,4 +13,41 @@ def validate_tweet_data(tweet_data):
     if not tweet_data.strip():
         return False
     
-    return True
\ No newline at end of file
+    return True
+
+
+def is_id(value):
+    """
+    Проверяет, что значение - целочисленный ID (bool не считается числом)
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_id_list(value):
+    """
+    Проверяет, что значение - список целочисленных ID
+    """
+    return isinstance(value, list) and all(is_id(item) for item in value)
+
+
+def validate_tweet_payload(tweet_data, tweet_media_ids, max_media):
+    """
+    Валидирует текст и вложения твита, возвращает текст ошибки или None
+    """
+    # Отсутствующий текст вызывающий передает как '', null в запросе - ошибка
+    if not isinstance(tweet_data, str):
+        return "tweet_data must be a string"
+
+    if not tweet_data and not tweet_media_ids:
+        return "Either tweet text or media is required"
+
+    if len(tweet_data) > 280:
+        return "Tweet text too long (max 280 characters)"
+
+    if not is_id_list(tweet_media_ids):
+        return "tweet_media_ids must be a list of integers"
+
+    if len(tweet_media_ids) > max_media:
+        return f"Too many attachments (max {max_media})"
+
+    return None